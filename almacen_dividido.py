@@ -0,0 +1,455 @@
+import base64
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cache_estructura import cargar_estructura, guardar_estructura
+from paginacion import CursorInvalido
+from registro_cambios import SINCRONIZAR
+
+# Sufijo del directorio que identifica una estructura dividida en lugar de estructura.json
+EXTENSION_DIVIDIDA = '.dividida'
+
+# Archivo con la raíz y los directorios de primer nivel, y prefijo de la carpeta
+# con sus subárboles (la cabecera guarda cuál es; sin esa clave es 'subarboles')
+CABECERA = 'cabecera.json'
+SUBARBOLES = 'subarboles'
+
+# Subárboles que se mantienen cargados a la vez; los menos usados se descartan
+MAX_SUBARBOLES_RESIDENTES = int(os.environ.get("MCP_SUBARBOLES_RESIDENTES", "8"))
+
+# Claves de los directorios de primer nivel en la cabecera que no son del nodo original
+_CLAVES_RESUMEN = ('subarbol', 'hijos', 'nombres', 'por_profundidad')
+
+
+def es_ruta_dividida(ruta: Optional[str]) -> bool:
+    """Indica si la ruta apunta a una estructura dividida por su sufijo."""
+    return bool(ruta) and ruta.rstrip(os.sep).lower().endswith(EXTENSION_DIVIDIDA)
+
+
+def _escribir_json(ruta: str, datos: Dict):
+    """Escribe un JSON en un temporal y lo renombra encima, para no dejar nunca un archivo a medias."""
+    temporal = f"{ruta}.tmp"
+    try:
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False, indent=4)
+            f.flush()
+            if SINCRONIZAR:
+                os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def _directorios(nodo: Dict, profundidad: int = 0, max_depth: Optional[int] = None) -> Iterator[Tuple[Dict, int]]:
+    """Directorios de un subárbol en memoria, en preorden, con su profundidad."""
+    pila = [(nodo, profundidad)]
+    while pila:
+        actual, nivel = pila.pop()
+        if actual.get('type') != 'directory':
+            continue
+        yield actual, nivel
+        if max_depth is None or nivel < max_depth:
+            pila.extend((hijo, nivel + 1) for hijo in reversed(actual.get('children', [])))
+
+
+def dividir(estructura: Dict, directorio: str) -> int:
+    """
+    Escribe una estructura anidada con el formato dividido: cada directorio de
+    primer nivel va a su propio archivo en una carpeta subarboles-* y la cabecera guarda la
+    raíz, los archivos de primer nivel y un resumen de cada subárbol (nombre,
+    descripción, número de hijos, nombres de sus directorios y directorios por
+    profundidad), suficiente para listar y localizar sin cargarlos.
+    Reemplaza lo que hubiera en el directorio: los subárboles se escriben en una
+    carpeta nueva y la cabecera que apunta a ella se cambia con os.replace, así
+    que quien lee (o un corte a medias) ve la versión anterior completa o la
+    nueva; después se borran las carpetas anteriores.
+
+    Returns:
+        int: Número de subárboles escritos
+    """
+    os.makedirs(directorio, exist_ok=True)
+    carpeta = os.path.join(directorio, f"{SUBARBOLES}-{os.getpid()}-{time.time_ns()}")
+    os.makedirs(carpeta)
+    try:
+        subarboles = _escribir_subarboles(estructura, carpeta)
+    except BaseException:
+        shutil.rmtree(carpeta, ignore_errors=True)
+        raise
+    # Restos de versiones anteriores o de divisiones interrumpidas
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        if nombre.startswith(SUBARBOLES) and ruta != carpeta and os.path.isdir(ruta):
+            shutil.rmtree(ruta, ignore_errors=True)
+    return subarboles
+
+
+def _escribir_subarboles(estructura: Dict, carpeta: str) -> int:
+    """Escribe los subárboles de dividir() en 'carpeta' y, por último, la cabecera que apunta a ella."""
+    raiz = {clave: valor for clave, valor in estructura.items() if clave != 'children'}
+    raiz['children'] = []
+    subarboles = 0
+    for hijo in estructura.get('children', []):
+        if hijo.get('type') != 'directory':
+            raiz['children'].append(hijo)
+            continue
+        archivo = f"{subarboles:06d}.json"
+        por_profundidad: List[int] = []
+        nombres = set()
+        for nodo, nivel in _directorios(hijo):
+            if nivel == len(por_profundidad):
+                por_profundidad.append(0)
+            por_profundidad[nivel] += 1
+            nombres.add(nodo.get('name'))
+        resumen = {clave: valor for clave, valor in hijo.items() if clave != 'children'}
+        resumen.update(
+            subarbol=archivo,
+            hijos=len(hijo.get('children', [])),
+            nombres=sorted(nombre for nombre in nombres if nombre is not None),
+            por_profundidad=por_profundidad
+        )
+        raiz['children'].append(resumen)
+        # La descripción del primer nivel vive solo en la cabecera
+        _escribir_json(
+            os.path.join(carpeta, archivo),
+            {clave: valor for clave, valor in hijo.items() if clave != 'description'}
+        )
+        subarboles += 1
+
+    directorio = os.path.dirname(carpeta)
+    _escribir_json(
+        os.path.join(directorio, CABECERA),
+        {'version': 1, 'subarboles': os.path.basename(carpeta), 'raiz': raiz}
+    )
+    return subarboles
+
+
+class EstructuraDividida:
+    """
+    Estructura de directorios dividida en disco (ver dividir). La cabecera se
+    lee al abrirla; cada subárbol de primer nivel se lee la primera vez que una
+    operación baja a él y se queda en una caché LRU de MAX_SUBARBOLES_RESIDENTES
+    entradas, de forma que memoria y tiempo de respuesta dependen de lo que toca
+    cada consulta y no del tamaño del árbol. Si un archivo cambia en disco se
+    vuelve a leer.
+    """
+
+    def __init__(self, directorio: str, max_residentes: int = MAX_SUBARBOLES_RESIDENTES):
+        self.directorio = directorio
+        self.max_residentes = max(1, max_residentes)
+        self._lock = threading.RLock()
+        self._cabecera: Optional[Dict] = None
+        self._firma_cabecera: Optional[Tuple[int, int]] = None
+        # archivo -> (firma, subárbol)
+        self._subarboles: 'OrderedDict[str, Tuple[Tuple[int, int], Dict]]' = OrderedDict()
+        self.cargas = 0
+
+    @staticmethod
+    def _firma(ruta: str) -> Tuple[int, int]:
+        stat = os.stat(ruta)
+        return stat.st_mtime_ns, stat.st_size
+
+    def cabecera(self) -> Dict:
+        ruta = os.path.join(self.directorio, CABECERA)
+        with self._lock:
+            firma = self._firma(ruta)
+            if self._cabecera is None or firma != self._firma_cabecera:
+                with open(ruta, 'r', encoding='utf-8') as f:
+                    self._cabecera = json.load(f)
+                self._firma_cabecera = firma
+            return self._cabecera
+
+    @property
+    def raiz(self) -> Dict:
+        return self.cabecera()['raiz']
+
+    def _archivo(self, resumen: Dict) -> str:
+        """Ruta de un subárbol relativa al directorio, dentro de la carpeta que indica la cabecera."""
+        return os.path.join(self.cabecera().get('subarboles', SUBARBOLES), resumen['subarbol'])
+
+    def primer_nivel(self) -> List[Dict]:
+        """Resúmenes de los directorios de primer nivel, en orden."""
+        return [hijo for hijo in self.raiz.get('children', []) if 'subarbol' in hijo]
+
+    def subarbol(self, resumen: Dict) -> Dict:
+        """Subárbol completo de un directorio de primer nivel, leyéndolo si no está en la caché."""
+        with self._lock:
+            archivo = self._archivo(resumen)
+            ruta = os.path.join(self.directorio, archivo)
+            firma = self._firma(ruta)
+            entrada = self._subarboles.get(archivo)
+            if entrada is not None and entrada[0] == firma:
+                self._subarboles.move_to_end(archivo)
+                return entrada[1]
+            with open(ruta, 'r', encoding='utf-8') as f:
+                nodo = json.load(f)
+            self.cargas += 1
+            self._subarboles[archivo] = (firma, nodo)
+            while len(self._subarboles) > self.max_residentes:
+                self._subarboles.popitem(last=False)
+            return nodo
+
+    def residentes(self) -> int:
+        return len(self._subarboles)
+
+    def _resumen_de(self, full_path: str) -> Optional[Dict]:
+        """Directorio de primer nivel que contiene full_path (o es él)."""
+        for resumen in self.primer_nivel():
+            base = resumen.get('full_path', '')
+            if base and (full_path == base or full_path.startswith(base.rstrip(os.sep) + os.sep)):
+                return resumen
+        return None
+
+    def nodo(self, full_path: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """
+        Localiza un nodo por full_path cargando como mucho su subárbol.
+
+        Returns:
+            Tuple: (nodo, resumen de primer nivel que lo contiene). Para la raíz y
+                los directorios de primer nivel el nodo es el de la cabecera y el
+                resumen None; (None, None) si no existe
+        """
+        raiz = self.raiz
+        if full_path == raiz.get('full_path'):
+            return raiz, None
+        resumen = self._resumen_de(full_path)
+        if resumen is None:
+            return None, None
+        if full_path == resumen.get('full_path'):
+            return resumen, None
+        nodo = self._localizar(self.subarbol(resumen), resumen['full_path'], full_path)
+        return (nodo, resumen) if nodo is not None else (None, None)
+
+    def por_nombre(self, nombre: str, todos: bool = True) -> List[Tuple[Dict, Optional[Dict]]]:
+        """
+        Directorios con ese nombre en preorden, como pares (nodo, resumen) de nodo().
+        Solo se cargan los subárboles cuya lista de nombres lo incluye; con
+        todos=False se para en el primero.
+        """
+        encontrados = []
+        raiz = self.raiz
+        if raiz.get('name') == nombre:
+            encontrados.append((raiz, None))
+        for resumen in self.primer_nivel():
+            if encontrados and not todos:
+                break
+            if resumen.get('name') == nombre:
+                encontrados.append((resumen, None))
+            if nombre not in resumen.get('nombres', ()):
+                continue
+            subarbol = self.subarbol(resumen)
+            for nodo, nivel in _directorios(subarbol):
+                if nivel and nodo.get('name') == nombre:
+                    encontrados.append((nodo, resumen))
+        return encontrados if todos else encontrados[:1]
+
+    @staticmethod
+    def _localizar(nodo: Dict, base: str, full_path: str) -> Optional[Dict]:
+        if full_path == base:
+            return nodo
+        for parte in os.path.relpath(full_path, base).split(os.sep):
+            nodo = next((h for h in nodo.get('children', []) if h.get('name') == parte), None)
+            if nodo is None:
+                return None
+        return nodo
+
+    def fijar_descripciones(self, cambios: List[Tuple[Dict, Optional[Dict], str]]):
+        """
+        Aplica descripciones a nodos obtenidos con nodo() o por_nombre() y
+        reescribe solo la cabecera y/o los subárboles afectados. Cada nodo se
+        vuelve a buscar por full_path en lo que se escribe, por si su subárbol
+        salió de la caché entre medias.
+        """
+        with self._lock:
+            raiz = self.raiz
+            cabecera = False
+            por_subarbol: Dict[str, Tuple[Dict, List[Tuple[Dict, str]]]] = {}
+            for nodo, resumen, descripcion in cambios:
+                if resumen is None:
+                    destino = self._localizar(raiz, raiz.get('full_path', ''), nodo['full_path']) if nodo.get('full_path') else None
+                    (destino or nodo)['description'] = descripcion
+                    cabecera = True
+                else:
+                    por_subarbol.setdefault(self._archivo(resumen), (resumen, []))[1].append((nodo, descripcion))
+            for archivo, (resumen, nodos) in por_subarbol.items():
+                subarbol = self.subarbol(resumen)
+                for nodo, descripcion in nodos:
+                    destino = self._localizar(subarbol, resumen['full_path'], nodo['full_path']) if nodo.get('full_path') else None
+                    (destino or nodo)['description'] = descripcion
+                ruta = os.path.join(self.directorio, archivo)
+                _escribir_json(ruta, subarbol)
+                self._subarboles[archivo] = (self._firma(ruta), subarbol)
+            if cabecera:
+                ruta = os.path.join(self.directorio, CABECERA)
+                _escribir_json(ruta, self._cabecera)
+                self._firma_cabecera = self._firma(ruta)
+
+    def _visibles(self, resumen: Dict, max_depth: Optional[int]) -> int:
+        """Directorios de un subárbol de primer nivel a max_depth niveles o menos de él."""
+        por_profundidad = resumen.get('por_profundidad', [1])
+        return sum(por_profundidad if max_depth is None else por_profundidad[:max_depth + 1])
+
+    def directorios(
+        self,
+        subtree: Optional[str] = None,
+        max_depth: Optional[int] = None,
+        saltar: int = 0
+    ) -> Iterator[Tuple[Dict, int]]:
+        """
+        Directorios en preorden con su profundidad relativa, como IndicePreorden.
+        Los subárboles de primer nivel que quedan enteros antes de 'saltar' o por
+        debajo de max_depth no se cargan.
+
+        Raises:
+            KeyError: Si subtree no está en la estructura
+        """
+        raiz = self.raiz
+        if subtree and subtree != raiz.get('full_path'):
+            nodo, resumen = self.nodo(subtree)
+            if nodo is None or nodo.get('type') != 'directory':
+                raise KeyError(subtree)
+            if resumen is not None:
+                iterador = _directorios(nodo, 0, max_depth)
+                for _ in range(saltar):
+                    next(iterador, None)
+                yield from iterador
+                return
+            resumenes, base = [nodo], 0
+        else:
+            if saltar:
+                saltar -= 1
+            else:
+                yield raiz, 0
+            if max_depth == 0:
+                return
+            resumenes, base = self.primer_nivel(), 1
+
+        for resumen in resumenes:
+            restante = None if max_depth is None else max_depth - base
+            visibles = self._visibles(resumen, restante)
+            if saltar >= visibles:
+                saltar -= visibles
+                continue
+            if saltar:
+                saltar -= 1
+            else:
+                yield resumen, base
+            if restante == 0:
+                continue
+            iterador = (
+                par
+                for hijo in self.subarbol(resumen).get('children', [])
+                for par in _directorios(hijo, base + 1, max_depth)
+            )
+            for _ in range(saltar):
+                next(iterador, None)
+            saltar = 0
+            yield from iterador
+
+    def _version(self) -> int:
+        """Cambia cada vez que se reescribe la cabecera (y con ella la forma del árbol)."""
+        self.cabecera()
+        return self._firma_cabecera[0]
+
+    def pagina(
+        self,
+        subtree: Optional[str] = None,
+        max_depth: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Tuple[Dict, int]], Optional[str]]:
+        """
+        Página de directorios en preorden; mismos argumentos y resultado que
+        IndicePreorden.pagina. El cursor guarda cuántos directorios se llevan,
+        así que en la página siguiente los subárboles ya listados enteros se
+        saltan sin cargarlos.
+        """
+        saltar = 0
+        if cursor:
+            try:
+                version, saltar, profundidad, subtree = (
+                    base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 3)
+                )
+                version, saltar = int(version), int(saltar)
+                max_depth = int(profundidad) if profundidad else None
+            except Exception:
+                raise CursorInvalido("Cursor mal formado")
+            if version != self._version():
+                raise CursorInvalido("La estructura ha cambiado desde la página anterior; vuelve a pedir la primera")
+
+        resultado = []
+        for par in self.directorios(subtree or None, max_depth, saltar):
+            if limit is not None and len(resultado) >= limit:
+                texto = '|'.join([
+                    str(self._version()), str(saltar + len(resultado)),
+                    '' if max_depth is None else str(max_depth), subtree or ''
+                ])
+                return resultado, base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii')
+            resultado.append(par)
+        return resultado, None
+
+    def unir(self) -> Dict:
+        """Estructura anidada completa (carga todos los subárboles, sin quedarse con ellos)."""
+        raiz = self.raiz
+        estructura = {clave: valor for clave, valor in raiz.items() if clave != 'children'}
+        estructura['children'] = []
+        for hijo in raiz.get('children', []):
+            if 'subarbol' not in hijo:
+                estructura['children'].append(hijo)
+                continue
+            with open(os.path.join(self.directorio, self._archivo(hijo)), 'r', encoding='utf-8') as f:
+                nodo = json.load(f)
+            completo = {clave: valor for clave, valor in hijo.items() if clave not in _CLAVES_RESUMEN}
+            completo.update((clave, valor) for clave, valor in nodo.items() if clave not in completo)
+            estructura['children'].append(completo)
+        return estructura
+
+
+_ABIERTAS: Dict[str, EstructuraDividida] = {}
+_LOCK = threading.Lock()
+
+
+def abrir(directorio: str) -> EstructuraDividida:
+    """Estructura dividida de un directorio, compartida entre llamadas para conservar su caché."""
+    clave = os.path.abspath(directorio)
+    if not os.path.exists(os.path.join(clave, CABECERA)):
+        raise FileNotFoundError(f"No existe {os.path.join(clave, CABECERA)}")
+    with _LOCK:
+        if clave not in _ABIERTAS:
+            _ABIERTAS[clave] = EstructuraDividida(clave)
+        return _ABIERTAS[clave]
+
+
+def dividir_json(ruta_json: str, directorio: str) -> Dict:
+    """
+    Convierte un estructura.json existente al formato dividido (se reemplaza lo que hubiera).
+
+    Returns:
+        dict: Resultado de la operación (éxito o error)
+    """
+    try:
+        estructura = cargar_estructura(ruta_json)
+        total = dividir(estructura, directorio)
+        return {"success": f"Estructura dividida en {total} subárboles en {directorio}", "subarboles": total}
+    except Exception as e:
+        return {"error": f"No se pudo dividir el JSON: {str(e)}"}
+
+
+def unir_json(directorio: str, ruta_json: str) -> Dict:
+    """
+    Reúne una estructura dividida en un único estructura.json.
+
+    Returns:
+        dict: Resultado de la operación (éxito o error)
+    """
+    try:
+        guardar_estructura(ruta_json, abrir(directorio).unir())
+        return {"success": f"Estructura exportada a {ruta_json}"}
+    except Exception as e:
+        return {"error": f"No se pudo unir la estructura: {str(e)}"}
@@ -0,0 +1,221 @@
+import base64
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_estructura import invalidar
+from ejecutor import comprobar_cancelacion
+from paginacion import CursorInvalido, indice_preorden
+from registro_cambios import ruta_registro
+
+# Archivo con la lista de fragmentos dentro del directorio del almacén
+MANIFIESTO = 'manifiesto.json'
+
+# Fragmentos consultados a la vez en las búsquedas repartidas
+MAX_HILOS_FRAGMENTOS = 8
+
+_LOCK = threading.Lock()
+
+
+def ruta_manifiesto(directorio: str) -> str:
+    return os.path.join(directorio, MANIFIESTO)
+
+
+def es_almacen_fragmentos(ruta: Optional[str]) -> bool:
+    """True si la ruta es el directorio de un almacén por fragmentos (tiene manifiesto)."""
+    return bool(ruta) and os.path.isdir(ruta) and os.path.exists(ruta_manifiesto(ruta))
+
+
+def leer_manifiesto(directorio: str) -> Dict:
+    """
+    Manifiesto del almacén: {"version": int, "fragmentos": [{"nombre", "raiz",
+    "archivo", "actualizado", "entradas"}]}, con los fragmentos ordenados por
+    raíz. Un almacén sin manifiesto está vacío.
+    """
+    try:
+        with open(ruta_manifiesto(directorio), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': 0, 'fragmentos': []}
+
+
+def _escribir_manifiesto(directorio: str, manifiesto: Dict):
+    os.makedirs(directorio, exist_ok=True)
+    destino = ruta_manifiesto(directorio)
+    temporal = f"{destino}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=4)
+    os.replace(temporal, destino)
+
+
+def nombre_fragmento(ruta_raiz: str) -> str:
+    """Nombre estable del fragmento de una raíz: su nombre más un resumen de la ruta absoluta."""
+    ruta_raiz = os.path.abspath(ruta_raiz)
+    base = re.sub(r'[^\w.-]+', '_', os.path.basename(ruta_raiz)) or 'raiz'
+    return f"{base}-{hashlib.sha1(ruta_raiz.encode('utf-8')).hexdigest()[:8]}"
+
+
+def ruta_fragmento(directorio: str, ruta_raiz: str) -> str:
+    """Archivo JSON de estructura donde se guarda el rastreo de ruta_raiz."""
+    return os.path.join(directorio, nombre_fragmento(ruta_raiz) + '.json')
+
+
+def registrar_fragmento(directorio: str, ruta_raiz: str, entradas: int = 0) -> Dict:
+    """
+    Da de alta (o actualiza) en el manifiesto el fragmento de ruta_raiz, cuyo
+    archivo ya debe estar escrito. Los demás fragmentos no se tocan.
+
+    Returns:
+        dict: Entrada del fragmento en el manifiesto
+    """
+    ruta_raiz = os.path.abspath(ruta_raiz)
+    entrada = {
+        'nombre': nombre_fragmento(ruta_raiz),
+        'raiz': ruta_raiz,
+        'archivo': nombre_fragmento(ruta_raiz) + '.json',
+        'actualizado': datetime.now().isoformat(),
+        'entradas': entradas
+    }
+    with _LOCK:
+        manifiesto = leer_manifiesto(directorio)
+        fragmentos = [f for f in manifiesto['fragmentos'] if f['raiz'] != ruta_raiz]
+        fragmentos.append(entrada)
+        fragmentos.sort(key=lambda f: f['raiz'])
+        _escribir_manifiesto(directorio, {'version': manifiesto['version'] + 1, 'fragmentos': fragmentos})
+    return entrada
+
+
+def quitar_fragmento(directorio: str, ruta_raiz: str) -> bool:
+    """Quita del manifiesto el fragmento de ruta_raiz y borra su archivo y su registro. False si no existía."""
+    ruta_raiz = os.path.abspath(ruta_raiz)
+    with _LOCK:
+        manifiesto = leer_manifiesto(directorio)
+        fragmentos = [f for f in manifiesto['fragmentos'] if f['raiz'] != ruta_raiz]
+        if len(fragmentos) == len(manifiesto['fragmentos']):
+            return False
+        _escribir_manifiesto(directorio, {'version': manifiesto['version'] + 1, 'fragmentos': fragmentos})
+    ruta_json = ruta_fragmento(directorio, ruta_raiz)
+    for ruta in (ruta_json, ruta_registro(ruta_json)):
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+    invalidar(ruta_json)
+    return True
+
+
+def fragmento_de(fragmentos: List[Dict], full_path: str) -> Optional[int]:
+    """Posición del fragmento cuya raíz contiene full_path (la más profunda si hay varias)."""
+    mejor = None
+    for posicion, fragmento in enumerate(fragmentos):
+        raiz = fragmento['raiz']
+        if full_path == raiz or full_path.startswith(raiz.rstrip(os.sep) + os.sep):
+            if mejor is None or len(raiz) > len(fragmentos[mejor]['raiz']):
+                mejor = posicion
+    return mejor
+
+
+def en_paralelo(
+    directorio: str,
+    funcion: Callable[[str], Any],
+    max_hilos: Optional[int] = None
+) -> List[Tuple[Dict, Any]]:
+    """
+    Aplica funcion(ruta_json) a cada fragmento del almacén en un pool de hilos.
+    Cada fragmento se carga (si no estaba ya en caché) dentro de su propia tarea.
+
+    Returns:
+        list: Pares (entrada del manifiesto, resultado), en el orden del manifiesto
+
+    Raises:
+        La primera excepción de funcion, o ejecutor.Cancelado si la llamada se canceló
+    """
+    fragmentos = leer_manifiesto(directorio)['fragmentos']
+    rutas = [os.path.join(directorio, fragmento['archivo']) for fragmento in fragmentos]
+    if len(rutas) <= 1:
+        resultados = [funcion(ruta) for ruta in rutas]
+    else:
+        with ThreadPoolExecutor(max_workers=max_hilos or MAX_HILOS_FRAGMENTOS, thread_name_prefix='fragmentos') as pool:
+            futuros = [pool.submit(contextvars.copy_context().run, funcion, ruta) for ruta in rutas]
+            resultados = [futuro.result() for futuro in futuros]
+    comprobar_cancelacion()
+    return list(zip(fragmentos, resultados))
+
+
+def _codificar_cursor(version: int, posicion: int, ultimo: int, max_depth: Optional[int], interno: Optional[str]) -> str:
+    texto = '|'.join(['' if campo is None else str(campo) for campo in (version, posicion, ultimo, max_depth, interno)])
+    return base64.urlsafe_b64encode(texto.encode('ascii')).decode('ascii')
+
+
+def _decodificar_cursor(cursor: str) -> Tuple[int, int, int, Optional[int], Optional[str]]:
+    try:
+        version, posicion, ultimo, max_depth, interno = (
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        )
+        return int(version), int(posicion), int(ultimo), int(max_depth) if max_depth else None, interno or None
+    except Exception:
+        raise CursorInvalido("Cursor mal formado")
+
+
+def pagina(
+    directorio: str,
+    subtree: Optional[str] = None,
+    max_depth: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    solo_directorios: bool = True
+) -> Tuple[List[Tuple[Dict, int]], Optional[str]]:
+    """
+    Página del recorrido en preorden de todo el almacén: los fragmentos van uno
+    detrás de otro en el orden del manifiesto, cada uno con su raíz a
+    profundidad 0. Con subtree solo se recorre el fragmento que lo contiene.
+    Solo se cargan los fragmentos que llegan a entrar en la página; sin limit se
+    cargan todos a la vez (ver en_paralelo).
+
+    Mismos argumentos y resultado que IndicePreorden.pagina.
+
+    Raises:
+        KeyError: Si subtree no está en ningún fragmento
+        CursorInvalido: Si el cursor no corresponde a la versión actual del manifiesto
+    """
+    manifiesto = leer_manifiesto(directorio)
+    fragmentos = manifiesto['fragmentos']
+    interno = None
+    if cursor:
+        version, posicion, ultimo, max_depth, interno = _decodificar_cursor(cursor)
+        if version != manifiesto['version']:
+            raise CursorInvalido("El almacén ha cambiado desde la página anterior; vuelve a pedir la primera")
+    elif subtree:
+        posicion = fragmento_de(fragmentos, subtree)
+        if posicion is None:
+            raise KeyError(subtree)
+        ultimo = posicion
+    elif limit is None:
+        paginas = en_paralelo(
+            directorio,
+            lambda ruta_json: indice_preorden(ruta_json, solo_directorios).pagina(max_depth=max_depth)[0]
+        )
+        return [par for _, nodos in paginas for par in nodos], None
+    else:
+        posicion, ultimo = 0, len(fragmentos) - 1
+
+    resultado: List[Tuple[Dict, int]] = []
+    while posicion <= ultimo and posicion < len(fragmentos) and (limit is None or len(resultado) < limit):
+        ruta_json = os.path.join(directorio, fragmentos[posicion]['archivo'])
+        restante = None if limit is None else limit - len(resultado)
+        nodos, interno = indice_preorden(ruta_json, solo_directorios).pagina(
+            None if cursor else subtree, max_depth, restante, interno
+        )
+        resultado.extend(nodos)
+        if interno is None:
+            posicion += 1
+
+    if posicion <= ultimo and posicion < len(fragmentos):
+        return resultado, _codificar_cursor(manifiesto['version'], posicion, ultimo, max_depth, interno)
+    return resultado, None
@@ -0,0 +1,329 @@
+import json
+import os
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from cache_estructura import cargar_estructura, guardar_estructura
+from paginacion import codificar_cursor, decodificar_cursor
+
+# Extensiones que identifican un almacén SQLite en lugar de estructura.json
+EXTENSIONES_SQLITE = ('.db', '.sqlite', '.sqlite3')
+
+# Claves con columna propia; el resto del nodo se guarda como JSON en 'extra'
+CLAVES_COLUMNA = ('name', 'type', 'description', 'children', 'full_path')
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS nodos (
+    id INTEGER PRIMARY KEY,
+    padre INTEGER REFERENCES nodos(id),
+    posicion INTEGER NOT NULL DEFAULT 0,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    description TEXT,
+    full_path TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_nodos_padre ON nodos(padre, posicion);
+CREATE INDEX IF NOT EXISTS idx_nodos_name ON nodos(name);
+CREATE INDEX IF NOT EXISTS idx_nodos_full_path ON nodos(full_path);
+CREATE INDEX IF NOT EXISTS idx_nodos_type ON nodos(type);
+"""
+
+
+def es_ruta_sqlite(ruta: Optional[str]) -> bool:
+    """Indica si la ruta apunta a un almacén SQLite por su extensión."""
+    return bool(ruta) and ruta.lower().endswith(EXTENSIONES_SQLITE)
+
+
+class AlmacenSQLite:
+    """
+    Almacén de la estructura de directorios en SQLite: un nodo por fila en la tabla
+    'nodos', enlazado a su padre. Los ids se asignan en preorden, de modo que
+    ORDER BY id reproduce el orden del recorrido en profundidad del JSON.
+
+    Uso:
+        with AlmacenSQLite(ruta_db) as almacen:
+            almacen.directorios()
+    """
+
+    def __init__(self, ruta_db: str):
+        self.ruta_db = ruta_db
+        directorio = os.path.dirname(ruta_db)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.conexion = sqlite3.connect(ruta_db)
+        self.conexion.row_factory = sqlite3.Row
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.executescript(ESQUEMA)
+
+    def __enter__(self) -> 'AlmacenSQLite':
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        self.conexion.close()
+
+    def vacio(self) -> bool:
+        return self.conexion.execute("SELECT 1 FROM nodos LIMIT 1").fetchone() is None
+
+    def importar(self, estructura: Dict) -> int:
+        """
+        Reemplaza el contenido del almacén por la estructura anidada dada.
+
+        Returns:
+            int: Número de nodos insertados
+        """
+        def filas() -> Iterator[tuple]:
+            siguiente_id = 0
+            pila = [(estructura, None, 0)]
+            while pila:
+                nodo, padre, posicion = pila.pop()
+                siguiente_id += 1
+                nodo_id = siguiente_id
+                extra = {k: v for k, v in nodo.items() if k not in CLAVES_COLUMNA}
+                yield (
+                    nodo_id, padre, posicion,
+                    nodo.get('name', ''), nodo.get('type', ''),
+                    nodo.get('description'), nodo.get('full_path'),
+                    json.dumps(extra, ensure_ascii=False) if extra else None
+                )
+                hijos = nodo.get('children', [])
+                for i in range(len(hijos) - 1, -1, -1):
+                    pila.append((hijos[i], nodo_id, i))
+
+        with self.conexion:
+            self.conexion.execute("DELETE FROM nodos")
+            cursor = self.conexion.executemany(
+                "INSERT INTO nodos (id, padre, posicion, name, type, description, full_path, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                filas()
+            )
+        return cursor.rowcount
+
+    def _fila_a_nodo(self, fila: sqlite3.Row) -> Dict:
+        nodo = {'name': fila['name'], 'type': fila['type']}
+        if fila['description'] is not None:
+            nodo['description'] = fila['description']
+        if fila['type'] == 'directory':
+            nodo['children'] = []
+        if fila['full_path'] is not None:
+            nodo['full_path'] = fila['full_path']
+        if fila['extra']:
+            nodo.update(json.loads(fila['extra']))
+        return nodo
+
+    def exportar(self) -> Dict:
+        """Reconstruye la estructura anidada con el mismo formato que estructura.json."""
+        nodos = {}
+        raiz = None
+        for fila in self.conexion.execute("SELECT * FROM nodos ORDER BY padre, posicion"):
+            nodo = self._fila_a_nodo(fila)
+            nodos[fila['id']] = (nodo, fila['padre'])
+            if fila['padre'] is None:
+                raiz = nodo
+        for nodo, padre in nodos.values():
+            if padre is not None:
+                nodos[padre][0].setdefault('children', []).append(nodo)
+        return raiz or {}
+
+    def directorios(self) -> List[Dict]:
+        """
+        Devuelve nombre, descripción y full_path de cada directorio en preorden,
+        leyendo solo las filas de tipo directorio.
+        """
+        return [
+            {
+                'name': fila['name'],
+                'descripcion': fila['description'] or '',
+                'full_path': fila['full_path'] or ''
+            }
+            for fila in self.conexion.execute(
+                "SELECT name, description, full_path FROM nodos "
+                "WHERE type = 'directory' ORDER BY id"
+            )
+        ]
+
+    def _fin_subarbol(self, nodo_id: int) -> int:
+        """
+        Primer id posterior al subárbol de un nodo: el del siguiente hermano del
+        nodo o, si no lo tiene, el del siguiente hermano del ancestro más cercano.
+        """
+        actual = nodo_id
+        while True:
+            fila = self.conexion.execute("SELECT padre, posicion FROM nodos WHERE id = ?", (actual,)).fetchone()
+            if fila is None or fila['padre'] is None:
+                return self.conexion.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM nodos").fetchone()[0]
+            siguiente = self.conexion.execute(
+                "SELECT MIN(id) FROM nodos WHERE padre = ? AND posicion > ?", (fila['padre'], fila['posicion'])
+            ).fetchone()[0]
+            if siguiente is not None:
+                return siguiente
+            actual = fila['padre']
+
+    def pagina_directorios(
+        self,
+        subtree: Optional[str] = None,
+        max_depth: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Página de directorios en preorden, igual que directorios() pero acotada.
+        Sin max_depth, el subárbol es un rango de ids y cada página es una consulta
+        por clave primaria; con max_depth se recorre el subárbol por niveles.
+
+        Returns:
+            Tuple[list, Optional[str]]: Directorios (name, descripcion, full_path,
+                profundidad) y cursor de la página siguiente (None si no hay más)
+
+        Raises:
+            KeyError: Si subtree no es un directorio del almacén
+            CursorInvalido: Si el cursor está mal formado
+        """
+        if cursor:
+            ultimo_id, raiz_id, fin_id, max_depth = decodificar_cursor(cursor, 4)
+        else:
+            if subtree:
+                fila = self.conexion.execute(
+                    "SELECT id FROM nodos WHERE full_path = ? AND type = 'directory' ORDER BY id LIMIT 1", (subtree,)
+                ).fetchone()
+            else:
+                fila = self.conexion.execute("SELECT id FROM nodos WHERE padre IS NULL").fetchone()
+            if fila is None:
+                if subtree:
+                    raise KeyError(subtree)
+                return [], None
+            raiz_id = fila['id']
+            ultimo_id = raiz_id - 1
+            fin_id = self._fin_subarbol(raiz_id)
+
+        # Se pide uno más para saber si hay página siguiente
+        tope = -1 if limit is None else limit + 1
+        if max_depth is None:
+            filas = self.conexion.execute(
+                "SELECT id, name, description, full_path, NULL AS profundidad FROM nodos "
+                "WHERE type = 'directory' AND id > ? AND id < ? ORDER BY id LIMIT ?",
+                (ultimo_id, fin_id, tope)
+            ).fetchall()
+        else:
+            filas = self.conexion.execute(
+                "WITH RECURSIVE sub(id, profundidad) AS ("
+                "  SELECT ?, 0"
+                "  UNION ALL"
+                "  SELECT n.id, sub.profundidad + 1 FROM nodos n JOIN sub ON n.padre = sub.id"
+                "  WHERE sub.profundidad < ? AND n.type = 'directory'"
+                ") SELECT n.id, n.name, n.description, n.full_path, sub.profundidad FROM sub "
+                "JOIN nodos n ON n.id = sub.id WHERE n.id > ? ORDER BY n.id LIMIT ?",
+                (raiz_id, max_depth, ultimo_id, tope)
+            ).fetchall()
+
+        siguiente = None
+        if limit is not None and len(filas) > limit:
+            filas = filas[:limit]
+            siguiente = codificar_cursor(filas[-1]['id'], raiz_id, fin_id, max_depth)
+        return [
+            {
+                'name': fila['name'],
+                'descripcion': fila['description'] or '',
+                'full_path': fila['full_path'] or '',
+                'profundidad': fila['profundidad']
+            }
+            for fila in filas
+        ], siguiente
+
+    def buscar_por_full_path(self, full_path: str) -> Optional[Dict]:
+        fila = self.conexion.execute(
+            "SELECT * FROM nodos WHERE full_path = ? ORDER BY id LIMIT 1", (full_path,)
+        ).fetchone()
+        return self._fila_a_nodo(fila) if fila else None
+
+    def hijos(self, full_path: str) -> List[Dict]:
+        """Devuelve los hijos directos (sin sus descendientes) del nodo con ese full_path."""
+        return [
+            self._fila_a_nodo(fila)
+            for fila in self.conexion.execute(
+                "SELECT h.* FROM nodos h JOIN nodos p ON h.padre = p.id "
+                "WHERE p.full_path = ? ORDER BY h.posicion", (full_path,)
+            )
+        ]
+
+    def actualizar_descripcion(self, nombre: str, descripcion: str) -> bool:
+        """
+        Cambia la descripción del primer directorio (en preorden) con ese nombre,
+        igual que la búsqueda en profundidad sobre el JSON.
+
+        Returns:
+            bool: True si se encontró el directorio
+        """
+        with self.conexion:
+            cursor = self.conexion.execute(
+                "UPDATE nodos SET description = ? WHERE id = ("
+                "SELECT id FROM nodos WHERE type = 'directory' AND name = ? ORDER BY id LIMIT 1)",
+                (descripcion, nombre)
+            )
+        return cursor.rowcount > 0
+
+    def actualizar_descripciones(self, descripciones: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Aplica varias descripciones en una sola transacción. Cada clave es un
+        full_path o un nombre de directorio; los nombres repetidos no se aplican.
+
+        Returns:
+            dict: Listas 'actualizados' y 'no_encontrados' y diccionario 'ambiguos'
+        """
+        informe = {"actualizados": [], "ambiguos": {}, "no_encontrados": []}
+        with self.conexion:
+            for clave, descripcion in descripciones.items():
+                filas = self.conexion.execute(
+                    "SELECT id, full_path FROM nodos WHERE type = 'directory' AND full_path = ? "
+                    "ORDER BY id LIMIT 1", (clave,)
+                ).fetchall() or self.conexion.execute(
+                    "SELECT id, full_path FROM nodos WHERE type = 'directory' AND name = ? "
+                    "ORDER BY id", (clave,)
+                ).fetchall()
+                if not filas:
+                    informe["no_encontrados"].append(clave)
+                elif len(filas) > 1:
+                    informe["ambiguos"][clave] = [f['full_path'] for f in filas]
+                else:
+                    self.conexion.execute(
+                        "UPDATE nodos SET description = ? WHERE id = ?", (descripcion, filas[0]['id'])
+                    )
+                    informe["actualizados"].append(filas[0]['full_path'])
+        return informe
+
+
+def importar_json(ruta_json: str, ruta_db: str) -> Dict:
+    """
+    Importa un estructura.json existente a un almacén SQLite (se reemplaza su contenido).
+
+    Returns:
+        dict: Resultado de la operación (éxito o error)
+    """
+    try:
+        estructura = cargar_estructura(ruta_json)
+        with AlmacenSQLite(ruta_db) as almacen:
+            total = almacen.importar(estructura)
+        return {"success": f"Importados {total} nodos en {ruta_db}", "nodos": total}
+    except Exception as e:
+        return {"error": f"No se pudo importar el JSON: {str(e)}"}
+
+
+def exportar_json(ruta_db: str, ruta_json: str) -> Dict:
+    """
+    Exporta un almacén SQLite al formato de estructura.json.
+
+    Returns:
+        dict: Resultado de la operación (éxito o error)
+    """
+    try:
+        if not os.path.exists(ruta_db):
+            return {"error": f"No se encontró el almacén en {ruta_db}"}
+        with AlmacenSQLite(ruta_db) as almacen:
+            estructura = almacen.exportar()
+        guardar_estructura(ruta_json, estructura)
+        return {"success": f"Estructura exportada a {ruta_json}"}
+    except Exception as e:
+        return {"error": f"No se pudo exportar a JSON: {str(e)}"}
@@ -3,16 +3,32 @@ import json
 import os
 from typing import Dict, Any, Tuple, Optional
 import mcp.types as types
+from almacen_sqlite import AlmacenSQLite, es_ruta_sqlite
+import almacen_dividido
+import almacen_fragmentos
+from almacen_dividido import es_ruta_dividida
+from almacen_fragmentos import es_almacen_fragmentos
+from cache_estructura import cargar_estructura
+from contexto import ajustar_directorios, archivos_candidatos, directorios_relevantes, leer_extractos
+from ejecutor import estado as estado_ejecutor, version_asincrona
+from lectura import leer_lote
+from paginacion import CursorInvalido, indice_preorden, validar_paginacion
+from metricas import fase, iniciar_volcado_periodico, instrumentar, obtener_metricas, registrar_bytes_leidos
 
 mcp = FastMCP("search_file_pro")
 
 # Path global para el archivo JSON
 MEMORIA_PATH = "/Users/msaez/Desktop/Gesco/estructura.json"
 
+# Bytes por defecto del paquete de contexto de preparar_contexto
+MAX_BYTES_CONTEXTO = 32 * 1024
+
 @mcp.tool()
+@instrumentar
 def verificar_memoria(ruta: Optional[str] = None) -> Dict:
     """
     Verifica que el archivo de memoria tenga una estructura válida.
+    Acepta también un almacén SQLite (.db, .sqlite, .sqlite3) o una estructura dividida.
 
     Args:
         ruta: Path opcional donde está el archivo JSON (usa MEMORIA_PATH por defecto)
@@ -25,9 +41,15 @@ def verificar_memoria(ruta: Optional[str] = None) -> Dict:
     try:
         if not os.path.exists(ruta):
             return {"error": True, "mensaje": f"No se encontró el archivo en {ruta}"}
-            
-        with open(ruta, 'r', encoding='utf-8') as f:
-            datos = json.load(f)
+
+        with fase('carga'):
+            if es_ruta_sqlite(ruta):
+                with AlmacenSQLite(ruta) as almacen:
+                    datos = almacen.exportar()
+            elif es_ruta_dividida(ruta):
+                datos = almacen_dividido.abrir(ruta).unir()
+            else:
+                datos = cargar_estructura(ruta)
             
         if not isinstance(datos, dict):
             return {"error": True, "mensaje": "El archivo no contiene un objeto JSON válido"}
@@ -39,44 +61,81 @@ def verificar_memoria(ruta: Optional[str] = None) -> Dict:
     except Exception as e:
         return {"error": True, "mensaje": f"Error al leer el archivo: {str(e)}"}
 
-@mcp.tool()
-def obtener_descripciones_y_paths(ruta_json: str = None) -> dict:
+def obtener_descripciones_y_paths(
+    ruta_json: str = None,
+    max_depth: Optional[int] = None,
+    subtree: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> dict:
     """
     Carga la estructura de directorios desde un archivo JSON y devuelve una lista
     de diccionarios con la descripción y el path completo de cada directorio.
 
+    Para árboles grandes la lista se puede acotar y paginar: cada página cuesta lo
+    mismo sea cual sea el tamaño del árbol. Si hay más resultados, la respuesta
+    incluye 'siguiente_cursor' para pedir la página siguiente.
+
     Args:
-        ruta_json (str): Ruta al archivo JSON. Si no se proporciona, usa MEMORIA_PATH.
+        ruta_json (str): Ruta al archivo JSON, al almacén SQLite, a una estructura dividida (solo
+            se leen los subárboles a los que llega la página) o al directorio de un almacén
+            por fragmentos (se recorren sus fragmentos uno detrás de otro; sin limit se cargan
+            todos en paralelo). Si no se proporciona, usa MEMORIA_PATH.
+        max_depth (int): Niveles de subdirectorios a incluir (0 = solo el directorio inicial).
+        subtree (str): full_path del directorio desde el que listar (la raíz por defecto).
+        limit (int): Directorios por página.
+        cursor (str): 'siguiente_cursor' de la página anterior.
 
     Returns:
         dict: Diccionario con la clave 'resultado' que contiene la lista de descripciones y paths.
     """
     ruta_json = ruta_json or MEMORIA_PATH
+    error = validar_paginacion(max_depth, limit)
+    if error:
+        return {"error": True, "mensaje": error}
+
     try:
-        with open(ruta_json, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        if es_ruta_sqlite(ruta_json):
+            with AlmacenSQLite(ruta_json) as almacen:
+                directorios, siguiente = almacen.pagina_directorios(subtree, max_depth, limit, cursor)
+            resultado = [{"descripcion": d["descripcion"], "full_path": d["full_path"]} for d in directorios]
+        else:
+            if es_ruta_dividida(ruta_json):
+                # Cada subárbol de primer nivel se carga cuando la página baja a él
+                with fase('recorrido'):
+                    nodos, siguiente = almacen_dividido.abrir(ruta_json).pagina(subtree, max_depth, limit, cursor)
+            elif es_almacen_fragmentos(ruta_json):
+                # Cada fragmento se carga cuando la página llega a él
+                with fase('recorrido'):
+                    nodos, siguiente = almacen_fragmentos.pagina(ruta_json, subtree, max_depth, limit, cursor)
+            else:
+                with fase('carga'):
+                    indice = indice_preorden(ruta_json)
+                with fase('recorrido'):
+                    nodos, siguiente = indice.pagina(subtree, max_depth, limit, cursor)
+            resultado = [
+                {"descripcion": nodo.get("description", ""), "full_path": nodo.get("full_path", "")}
+                for nodo, _ in nodos
+            ]
+    except KeyError:
+        return {"error": True, "mensaje": f"No se encontró el directorio {subtree}"}
+    except CursorInvalido as e:
+        return {"error": True, "mensaje": str(e)}
     except Exception as e:
-        return {"error": True, "mensaje": f"No se pudo cargar el JSON: {str(e)}"}
-
-    resultado = []
-
-    def recorrer(nodo):
-        if nodo.get("type") == "directory":
-            resultado.append({
-                "descripcion": nodo.get("description", ""),
-                "full_path": nodo.get("full_path", "")
-            })
-            for hijo in nodo.get("children", []):
-                recorrer(hijo)
+        return {"error": True, "mensaje": f"No se pudo cargar la estructura: {str(e)}"}
 
-    recorrer(data)
-    return {"error": False, "resultado": resultado}
+    respuesta = {"error": False, "resultado": resultado}
+    if limit is not None or cursor:
+        respuesta["siguiente_cursor"] = siguiente
+    return respuesta
 
 @mcp.tool()
+@instrumentar
 def combinar_descripciones_y_prompt(descripciones: list, prompt: str) -> dict:
     """
     Siempre que un prompt empiece con "Buscar:" se debe usar esta herramienta.
     Entonces se comparara el prompt con las descripciones de los directorios y se usara el path completo del directorio que coincida con el prompt para buscar en el sistema de archivos. Una vez encontrado el path completo, se usará la herramienta read_multiple_files para leer los archivos de ese path y dar una respuesta a la pregunta.
+    preparar_contexto hace todo el proceso en una sola llamada.
 
     Args:
         descripciones (list): Lista de diccionarios con descripciones y paths.
@@ -90,7 +149,6 @@ def combinar_descripciones_y_prompt(descripciones: list, prompt: str) -> dict:
         "prompt": prompt
     }
 
-@mcp.tool()
 def leer_archivo(path: str) -> dict:
     """
     Lee el contenido completo de un archivo del sistema de archivos.
@@ -104,30 +162,134 @@ def leer_archivo(path: str) -> dict:
     try:
         with open(path, "r", encoding="utf-8") as f:
             contenido = f.read()
+        registrar_bytes_leidos(len(contenido.encode("utf-8")))
         return {"error": False, "contenido": contenido}
     except Exception as e:
         return {"error": True, "mensaje": f"No se pudo leer el archivo: {str(e)}"}
 
-@mcp.tool()
-def leer_multiples_archivos(paths: list) -> dict:
+def leer_multiples_archivos(paths: list, max_bytes_total: Optional[int] = None, max_bytes_archivo: Optional[int] = None) -> dict:
     """
     Lee el contenido de múltiples archivos simultáneamente.
 
+    Las lecturas se hacen en paralelo y los resultados vuelven en el orden pedido.
+    Con los límites de bytes, el presupuesto se reparte en ese mismo orden y los
+    archivos que no caben enteros se recortan: llevan 'truncado': True y una
+    marca al final del contenido con el offset para seguir leyendo.
+
     Args:
-        paths (list): Lista de rutas de archivos a leer.
+        paths (list): Lista de rutas de archivos a leer, o de diccionarios
+            {"path": ..., "offset": ..., "longitud": ...} para leer un rango de bytes.
+        max_bytes_total (int): Bytes máximos a devolver entre todos los archivos.
+        max_bytes_archivo (int): Bytes máximos a devolver por archivo.
 
     Returns:
         dict: Diccionario con los contenidos de los archivos o mensajes de error por cada archivo.
     """
-    resultados = []
-    for path in paths:
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                contenido = f.read()
-            resultados.append({"path": path, "error": False, "contenido": contenido})
-        except Exception as e:
-            resultados.append({"path": path, "error": True, "mensaje": f"No se pudo leer el archivo: {str(e)}"})
-    return {"resultados": resultados}
+    try:
+        resultado = leer_lote(paths, max_bytes_total=max_bytes_total, max_bytes_archivo=max_bytes_archivo)
+        registrar_bytes_leidos(resultado["bytes_leidos"])
+        return resultado
+    except Exception as e:
+        return {"error": True, "mensaje": f"No se pudieron leer los archivos: {str(e)}"}
+
+def preparar_contexto(
+    prompt: str,
+    ruta_json: str = None,
+    k: int = 3,
+    max_archivos: int = 8,
+    max_bytes: int = MAX_BYTES_CONTEXTO,
+    max_bytes_archivo: Optional[int] = None,
+    profundidad: int = 1
+) -> dict:
+    """
+    Hace en una sola llamada lo que describe combinar_descripciones_y_prompt:
+    elige los directorios más relevantes para el prompt (BM25 sobre descripciones,
+    nombres y rutas, sin enviar la lista de descripciones al cliente), escoge sus
+    archivos de texto más prometedores y lee el principio de cada uno. Todo cabe
+    en max_bytes: primero entran los directorios con su descripción (la que no
+    cabe entera se recorta y los siguientes se descartan) y el resto se reparte
+    entre los archivos, contando las marcas de truncado.
+
+    Args:
+        prompt (str): Pregunta o consulta del usuario.
+        ruta_json (str): Ruta al archivo JSON o al directorio de un almacén por
+            fragmentos. Si no se proporciona, usa MEMORIA_PATH.
+        k (int): Directorios a considerar.
+        max_archivos (int): Archivos a leer como máximo.
+        max_bytes (int): Bytes máximos de descripciones y contenido entre todo.
+        max_bytes_archivo (int): Bytes máximos por archivo.
+        profundidad (int): Niveles de subdirectorios en los que buscar archivos
+            (0 = solo los del propio directorio).
+
+    Returns:
+        dict: {"prompt", "directorios": [{"full_path", "descripcion", "relevancia"}],
+               "archivos": [{"path", "directorio", "contenido", "bytes_totales", "truncado"}],
+               "bytes", "presupuesto_agotado"}. El directorio con la descripción
+               recortada lleva "descripcion_truncada".
+    """
+    ruta_json = ruta_json or MEMORIA_PATH
+    if es_ruta_sqlite(ruta_json) or es_ruta_dividida(ruta_json):
+        return {"error": True, "mensaje": "preparar_contexto necesita un archivo JSON o un almacén por fragmentos"}
+    if not os.path.exists(ruta_json):
+        return {"error": True, "mensaje": f"No se encontró el archivo en {ruta_json}"}
+
+    try:
+        with fase('ranking'):
+            relevantes = directorios_relevantes(ruta_json, prompt, k)
+        directorios, bytes_directorios = ajustar_directorios([
+            {
+                "full_path": documento["full_path"],
+                "descripcion": documento["descripcion"],
+                "relevancia": f"{relevancia:.2%}"
+            }
+            for documento, relevancia, _ in relevantes
+        ], max_bytes)
+        recortados = len(directorios) < len(relevantes) or any(d.get("descripcion_truncada") for d in directorios)
+        # Los directorios que no caben tampoco aportan archivos
+        relevantes = relevantes[:len(directorios)]
+        presupuesto = max_bytes - bytes_directorios
+
+        with fase('seleccion'):
+            archivos = archivos_candidatos(relevantes, prompt, max_archivos, profundidad)
+        with fase('lectura'):
+            extractos = leer_extractos(archivos, presupuesto, max_bytes_archivo)
+        registrar_bytes_leidos(extractos["bytes_leidos"])
+    except Exception as e:
+        return {"error": True, "mensaje": f"No se pudo preparar el contexto: {str(e)}"}
+
+    return {
+        "error": False,
+        "prompt": prompt,
+        "directorios": directorios,
+        "archivos": extractos["archivos"],
+        "bytes": bytes_directorios + extractos["bytes_contenido"],
+        "presupuesto_agotado": recortados or extractos["presupuesto_agotado"]
+    }
+
+# Herramientas con E/S pesada: se registran en versión async, que las ejecuta en
+# el pool acotado de ejecutor.py (MCP_MAX_TRABAJOS_IO trabajos a la vez) para que
+# verificar_memoria y el resto sigan respondiendo mientras tanto. Las funciones
+# síncronas siguen disponibles para llamarlas directamente.
+for _herramienta in (obtener_descripciones_y_paths, leer_archivo, leer_multiples_archivos, preparar_contexto):
+    mcp.tool()(instrumentar(version_asincrona(_herramienta)))
+
+@mcp.tool()
+def metricas(reiniciar: bool = False) -> dict:
+    """
+    Devuelve las métricas de uso de las herramientas de este servidor: llamadas,
+    errores, latencias (media, p50, p95, p99, máxima), tiempo por fase (carga,
+    recorrido, escritura...), bytes leídos de disco y bytes devueltos (estimados
+    por muestreo). En 'ejecutor', los trabajos de E/S en curso, en espera y
+    cancelados.
+
+    Args:
+        reiniciar (bool): Si es True, pone los contadores a cero después de leerlos.
+
+    Returns:
+        dict: Instantánea de las métricas por herramienta.
+    """
+    return dict(obtener_metricas(reiniciar), ejecutor=estado_ejecutor())
 
 if __name__ == "__main__":
+    iniciar_volcado_periodico()
     mcp.run()
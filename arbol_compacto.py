@@ -0,0 +1,414 @@
+import json
+import os
+from array import array
+from typing import Dict, Iterator, List, Optional, TextIO
+
+# Banderas de cada nodo
+ES_DIRECTORIO = 1
+# El nodo tiene clave 'description' (los directorios del rastreo la llevan, aunque esté vacía)
+CON_DESCRIPCION = 2
+# El nodo tiene 'full_path' y coincide con la reconstruida a partir de sus padres
+CON_RUTA = 4
+# El nodo tiene clave 'children' (todos los directorios del rastreo)
+CON_HIJOS = 8
+
+# Claves que se guardan en los arrays; cualquier otra va a 'extras'
+_CLAVES_FIJAS = ('name', 'type', 'description', 'children', 'full_path')
+# Valor en 'extras' para una clave fija que el nodo original no tenía
+_AUSENTE = object()
+# El mismo que usa json.dump(..., ensure_ascii=False, indent=4)
+_CODIFICADOR = json.JSONEncoder(ensure_ascii=False, indent=4)
+
+
+class ArbolCompacto:
+    """
+    Estructura de directorios en arrays paralelos, en preorden: por nodo guarda el
+    índice del padre, el del final de su subárbol, el nombre (internado en una
+    tabla de segmentos) y unas banderas de tipo. Las rutas completas no se
+    guardan, se reconstruyen subiendo por los padres; descripciones, metadatos y
+    demás claves solo ocupan memoria en los nodos que las tienen.
+
+    Un nodo ocupa unos 13 bytes más su parte de la tabla de nombres, frente a
+    los cientos de bytes de un diccionario con su full_path. La conversión desde
+    y hacia el formato de estructura.json es sin pérdidas.
+
+    Los nodos se añaden en preorden (cada uno detrás de su padre y de los
+    subárboles de sus hermanos anteriores), como los produce un recorrido en
+    profundidad; el subárbol de un nodo es el tramo [i, fin(i)). Con la
+    profundidad de cada nodo, las páginas (paginacion.pagina_compacta) y los
+    recortes por max_depth saltan subárboles enteros sin recorrerlos.
+    """
+
+    def __init__(self, ruta_raiz: str = ''):
+        self.ruta_raiz = ruta_raiz
+        self.padres = array('i')
+        self.fines = array('I')
+        self.nombres = array('I')
+        self.banderas = array('B')
+        self.profundidades = array('H')
+        self.segmentos: List[str] = []
+        self._ids_segmento: Dict[str, int] = {}
+        self.descripciones: Dict[int, str] = {}
+        self.extras: Dict[int, Dict] = {}
+        self._abiertos: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.padres)
+
+    def _segmento(self, nombre: str) -> int:
+        identificador = self._ids_segmento.get(nombre)
+        if identificador is None:
+            identificador = self._ids_segmento[nombre] = len(self.segmentos)
+            self.segmentos.append(nombre)
+        return identificador
+
+    def anadir(
+        self,
+        padre: int,
+        nombre: str,
+        banderas: int,
+        descripcion: str = '',
+        extras: Optional[Dict] = None
+    ) -> int:
+        """
+        Añade un nodo como último hijo de padre (-1 para la raíz) y devuelve su índice.
+        Cierra los subárboles que ya no pueden recibir más nodos.
+        """
+        while self._abiertos and self._abiertos[-1] != padre:
+            self.fines[self._abiertos.pop()] = len(self.padres)
+        posicion = len(self.padres)
+        self.padres.append(padre)
+        self.fines.append(posicion + 1)
+        self.nombres.append(self._segmento(nombre))
+        self.banderas.append(banderas)
+        self.profundidades.append(self.profundidades[padre] + 1 if padre >= 0 else 0)
+        if descripcion:
+            self.descripciones[posicion] = descripcion
+        if extras:
+            self.extras[posicion] = extras
+        if banderas & ES_DIRECTORIO:
+            self._abiertos.append(posicion)
+        return posicion
+
+    def terminar(self) -> 'ArbolCompacto':
+        """Cierra los subárboles abiertos; hay que llamarlo tras el último anadir."""
+        while self._abiertos:
+            self.fines[self._abiertos.pop()] = len(self.padres)
+        return self
+
+    def nombre(self, indice: int) -> str:
+        return self.segmentos[self.nombres[indice]]
+
+    def es_directorio(self, indice: int) -> bool:
+        return bool(self.banderas[indice] & ES_DIRECTORIO)
+
+    def descripcion(self, indice: int) -> str:
+        return self.descripciones.get(indice, '')
+
+    def nodo(self, indice: int) -> Dict:
+        """Nodo en el formato de estructura.json, sin sus descendientes."""
+        nodo = self._nodo(indice)
+        nodo.pop('children', None)
+        return nodo
+
+    def ruta_guardada(self, indice: int) -> str:
+        """Valor de 'full_path' del nodo ('' si no lo tiene), como lo daría nodo.get('full_path', '')."""
+        if self.banderas[indice] & CON_RUTA:
+            return self.full_path(indice)
+        ruta = self.extras.get(indice, {}).get('full_path', '')
+        return ruta if ruta is not _AUSENTE else ''
+
+    def fijar_descripcion(self, indice: int, descripcion: str):
+        """Equivale a nodo['description'] = descripcion."""
+        self.banderas[indice] |= CON_DESCRIPCION
+        extras = self.extras.get(indice)
+        if extras:
+            extras.pop('description', None)
+        if isinstance(descripcion, str):
+            if descripcion:
+                self.descripciones[indice] = descripcion
+            else:
+                self.descripciones.pop(indice, None)
+        else:
+            self.descripciones.pop(indice, None)
+            self.extras.setdefault(indice, {})['description'] = descripcion
+
+    def fin(self, indice: int) -> int:
+        """Posición siguiente al último descendiente del nodo."""
+        return self.fines[indice]
+
+    def hijos(self, indice: int) -> Iterator[int]:
+        """Índices de los hijos directos, en orden."""
+        hijo = indice + 1
+        fin = self.fines[indice]
+        while hijo < fin:
+            yield hijo
+            hijo = self.fines[hijo]
+
+    def full_path(self, indice: int) -> str:
+        """Ruta completa del nodo, reconstruida a partir de la de la raíz."""
+        extras = self.extras.get(indice)
+        if extras and 'full_path' in extras:
+            return extras['full_path']
+        partes = []
+        while indice > 0:
+            partes.append(self.segmentos[self.nombres[indice]])
+            indice = self.padres[indice]
+        partes.append(self.ruta_raiz)
+        return os.path.join(*reversed(partes))
+
+    def buscar(self, full_path: str) -> Optional[int]:
+        """Índice del nodo con esa ruta completa, bajando por nombres desde la raíz."""
+        if not len(self):
+            return None
+        if full_path == self.ruta_raiz:
+            return 0
+        relativa = os.path.relpath(full_path, self.ruta_raiz) if self.ruta_raiz else full_path
+        if relativa.startswith(os.pardir):
+            return self._buscar_en_extras(full_path)
+        indice = self._por_nombres(relativa.split(os.sep))
+        return indice if indice is not None else self._buscar_en_extras(full_path)
+
+    def _por_nombres(self, partes: List[str]) -> Optional[int]:
+        # Baja desde la raíz por los hijos con esos nombres, como registro_cambios._nodo_por_ruta
+        indice = 0
+        for parte in partes:
+            identificador = self._ids_segmento.get(parte)
+            if identificador is None:
+                return None
+            indice = next((h for h in self.hijos(indice) if self.nombres[h] == identificador), None)
+            if indice is None:
+                return None
+        return indice
+
+    def _buscar_en_extras(self, full_path: str) -> Optional[int]:
+        # Nodos cuyo full_path no es el que se reconstruye desde la raíz
+        return next((i for i, extras in self.extras.items() if extras.get('full_path') == full_path), None)
+
+    def directorios(self) -> Iterator[int]:
+        """Índices de todos los directorios, en preorden."""
+        banderas = self.banderas
+        return (i for i in range(len(banderas)) if banderas[i] & ES_DIRECTORIO)
+
+    def directorios_por_nombre(self, nombre: str) -> List[int]:
+        """Índices de los directorios con ese nombre, en preorden (como IndiceDirectorios.por_nombre)."""
+        identificador = self._ids_segmento.get(nombre)
+        encontrados = []
+        if identificador is None:
+            return encontrados
+        # array.index recorre los identificadores en C, sin un índice aparte por nombre
+        posicion = 0
+        while True:
+            try:
+                posicion = self.nombres.index(identificador, posicion)
+            except ValueError:
+                return encontrados
+            extras = self.extras.get(posicion)
+            if self.banderas[posicion] & ES_DIRECTORIO and not (extras and 'name' in extras):
+                encontrados.append(posicion)
+            posicion += 1
+
+    def resolver(self, clave: str) -> List[int]:
+        """
+        Directorios que corresponden a una clave, como IndiceDirectorios.resolver:
+        el de ese full_path si existe o, si no, todos los que tienen ese nombre.
+        """
+        indice = self.buscar(clave)
+        if indice is not None and self.banderas[indice] & ES_DIRECTORIO and self.ruta_guardada(indice) == clave:
+            return [indice]
+        return self.directorios_por_nombre(clave)
+
+    def archivos(self) -> Iterator[str]:
+        """full_path de todos los archivos, como indice_trigramas.archivos_de_estructura."""
+        for indice in range(len(self)):
+            if self.banderas[indice] & ES_DIRECTORIO:
+                continue
+            extras = self.extras.get(indice)
+            if extras and 'type' in extras:
+                continue
+            ruta = self.ruta_guardada(indice)
+            if ruta:
+                yield ruta
+
+    @classmethod
+    def desde_estructura(cls, estructura: Dict) -> 'ArbolCompacto':
+        """Convierte una estructura anidada (formato de estructura.json)."""
+        arbol = cls(estructura.get('full_path', ''))
+        rutas: List[str] = []
+        pila = [(estructura, -1)]
+        while pila:
+            nodo, padre = pila.pop()
+            # Ruta que reconstruiría full_path(); si el nodo trae otra, se conserva tal cual
+            ruta = arbol.ruta_raiz if padre < 0 else os.path.join(rutas[padre], nodo.get('name', ''))
+            banderas = 0
+            if nodo.get('type') == 'directory':
+                banderas |= ES_DIRECTORIO
+            if 'description' in nodo:
+                banderas |= CON_DESCRIPCION
+            if 'children' in nodo:
+                banderas |= CON_HIJOS
+            if 'full_path' in nodo and nodo['full_path'] == ruta:
+                banderas |= CON_RUTA
+            # Un full_path que no se reconstruye va en su sitio entre las demás claves
+            extras = {
+                clave: valor for clave, valor in nodo.items()
+                if clave not in _CLAVES_FIJAS or (clave == 'full_path' and not banderas & CON_RUTA)
+            }
+            if nodo.get('type') not in ('directory', 'file'):
+                extras['type'] = nodo['type'] if 'type' in nodo else _AUSENTE
+            if 'name' not in nodo:
+                extras['name'] = _AUSENTE
+
+            descripcion = nodo.get('description', '')
+            if not isinstance(descripcion, str):
+                extras['description'] = descripcion
+                descripcion = ''
+            posicion = arbol.anadir(padre, nodo.get('name', ''), banderas, descripcion, extras)
+            # Se reutiliza la cadena del nodo cuando coincide, para no duplicarla mientras dura la conversión
+            rutas.append(nodo['full_path'] if banderas & CON_RUTA else ruta)
+            if banderas & ES_DIRECTORIO or 'children' in nodo:
+                if not banderas & ES_DIRECTORIO:
+                    # Hijos de un nodo que no es directorio: se abren igualmente como subárbol
+                    arbol._abiertos.append(posicion)
+                pila.extend((hijo, posicion) for hijo in reversed(nodo.get('children', [])))
+        return arbol.terminar()
+
+    def a_estructura(self, indice: int = 0, max_depth: Optional[int] = None) -> Dict:
+        """
+        Devuelve el subárbol de un nodo en el formato anidado de estructura.json.
+        Con max_depth solo se incluyen esos niveles por debajo del nodo.
+        """
+        return self._construir(indice, max_depth, podado=False)
+
+    def podar(self, indice: int, max_depth: Optional[int]) -> Dict:
+        """
+        Equivale a paginacion.podar(self.a_estructura(indice), max_depth): los
+        directorios cortados llevan 'children' vacío, 'truncado' y 'hijos_omitidos',
+        pero los niveles que no se devuelven no llegan a convertirse.
+        """
+        return self._construir(indice, max_depth, podado=max_depth is not None)
+
+    def resumen(self, indice: int, profundidad: int) -> Dict:
+        """Equivale a paginacion.resumen_nodo para el nodo de ese índice."""
+        resumen = self.nodo(indice)
+        resumen['profundidad'] = profundidad
+        if resumen.get('type') == 'directory':
+            resumen['hijos'] = sum(1 for _ in self.hijos(indice)) if self.banderas[indice] & CON_HIJOS else 0
+        return resumen
+
+    def _construir(self, indice: int, max_depth: Optional[int], podado: bool) -> Dict:
+        if not len(self):
+            return {}
+        nodos: Dict[int, Dict] = {}
+        base = self.profundidades[indice]
+        fin = self.fines[indice]
+        posicion = indice
+        while posicion < fin:
+            nodo = self._nodo(posicion)
+            if podado and 'children' in nodo:
+                # podar copia el resto de claves y añade 'children' al final
+                nodo['children'] = nodo.pop('children')
+            nodos[posicion] = nodo
+            if posicion != indice:
+                nodos[self.padres[posicion]]['children'].append(nodo)
+            if max_depth is not None and self.profundidades[posicion] - base >= max_depth:
+                siguiente = self.fines[posicion]
+                if podado and 'children' in nodo and siguiente > posicion + 1:
+                    nodo['truncado'] = True
+                    nodo['hijos_omitidos'] = sum(1 for _ in self.hijos(posicion))
+                posicion = siguiente
+            else:
+                posicion += 1
+        return nodos[indice]
+
+    def volcar(self, f: TextIO):
+        """
+        Escribe el árbol en f exactamente como json.dump(self.a_estructura(), f,
+        ensure_ascii=False, indent=4), pero nodo a nodo: nunca se tiene en
+        memoria la estructura anidada completa.
+        """
+        if not len(self):
+            f.write('{}')
+            return
+        trozos: List[str] = []
+        pila = [self._trozos_json(0, 0)]
+        while pila:
+            trozo = next(pila[-1], None)
+            if trozo is None:
+                pila.pop()
+            elif isinstance(trozo, tuple):
+                pila.append(self._trozos_json(*trozo))
+            else:
+                trozos.append(trozo)
+                if len(trozos) >= 4096:
+                    f.write(''.join(trozos))
+                    trozos.clear()
+        f.write(''.join(trozos))
+
+    def _trozos_json(self, indice: int, nivel: int) -> Iterator:
+        # Texto del nodo; en lugar de cada hijo se cede (hijo, nivel) para que volcar lo escriba en su sitio
+        nodo = self._nodo(indice)
+        if not nodo:
+            yield '{}'
+            return
+        sangria = '\n' + '    ' * (nivel + 1)
+        yield '{'
+        for n, (clave, valor) in enumerate(nodo.items()):
+            yield (',' if n else '') + sangria + _CODIFICADOR.encode(clave) + ': '
+            if clave != 'children':
+                yield _CODIFICADOR.encode(valor).replace('\n', sangria)
+                continue
+            primero = True
+            for hijo in self.hijos(indice):
+                yield ('[' if primero else ',') + sangria + '    '
+                yield (hijo, nivel + 2)
+                primero = False
+            yield '[]' if primero else sangria + ']'
+        yield '\n' + '    ' * nivel + '}'
+
+    def aplicar_cambios(self, cambios: List[Dict]) -> int:
+        """
+        Equivale a registro_cambios.aplicar_cambios sobre la estructura anidada.
+
+        Returns:
+            int: Cambios aplicados (los que apuntan a nodos inexistentes se ignoran)
+        """
+        if not len(self):
+            return 0
+        aplicados = 0
+        for cambio in cambios:
+            if 'full_path' in cambio:
+                indice = self.buscar(cambio['full_path'])
+                if indice is not None and self.ruta_guardada(indice) != cambio['full_path']:
+                    indice = None
+            else:
+                indice = self._por_nombres(cambio.get('ruta', []))
+            if indice is None:
+                continue
+
+            if cambio.get('op') == 'descripcion':
+                self.fijar_descripcion(indice, cambio['descripcion'])
+            elif cambio.get('op') == 'metadatos':
+                self.extras.setdefault(indice, {}).setdefault('metadata', {}).update(cambio['metadata'])
+            else:
+                continue
+            aplicados += 1
+        return aplicados
+
+    def _nodo(self, indice: int) -> Dict:
+        banderas = self.banderas[indice]
+        extras = self.extras.get(indice, {})
+        nodo = {'name': self.segmentos[self.nombres[indice]]}
+        nodo['type'] = 'directory' if banderas & ES_DIRECTORIO else 'file'
+        if banderas & CON_DESCRIPCION:
+            nodo['description'] = self.descripciones.get(indice, '')
+        if banderas & CON_HIJOS:
+            nodo['children'] = []
+        if banderas & CON_RUTA:
+            nodo['full_path'] = self.full_path(indice)
+        for clave, valor in extras.items():
+            if valor is _AUSENTE:
+                del nodo[clave]
+            else:
+                nodo[clave] = valor
+        return nodo
@@ -0,0 +1,321 @@
+"""
+Benchmarks de las herramientas MCP sobre árboles sintéticos de distintos tamaños.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.ejecutar --tamanos 1000 10000 --salida resultados.json
+    python -m benchmarks.ejecutar --comparar anterior.json
+
+Para cada tamaño se genera un árbol determinista en disco con su estructura.json
+(con descripciones), se mide cada herramienta varias veces y se registra el pico
+de memoria de una ejecución adicional bajo tracemalloc. Los resultados se guardan
+en JSON para poder comparar ejecuciones.
+"""
+import argparse
+import importlib
+import importlib.machinery
+import importlib.util
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_REPO not in sys.path:
+    sys.path.insert(0, RAIZ_REPO)
+
+from benchmarks.generador import (describir_estructura, generar_arbol,
+                                  guardar_estructura_sintetica, parametros_para)
+
+TAMANOS_POR_DEFECTO = [1_000, 10_000, 100_000, 1_000_000]
+
+# Nombre del archivo de estructura dentro del directorio que reciben search y semantic_search
+NOMBRE_ESTRUCTURA = 'estructura.json'
+
+# search y semantic_search se guardan como .py.txt con imports relativos: se cargan
+# dentro de un paquete sintético cuyo '.server' es "server copy.py"
+PAQUETE_BUSQUEDA = 'benchmarks._busqueda'
+FUENTES_BUSQUEDA = {
+    'search': 'search.py.txt',
+    'semantic_search': 'semantic_search.py.txt',
+}
+
+
+class Contexto:
+    """Árbol generado para un tamaño: raíz en disco y estructura.json asociado."""
+
+    def __init__(self, raiz: str, directorio_json: str):
+        self.raiz = raiz
+        self.directorio_json = directorio_json
+        self.ruta_json = os.path.join(directorio_json, NOMBRE_ESTRUCTURA)
+
+
+def _cargar_fuente(nombre: str, ruta: str):
+    cargador = importlib.machinery.SourceFileLoader(nombre, ruta)
+    spec = importlib.util.spec_from_loader(nombre, cargador)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nombre] = modulo
+    try:
+        cargador.exec_module(modulo)
+    except BaseException:
+        del sys.modules[nombre]
+        raise
+    return modulo
+
+
+def _paquete_busqueda() -> types.ModuleType:
+    paquete = sys.modules.get(PAQUETE_BUSQUEDA)
+    if paquete is None:
+        paquete = types.ModuleType(PAQUETE_BUSQUEDA)
+        paquete.__path__ = []
+        sys.modules[PAQUETE_BUSQUEDA] = paquete
+        servidor = _cargar_fuente(f'{PAQUETE_BUSQUEDA}.server', os.path.join(RAIZ_REPO, 'server copy.py'))
+        # Sus valores por defecto están comentados; los benchmarks siempre pasan la ruta
+        servidor.MEMORIA_PATH = getattr(servidor, 'MEMORIA_PATH', '')
+        servidor.MEMORIA_FILENAME = getattr(servidor, 'MEMORIA_FILENAME', NOMBRE_ESTRUCTURA)
+    return paquete
+
+
+def _modulo(nombre: str):
+    """
+    Importa un módulo de la raíz del repositorio. search y semantic_search se
+    cargan desde su .py.txt; sus imports relativos apuntan a los mismos módulos
+    de la raíz que usa el resto, para que compartan cachés e índices.
+    Si no se pueden cargar se lanza la excepción: el benchmark falla en lugar
+    de quedar como no disponible sin que nadie lo note.
+    """
+    fuente = FUENTES_BUSQUEDA.get(nombre)
+    if fuente is None:
+        return importlib.import_module(nombre)
+    completo = f'{PAQUETE_BUSQUEDA}.{nombre}'
+    if completo in sys.modules:
+        return sys.modules[completo]
+    _paquete_busqueda()
+    ruta = os.path.join(RAIZ_REPO, fuente)
+    with open(ruta, 'r', encoding='utf-8') as f:
+        relativos = re.findall(r'^from \.(\w+) import', f.read(), re.MULTILINE)
+    for relativo in relativos:
+        if f'{PAQUETE_BUSQUEDA}.{relativo}' not in sys.modules:
+            sys.modules[f'{PAQUETE_BUSQUEDA}.{relativo}'] = importlib.import_module(relativo)
+    return _cargar_fuente(completo, ruta)
+
+
+def _comprobar(respuesta):
+    """Convierte en excepción la respuesta de error de una herramienta."""
+    if isinstance(respuesta, dict) and (respuesta.get('error') or respuesta.get('error_guardado')):
+        raise RuntimeError(respuesta.get('mensaje') or respuesta.get('error_guardado') or respuesta['error'])
+    return respuesta
+
+
+def _invalidar_cache():
+    try:
+        from cache_estructura import invalidar
+        invalidar()
+    except ImportError:
+        pass
+
+
+def bench_leer_estructura(ctx: Contexto):
+    # La herramienta real, guardando en el directorio del benchmark en lugar de RUTA_ESTRUCTURA
+    servidor = _modulo('server')
+    ruta_original = servidor.RUTA_ESTRUCTURA
+    servidor.RUTA_ESTRUCTURA = os.path.join(ctx.directorio_json, 'rastreo.json')
+    try:
+        _comprobar(servidor.leer_estructura_directorios(ctx.raiz, force=True))
+    finally:
+        servidor.RUTA_ESTRUCTURA = ruta_original
+
+
+def bench_obtener_descripciones(ctx: Contexto):
+    _invalidar_cache()
+    _comprobar(_modulo('app').obtener_descripciones_y_paths(ctx.ruta_json))
+
+
+def bench_obtener_descripciones_cache(ctx: Contexto):
+    _comprobar(_modulo('app').obtener_descripciones_y_paths(ctx.ruta_json))
+
+
+def bench_buscar_por_nombre(ctx: Contexto):
+    _comprobar(_modulo('search').buscar_por_nombre('ventas.*_1', ctx.directorio_json))
+
+
+def bench_buscar_por_contenido(ctx: Contexto):
+    _comprobar(_modulo('search').buscar_por_contenido('presupuesto anual', ruta=ctx.directorio_json))
+
+
+def bench_sugerir_directorios(ctx: Contexto):
+    semantic_search = _modulo('semantic_search')
+    # Sin vaciar la caché de sugerencias solo se mediría la primera repetición
+    semantic_search.estado_cache_sugerencias(limpiar=True)
+    _comprobar(semantic_search.sugerir_directorios(
+        '¿Dónde están los informes de ventas trimestrales?', ctx.directorio_json
+    ))
+
+
+HERRAMIENTAS: Dict[str, Callable[[Contexto], None]] = {
+    'leer_estructura_directorios': bench_leer_estructura,
+    'obtener_descripciones_y_paths': bench_obtener_descripciones,
+    'obtener_descripciones_y_paths (caché)': bench_obtener_descripciones_cache,
+    'buscar_por_nombre': bench_buscar_por_nombre,
+    'buscar_por_contenido': bench_buscar_por_contenido,
+    'sugerir_directorios': bench_sugerir_directorios,
+}
+
+
+def medir(funcion: Callable[[Contexto], None], ctx: Contexto, repeticiones: int) -> Dict:
+    """Mide el tiempo de varias ejecuciones y el pico de memoria de una más."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(ctx)
+        tiempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    try:
+        funcion(ctx)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'segundos_min': round(min(tiempos), 6),
+        'segundos_mediana': round(statistics.median(tiempos), 6),
+        'pico_memoria_bytes': pico
+    }
+
+
+def preparar(directorio: str, nodos: int, args: argparse.Namespace) -> Contexto:
+    """Genera el árbol y su estructura.json con descripciones para un tamaño."""
+    from rastreador import explorar_arbol
+
+    raiz = os.path.join(directorio, f'arbol_{nodos}')
+    palabras = None
+    if args.vocabulario:
+        with open(args.vocabulario, 'r', encoding='utf-8') as f:
+            palabras = sorted(set(f.read().split()))
+    parametros = parametros_para(nodos, args.archivos_por_directorio, args.ramificacion)
+    generar_arbol(
+        raiz,
+        parametros['profundidad'],
+        parametros['ramificacion'],
+        parametros['archivos_por_directorio'],
+        tamano_archivo=args.tamano_archivo,
+        max_nodos=nodos,
+        palabras=palabras,
+        semilla=args.semilla
+    )
+    ctx = Contexto(raiz, os.path.join(directorio, f'memoria_{nodos}'))
+    estructura = describir_estructura(
+        explorar_arbol(raiz), palabras=palabras,
+        palabras_por_descripcion=args.palabras_descripcion, semilla=args.semilla
+    )
+    guardar_estructura_sintetica(estructura, ctx.ruta_json)
+    return ctx
+
+
+def comparar(actual: Dict, anterior: Dict):
+    """Imprime la variación de la mediana de cada herramienta y tamaño respecto a otra ejecución."""
+    previos = {
+        (r['herramienta'], r['nodos']): r for r in anterior.get('resultados', []) if 'segundos_mediana' in r
+    }
+    for r in actual['resultados']:
+        previo = previos.get((r['herramienta'], r['nodos']))
+        if previo is None or 'segundos_mediana' not in r:
+            continue
+        ratio = r['segundos_mediana'] / previo['segundos_mediana'] if previo['segundos_mediana'] else float('inf')
+        print(f"{r['herramienta']:<40} {r['nodos']:>9}  {previo['segundos_mediana']:.4f}s -> "
+              f"{r['segundos_mediana']:.4f}s  (x{ratio:.2f})")
+
+
+def ejecutar(args: argparse.Namespace) -> Dict:
+    herramientas = args.herramientas or list(HERRAMIENTAS)
+    directorio = args.directorio or tempfile.mkdtemp(prefix='bench_mcp_')
+    informe = {
+        'fecha': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'plataforma': platform.platform(),
+        'parametros': {
+            'tamanos': args.tamanos,
+            'repeticiones': args.repeticiones,
+            'archivos_por_directorio': args.archivos_por_directorio,
+            'ramificacion': args.ramificacion,
+            'tamano_archivo': args.tamano_archivo,
+            'palabras_descripcion': args.palabras_descripcion,
+            'vocabulario': args.vocabulario,
+            'semilla': args.semilla
+        },
+        'resultados': []
+    }
+
+    try:
+        for nodos in args.tamanos:
+            inicio = time.perf_counter()
+            ctx = preparar(directorio, nodos, args)
+            print(f"[{nodos} nodos] árbol generado en {time.perf_counter() - inicio:.1f}s")
+            for nombre in herramientas:
+                resultado = {'herramienta': nombre, 'nodos': nodos}
+                try:
+                    resultado.update(medir(HERRAMIENTAS[nombre], ctx, args.repeticiones))
+                    print(f"  {nombre:<40} {resultado['segundos_mediana']:.4f}s  "
+                          f"pico {resultado['pico_memoria_bytes'] / 1e6:.1f}MB")
+                except Exception as e:
+                    resultado['error'] = f"{type(e).__name__}: {e}"
+                    print(f"  {nombre:<40} FALLO ({resultado['error']})", file=sys.stderr)
+                informe['resultados'].append(resultado)
+            if not args.conservar:
+                shutil.rmtree(ctx.raiz, ignore_errors=True)
+                shutil.rmtree(ctx.directorio_json, ignore_errors=True)
+    finally:
+        if not args.conservar and not args.directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    return informe
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmarks de las herramientas MCP sobre árboles sintéticos')
+    parser.add_argument('--tamanos', type=int, nargs='+', default=TAMANOS_POR_DEFECTO,
+                        help='Número aproximado de nodos de cada árbol')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--archivos-por-directorio', type=int, default=8)
+    parser.add_argument('--ramificacion', type=int, default=4)
+    parser.add_argument('--tamano-archivo', type=int, default=256, help='Bytes por archivo')
+    parser.add_argument('--palabras-descripcion', type=int, default=8)
+    parser.add_argument('--vocabulario', help='Archivo de texto cuyas palabras se usan para nombres, contenidos y descripciones')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--herramientas', nargs='+', choices=list(HERRAMIENTAS))
+    parser.add_argument('--directorio', help='Dónde generar los árboles (temporal por defecto)')
+    parser.add_argument('--conservar', action='store_true', help='No borrar los árboles generados')
+    parser.add_argument('--salida', help='Archivo JSON de resultados')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior con el que comparar')
+    args = parser.parse_args(argv)
+
+    informe = ejecutar(args)
+
+    salida = args.salida or os.path.join(
+        RAIZ_REPO, 'benchmarks', 'resultados', f"{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, ensure_ascii=False, indent=4)
+    print(f"Resultados guardados en: {salida}")
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            comparar(informe, json.load(f))
+
+    fallidas = sorted({r['herramienta'] for r in informe['resultados'] if 'error' in r})
+    if fallidas:
+        sys.exit(f"Herramientas que no se pudieron medir: {', '.join(fallidas)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import json
+import os
+import random
+from collections import deque
+from typing import Dict, List, Optional
+
+# Vocabulario por defecto para nombres, contenidos y descripciones
+VOCABULARIO = (
+    'ventas facturas informes financieros clientes proveedores contratos nominas '
+    'recursos humanos marketing proyectos presupuesto auditoria contabilidad '
+    'impuestos compras logistica inventario calidad legal actas reuniones '
+    'trimestral anual mensual resumen borrador final revisado aprobado'
+).split()
+
+EXTENSIONES = ('.txt', '.md', '.csv', '.log', '.json')
+
+
+def parametros_para(nodos: int, archivos_por_directorio: int = 8, ramificacion: int = 4) -> Dict:
+    """
+    Calcula la profundidad necesaria para que un árbol con la ramificación y los
+    archivos por directorio dados tenga aproximadamente 'nodos' nodos.
+    """
+    profundidad = 0
+    total = 1 + archivos_por_directorio
+    while total < nodos:
+        profundidad += 1
+        directorios_nivel = ramificacion ** profundidad
+        total += directorios_nivel * (1 + archivos_por_directorio)
+    return {
+        'profundidad': profundidad,
+        'ramificacion': ramificacion,
+        'archivos_por_directorio': archivos_por_directorio,
+        'max_nodos': nodos
+    }
+
+
+def _texto(aleatorio: random.Random, palabras: List[str], tamano: int) -> str:
+    partes = []
+    longitud = 0
+    while longitud < tamano:
+        linea = ' '.join(aleatorio.choices(palabras, k=10)) + '\n'
+        partes.append(linea)
+        longitud += len(linea)
+    return ''.join(partes)[:tamano]
+
+
+def generar_arbol(
+    destino: str,
+    profundidad: int,
+    ramificacion: int,
+    archivos_por_directorio: int,
+    tamano_archivo: int = 256,
+    max_nodos: Optional[int] = None,
+    palabras: Optional[List[str]] = None,
+    semilla: int = 0
+) -> Dict:
+    """
+    Crea en disco un árbol sintético determinista: con los mismos parámetros y la
+    misma semilla se generan siempre los mismos nombres y contenidos.
+
+    Args:
+        destino: Directorio raíz a crear
+        profundidad: Niveles de subdirectorios bajo la raíz
+        ramificacion: Subdirectorios por directorio
+        archivos_por_directorio: Archivos en cada directorio
+        tamano_archivo: Bytes de texto de cada archivo
+        max_nodos: Corta la generación al llegar a este número de nodos
+        palabras: Vocabulario para nombres y contenidos (VOCABULARIO por defecto)
+        semilla: Semilla del generador aleatorio
+
+    Returns:
+        dict: Número de directorios, archivos y bytes escritos
+    """
+    aleatorio = random.Random(semilla)
+    palabras = palabras or VOCABULARIO
+    conteo = {'directorios': 0, 'archivos': 0, 'bytes': 0}
+    cola = deque([(destino, 0)])
+    while cola:
+        directorio, nivel = cola.popleft()
+        os.makedirs(directorio, exist_ok=True)
+        conteo['directorios'] += 1
+        for i in range(archivos_por_directorio):
+            if max_nodos and conteo['directorios'] + conteo['archivos'] >= max_nodos:
+                return conteo
+            nombre = f"{aleatorio.choice(palabras)}_{i}{aleatorio.choice(EXTENSIONES)}"
+            contenido = _texto(aleatorio, palabras, tamano_archivo)
+            with open(os.path.join(directorio, nombre), 'w', encoding='utf-8') as f:
+                f.write(contenido)
+            conteo['archivos'] += 1
+            conteo['bytes'] += len(contenido)
+        if nivel < profundidad:
+            for i in range(ramificacion):
+                nombre = f"{aleatorio.choice(palabras)}_{nivel + 1}_{i}"
+                cola.append((os.path.join(directorio, nombre), nivel + 1))
+    return conteo
+
+
+def describir_estructura(
+    estructura: Dict,
+    palabras: Optional[List[str]] = None,
+    palabras_por_descripcion: int = 8,
+    semilla: int = 0
+) -> Dict:
+    """Asigna a cada directorio una descripción determinista tomada del vocabulario."""
+    aleatorio = random.Random(semilla)
+    palabras = palabras or VOCABULARIO
+    pila = [estructura]
+    while pila:
+        nodo = pila.pop()
+        if nodo.get('type') == 'directory':
+            nodo['description'] = ' '.join(aleatorio.choices(palabras, k=palabras_por_descripcion))
+            pila.extend(reversed(nodo.get('children', [])))
+    return estructura
+
+
+def guardar_estructura_sintetica(estructura: Dict, ruta_json: str):
+    os.makedirs(os.path.dirname(ruta_json), exist_ok=True)
+    with open(ruta_json, 'w', encoding='utf-8') as f:
+        json.dump(estructura, f, ensure_ascii=False, indent=4)
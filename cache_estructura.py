@@ -0,0 +1,543 @@
+import functools
+import hashlib
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from arbol_compacto import ArbolCompacto
+from metricas import registrar_bytes_leidos
+from registro_cambios import (SINCRONIZAR, UMBRAL_BYTES, UMBRAL_CAMBIOS, anexar, aplicar_cambios,
+                              bloqueo_registro, leer_registro, recortar_registro, ruta_registro)
+
+# Caché de estructuras cargadas: ruta absoluta -> (firma del archivo y su registro, estructura)
+_CACHE: Dict[str, Tuple[Tuple[int, int, int, int], Dict]] = {}
+# La misma estructura en forma de ArbolCompacto (ver cargar_compacto). Cada ruta
+# está en una sola de las dos cachés: al cargarla en una forma se suelta la otra
+_CACHE_COMPACTO: Dict[str, Tuple[Tuple[int, int, int, int], ArbolCompacto]] = {}
+# Datos derivados (índices): ruta absoluta -> {nombre: (estructura de origen, valor)}.
+# Un derivado solo vale mientras su estructura de origen sea la cacheada.
+_DERIVADOS: Dict[str, Dict[str, Tuple[Dict, Any]]] = {}
+_LOCK = threading.Lock()
+# Cambios en el registro pendientes de compactar, por ruta absoluta
+_PENDIENTES: Dict[str, int] = {}
+_COMPACTANDO = set()
+# Serializa escrituras del archivo base (los anexos no esperan al volcado). El
+# registro se protege con registro_cambios.bloqueo_registro, también entre procesos
+_LOCK_BASE = threading.RLock()
+# Versión de cada ruta (ver version_estructura) y firma del archivo con la que se calculó
+_VERSIONES: Dict[str, int] = {}
+_FIRMAS_VERSION: Dict[str, Optional[Tuple[int, int, int, int]]] = {}
+# Cambios en sitio (marcar_derivados_obsoletos) sin volcar al archivo base desde la última carga
+_EDICIONES: Dict[str, int] = {}
+# Distingue este proceso en huella_estructura mientras haya cambios solo en memoria
+_SESION = os.urandom(8).hex()
+
+
+class _LecturaEdicion:
+    """
+    Lock de lectores y editor de las estructuras cacheadas: las herramientas
+    las recorren a la vez (lectura) y quien les cambia nodos en segundo plano
+    (el vigilante) espera a que terminen las que ya estaban y excluye a las
+    nuevas mientras edita. Un hilo que ya lee (una herramienta que llama a otra)
+    no espera al editor; el editor es reentrante y también puede leer.
+    """
+
+    def __init__(self):
+        self._condicion = threading.Condition(threading.Lock())
+        self._lectores = 0
+        self._esperando = 0
+        self._editor: Optional[int] = None
+        self._niveles = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def lectura(self):
+        nivel = getattr(self._local, 'nivel', 0)
+        propio = nivel or self._editor == threading.get_ident()
+        if not propio:
+            with self._condicion:
+                while self._editor is not None or self._esperando:
+                    self._condicion.wait()
+                self._lectores += 1
+        self._local.nivel = nivel + 1
+        try:
+            yield
+        finally:
+            self._local.nivel = nivel
+            if not propio:
+                with self._condicion:
+                    self._lectores -= 1
+                    if not self._lectores:
+                        self._condicion.notify_all()
+
+    @contextmanager
+    def edicion(self):
+        hilo = threading.get_ident()
+        with self._condicion:
+            if self._editor != hilo:
+                self._esperando += 1
+                try:
+                    while self._editor is not None or self._lectores:
+                        self._condicion.wait()
+                finally:
+                    self._esperando -= 1
+                self._editor = hilo
+            self._niveles += 1
+        try:
+            yield
+        finally:
+            with self._condicion:
+                self._niveles -= 1
+                if not self._niveles:
+                    self._editor = None
+                    self._condicion.notify_all()
+
+
+_LECTURA_EDICION = _LecturaEdicion()
+
+
+def lectura_estructuras():
+    """
+    Context manager para recorrer estructuras cacheadas sin que el vigilante
+    las modifique a la vez. Varias lecturas pueden ir en paralelo.
+    """
+    return _LECTURA_EDICION.lectura()
+
+
+def edicion_estructuras():
+    """
+    Context manager para modificar en sitio estructuras cacheadas desde segundo
+    plano: espera a que terminen las lecturas en curso y no deja empezar otras.
+    """
+    return _LECTURA_EDICION.edicion()
+
+
+def compartiendo_estructuras(funcion: Callable) -> Callable:
+    """Decorador para herramientas: ejecuta la función con lectura_estructuras tomado."""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        with lectura_estructuras():
+            return funcion(*args, **kwargs)
+    return envoltura
+
+
+def _actual(clave: str) -> Optional[Dict]:
+    entrada = _CACHE.get(clave)
+    return entrada[1] if entrada is not None else None
+
+
+def _cacheada(clave: str) -> Optional[Tuple[Tuple[int, int, int, int], Union[Dict, ArbolCompacto]]]:
+    # Se llama con _LOCK tomado
+    entrada = _CACHE.get(clave)
+    return entrada if entrada is not None else _CACHE_COMPACTO.get(clave)
+
+
+def _cachear(clave: str, firma: Tuple[int, int, int, int], estructura: Union[Dict, ArbolCompacto]):
+    # Se llama con _LOCK tomado
+    if isinstance(estructura, ArbolCompacto):
+        _CACHE_COMPACTO[clave] = (firma, estructura)
+        _CACHE.pop(clave, None)
+        _DERIVADOS.pop(clave, None)
+    else:
+        _CACHE[clave] = (firma, estructura)
+        _CACHE_COMPACTO.pop(clave, None)
+
+
+def _firma(ruta: str) -> Tuple[int, int, int, int]:
+    stat = os.stat(ruta)
+    try:
+        stat_registro = os.stat(ruta_registro(ruta))
+        registro = (stat_registro.st_mtime_ns, stat_registro.st_size)
+    except FileNotFoundError:
+        registro = (0, 0)
+    return (stat.st_mtime_ns, stat.st_size) + registro
+
+
+def _leer_base(clave: str) -> Tuple[Tuple[int, int, int, int], Dict, List[Dict]]:
+    """Lee el archivo base y su registro; devuelve la firma, la estructura y los cambios sin aplicar."""
+    registro = ruta_registro(clave)
+    # Base y registro se leen con el registro bloqueado: otro proceso no puede
+    # compactar entre las dos lecturas ni dejar un anexo a medias. Lo que no se
+    # pueda leer es la cola de una escritura interrumpida, y se corta para que
+    # los próximos cambios no queden detrás
+    with bloqueo_registro(clave):
+        firma = _firma(clave)
+        with open(clave, 'r', encoding='utf-8') as f:
+            estructura = json.load(f)
+        cambios, bytes_registro = leer_registro(registro)
+        if os.path.exists(registro) and bytes_registro < os.path.getsize(registro):
+            os.truncate(registro, bytes_registro)
+            firma = _firma(clave)
+    registrar_bytes_leidos(firma[1] + bytes_registro)
+    return firma, estructura, cambios
+
+
+def cargar_estructura(ruta: str) -> Dict:
+    """
+    Devuelve la estructura guardada en un archivo JSON con los cambios de su
+    registro (estructura.json.wal) aplicados, parseándolo solo si alguno de los
+    dos ha cambiado en disco desde la última carga (según mtime y tamaño).
+    Si la ruta está cacheada como ArbolCompacto se convierte en lugar de releerla.
+
+    El diccionario devuelto es compartido: quien lo modifique debe guardarlo
+    después con guardar_estructura o registrar_cambios para que caché y disco
+    sigan coincidiendo.
+
+    Raises:
+        OSError, json.JSONDecodeError: Igual que open + json.load
+    """
+    clave = os.path.abspath(ruta)
+    firma = _firma(clave)
+    with _LOCK:
+        entrada = _CACHE.get(clave)
+        if entrada is not None and entrada[0] == firma:
+            return entrada[1]
+        compacto = _CACHE_COMPACTO.get(clave)
+
+    if compacto is not None and compacto[0] == firma:
+        # Conserva los cambios en memoria del árbol (y sus contadores)
+        estructura = compacto[1].a_estructura()
+        with _LOCK:
+            _cachear(clave, firma, estructura)
+        return estructura
+
+    firma, estructura, cambios = _leer_base(clave)
+    aplicar_cambios(estructura, cambios)
+
+    with _LOCK:
+        _cachear(clave, firma, estructura)
+        _PENDIENTES[clave] = len(cambios)
+        _EDICIONES.pop(clave, None)
+    return estructura
+
+
+def cargar_compacto(ruta: str) -> ArbolCompacto:
+    """
+    Como cargar_estructura, pero devuelve y cachea la estructura como
+    ArbolCompacto (ver arbol_compacto.py) y suelta la forma anidada y sus
+    derivados: mientras la ruta se use así, en memoria solo queda el árbol
+    compacto. El JSON se sigue parseando entero al cargarlo.
+
+    El árbol devuelto es compartido: quien lo modifique debe guardarlo después
+    con guardar_compacto o registrar_cambios.
+
+    Raises:
+        OSError, json.JSONDecodeError: Igual que open + json.load
+    """
+    clave = os.path.abspath(ruta)
+    firma = _firma(clave)
+    with _LOCK:
+        entrada = _CACHE_COMPACTO.get(clave)
+        if entrada is not None and entrada[0] == firma:
+            return entrada[1]
+        anidada = _CACHE.get(clave)
+
+    if anidada is not None and anidada[0] == firma:
+        arbol = ArbolCompacto.desde_estructura(anidada[1])
+        with _LOCK:
+            _cachear(clave, firma, arbol)
+        return arbol
+
+    firma, estructura, cambios = _leer_base(clave)
+    arbol = ArbolCompacto.desde_estructura(estructura)
+    del estructura
+    arbol.aplicar_cambios(cambios)
+
+    with _LOCK:
+        _cachear(clave, firma, arbol)
+        _PENDIENTES[clave] = len(cambios)
+        _EDICIONES.pop(clave, None)
+    return arbol
+
+
+def _escribir_base(clave: str, estructura: Union[Dict, ArbolCompacto]):
+    """
+    Escribe la estructura en un temporal y lo renombra sobre el archivo base, de
+    forma que un fallo a mitad nunca deja un JSON a medias. Después descarta del
+    registro lo que ya estaba escrito al empezar: esos cambios se aplicaron en
+    memoria antes de anotarse, así que están en el volcado. Lo anotado durante
+    el volcado se conserva (reaplicarlo es inocuo).
+    """
+    if isinstance(estructura, ArbolCompacto):
+        aplicar = estructura.aplicar_cambios
+        volcar = estructura.volcar
+    else:
+        aplicar = functools.partial(aplicar_cambios, estructura)
+        volcar = functools.partial(json.dump, estructura, ensure_ascii=False, indent=4)
+    registro = ruta_registro(clave)
+    with _LOCK_BASE:
+        with bloqueo_registro(clave):
+            try:
+                inicio_registro = os.path.getsize(registro)
+            except FileNotFoundError:
+                inicio_registro = 0
+            with _LOCK:
+                entrada = _cacheada(clave)
+            if inicio_registro and entrada is not None and entrada[1] is estructura and entrada[0] != _firma(clave):
+                # Otro proceso ha anotado cambios que la estructura cacheada no tiene:
+                # se incorporan antes del volcado (son idempotentes) para no perderlos al recortar
+                aplicar(leer_registro(registro)[0])
+        temporal = f"{clave}.tmp"
+        try:
+            with open(temporal, 'w', encoding='utf-8') as f:
+                volcar(f)
+                f.flush()
+                if SINCRONIZAR:
+                    os.fsync(f.fileno())
+            os.replace(temporal, clave)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        with bloqueo_registro(clave):
+            if inicio_registro:
+                recortar_registro(registro, inicio_registro)
+            # Lo anotado durante el volcado puede venir de otro proceso: se aplica
+            # para que la estructura cacheada corresponda a la firma que se guarda
+            restantes = leer_registro(registro)[0]
+            aplicar(restantes)
+            firma = _firma(clave)
+            with _LOCK:
+                _cachear(clave, firma, estructura)
+                _PENDIENTES[clave] = len(restantes)
+                _EDICIONES.pop(clave, None)
+
+
+def guardar_estructura(ruta: str, estructura: Dict):
+    """
+    Escribe la estructura en disco (de forma atómica) y actualiza la caché con
+    ella, de forma que la siguiente carga no vuelva a parsear el archivo recién
+    escrito. Los cambios del registro quedan incorporados y se descartan.
+    Si es el mismo objeto ya cacheado (modificado en sitio) se conservan sus
+    derivados, que quien lo modificó debe haber mantenido al día.
+    Si la escritura falla, la entrada se invalida.
+    """
+    clave = os.path.abspath(ruta)
+    try:
+        _escribir_base(clave, estructura)
+    except Exception:
+        invalidar(clave)
+        raise
+
+
+def guardar_compacto(ruta: str, arbol: ArbolCompacto):
+    """
+    Como guardar_estructura, para un ArbolCompacto: lo escribe nodo a nodo con
+    el mismo JSON que daría la estructura anidada y lo deja en caché en lugar
+    de ella (ver cargar_compacto).
+    """
+    clave = os.path.abspath(ruta)
+    try:
+        _escribir_base(clave, arbol)
+    except Exception:
+        invalidar(clave)
+        raise
+
+
+def registrar_cambios(
+    ruta: str,
+    cambios: List[Dict],
+    estructura: Optional[Union[Dict, ArbolCompacto]] = None
+):
+    """
+    Anota en el registro de la estructura cambios ya aplicados en sitio sobre la
+    estructura cacheada (ver registro_cambios.cambio_descripcion/cambio_metadatos).
+    Solo se escriben los cambios, no el árbol: el coste depende del tamaño del
+    cambio. Al superar UMBRAL_CAMBIOS o UMBRAL_BYTES se compacta el registro en
+    el archivo base en segundo plano.
+
+    Si se indica la estructura (o el ArbolCompacto) modificada y ya no es la
+    cacheada, p. ej. porque otra herramienta la ha convertido a la otra forma
+    mientras tanto, la caché se descarta en lugar de darla por al día.
+    """
+    clave = os.path.abspath(ruta)
+    with bloqueo_registro(clave):
+        firma_previa = _firma(clave)
+        tamano = anexar(ruta_registro(clave), cambios)
+        firma = _firma(clave)
+    with _LOCK:
+        entrada = _cacheada(clave)
+        if entrada is not None and entrada[0] == firma_previa and (estructura is None or estructura is entrada[1]):
+            _cachear(clave, firma, entrada[1])
+        else:
+            # Alguien más tocó el archivo: la próxima carga relee base y registro
+            _CACHE.pop(clave, None)
+            _CACHE_COMPACTO.pop(clave, None)
+        pendientes = _PENDIENTES[clave] = _PENDIENTES.get(clave, 0) + len(cambios)
+        compactar_ya = (pendientes >= UMBRAL_CAMBIOS or tamano >= UMBRAL_BYTES) and clave not in _COMPACTANDO
+        if compactar_ya:
+            _COMPACTANDO.add(clave)
+    if compactar_ya:
+        threading.Thread(target=_compactar_en_segundo_plano, args=(clave,), name='compactar_registro', daemon=True).start()
+
+
+def compactar(ruta: str) -> bool:
+    """
+    Incorpora el registro de cambios al archivo base (reemplazo atómico) y lo vacía.
+
+    Returns:
+        bool: False si la estructura cambió durante el volcado y hay que reintentar
+    """
+    clave = os.path.abspath(ruta)
+    if not os.path.exists(ruta_registro(clave)):
+        return True
+    with _LOCK:
+        compacto = clave in _CACHE_COMPACTO
+    # Se vuelca la forma en la que esté cacheada, sin convertirla
+    estructura = cargar_compacto(clave) if compacto else cargar_estructura(clave)
+    try:
+        _escribir_base(clave, estructura)
+    except RuntimeError:
+        # Un nodo se modificó mientras se serializaba; los cambios siguen en el registro
+        return False
+    return True
+
+
+def _compactar_en_segundo_plano(clave: str):
+    try:
+        with lectura_estructuras():
+            compactar(clave)
+    except Exception as e:
+        # stdout es el canal del protocolo MCP
+        print(f"Error al compactar el registro de {clave}: {e}", file=sys.stderr)
+    finally:
+        with _LOCK:
+            _COMPACTANDO.discard(clave)
+
+
+def derivado(
+    ruta: str,
+    nombre: str,
+    construir: Callable[[Dict], Any],
+    actualizar: Optional[Callable[[Any, Dict], Any]] = None
+) -> Any:
+    """
+    Devuelve un dato derivado (p. ej. un índice) de la estructura de la ruta,
+    construyéndolo con construir(estructura) solo cuando la estructura se recarga.
+    Si se indica actualizar(valor_anterior, estructura), tras una recarga se
+    aprovecha el valor anterior en lugar de construirlo desde cero.
+    """
+    clave = os.path.abspath(ruta)
+    estructura = cargar_estructura(clave)
+    with _LOCK:
+        previo = _DERIVADOS.get(clave, {}).get(nombre)
+    if previo is not None and previo[0] is estructura:
+        return previo[1]
+
+    if previo is not None and actualizar is not None:
+        valor = actualizar(previo[1], estructura)
+    else:
+        valor = construir(estructura)
+    with _LOCK:
+        if _actual(clave) is estructura:
+            _DERIVADOS.setdefault(clave, {})[nombre] = (estructura, valor)
+    return valor
+
+
+def derivado_construido(ruta: str, nombre: str) -> Optional[Any]:
+    """Devuelve el derivado si ya está construido para la estructura cacheada, sin construirlo."""
+    clave = os.path.abspath(ruta)
+    with _LOCK:
+        previo = _DERIVADOS.get(clave, {}).get(nombre)
+        if previo is not None and previo[0] is _actual(clave):
+            return previo[1]
+    return None
+
+
+def fijar_derivado(ruta: str, nombre: str, estructura: Dict, valor: Any):
+    """
+    Registra un derivado ya calculado, p. ej. por el rastreo que acaba de generar
+    la estructura, para que la primera consulta no tenga que construirlo. Solo
+    se guarda si la estructura sigue siendo la cacheada.
+    """
+    clave = os.path.abspath(ruta)
+    with _LOCK:
+        if _actual(clave) is estructura:
+            _DERIVADOS.setdefault(clave, {})[nombre] = (estructura, valor)
+
+
+def marcar_derivados_obsoletos(ruta: str, nombres: Optional[List[str]] = None):
+    """
+    Marca los derivados de una ruta (todos, o solo los indicados) como desfasados
+    tras modificar en sitio la estructura cacheada (p. ej. al añadir o quitar
+    nodos). La próxima llamada a derivado los pondrá al día con su función
+    actualizar, o los reconstruirá.
+    """
+    clave = os.path.abspath(ruta)
+    with _LOCK:
+        _nueva_version(clave)
+        _EDICIONES[clave] = _EDICIONES.get(clave, 0) + 1
+        derivados = _DERIVADOS.get(clave, {})
+        for nombre, (_, valor) in derivados.items():
+            if nombres is None or nombre in nombres:
+                derivados[nombre] = (None, valor)
+
+
+def _nueva_version(clave: str):
+    # Se llama con _LOCK tomado
+    _VERSIONES[clave] = _VERSIONES.get(clave, 0) + 1
+
+
+def version_estructura(ruta: str) -> int:
+    """
+    Número de versión de la estructura de una ruta, que sube cada vez que el
+    árbol o sus descripciones cambian: en disco (el archivo o su registro de
+    cambios son distintos de la última vez que se consultó) o en memoria
+    (marcar_derivados_obsoletos tras modificarla en sitio). Sirve de clave
+    para cachear resultados calculados sobre la estructura.
+    """
+    clave = os.path.abspath(ruta)
+    try:
+        firma = _firma(clave)
+    except FileNotFoundError:
+        firma = None
+    with _LOCK:
+        if clave not in _VERSIONES or _FIRMAS_VERSION.get(clave) != firma:
+            _FIRMAS_VERSION[clave] = firma
+            _nueva_version(clave)
+        return _VERSIONES[clave]
+
+
+def huella_estructura(ruta: str) -> int:
+    """
+    Identificador de la versión de la estructura de una ruta que, a diferencia
+    de version_estructura, se mantiene entre reinicios: sale de la firma del
+    archivo y su registro (la de la estructura cacheada, si la hay). Si la
+    estructura tiene cambios en sitio aún sin volcar al archivo base, incluye
+    también este proceso, porque otro no vería esos cambios.
+    """
+    clave = os.path.abspath(ruta)
+    with _LOCK:
+        entrada = _cacheada(clave)
+        firma = entrada[0] if entrada is not None else None
+        ediciones = _EDICIONES.get(clave, 0)
+    if firma is None:
+        try:
+            firma = _firma(clave)
+        except FileNotFoundError:
+            firma = None
+    datos = repr((clave, firma, ediciones, _SESION if ediciones else None)).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(datos, digest_size=8).digest(), 'big')
+
+
+def invalidar(ruta: Optional[str] = None):
+    """Descarta la entrada de una ruta, o toda la caché si no se indica ninguna."""
+    with _LOCK:
+        if ruta is None:
+            for clave in _VERSIONES:
+                _nueva_version(clave)
+            _CACHE.clear()
+            _CACHE_COMPACTO.clear()
+            _DERIVADOS.clear()
+            _PENDIENTES.clear()
+            _EDICIONES.clear()
+        else:
+            _nueva_version(os.path.abspath(ruta))
+            _CACHE.pop(os.path.abspath(ruta), None)
+            _CACHE_COMPACTO.pop(os.path.abspath(ruta), None)
+            _DERIVADOS.pop(os.path.abspath(ruta), None)
+            _PENDIENTES.pop(os.path.abspath(ruta), None)
+            _EDICIONES.pop(os.path.abspath(ruta), None)
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+# Marca de "no está en la caché" (None puede ser un resultado válido)
+AUSENTE = object()
+
+
+class CacheResultados:
+    """
+    Caché LRU de resultados de consultas sobre una estructura. Cada entrada se
+    guarda con la versión de la estructura con la que se calculó (ver
+    cache_estructura.version_estructura); al consultarla con otra versión se
+    descarta, así que un resultado deja de servirse justo cuando queda desfasado.
+    Cuenta aciertos, fallos, entradas desfasadas y expulsiones para dimensionarla.
+    """
+
+    def __init__(self, max_entradas: int = 256):
+        self.max_entradas = max(1, max_entradas)
+        self._entradas: 'OrderedDict[Hashable, Tuple[Hashable, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desfasados = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave: Hashable, version: Hashable) -> Any:
+        """Resultado guardado para la clave y esa versión, o AUSENTE."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == version:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            if entrada is not None:
+                del self._entradas[clave]
+                self.desfasados += 1
+            self.fallos += 1
+            return AUSENTE
+
+    def guardar(self, clave: Hashable, version: Hashable, resultado: Any):
+        with self._lock:
+            self._entradas[clave] = (version, resultado)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+
+    def limpiar(self, reiniciar_contadores: bool = False):
+        with self._lock:
+            self._entradas.clear()
+            if reiniciar_contadores:
+                self.aciertos = self.fallos = self.desfasados = self.expulsiones = 0
+
+    def estado(self) -> Dict:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'max_entradas': self.max_entradas,
+                'entradas': len(self._entradas),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else 0.0,
+                'desfasados': self.desfasados,
+                'expulsiones': self.expulsiones
+            }
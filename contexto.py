@@ -0,0 +1,197 @@
+import heapq
+import os
+from typing import Dict, List, Optional, Tuple
+
+from almacen_fragmentos import en_paralelo, es_almacen_fragmentos
+from escaneo_contenido import es_binario
+from indice_bm25 import indice_bm25, tokenizar
+from indices import indice_directorios
+from lectura import leer_lote
+
+# Relevancia BM25 mínima (de 0 a 1) para que un directorio entre en el contexto
+RELEVANCIA_MINIMA = 0.1
+
+# Bytes iniciales que se miran para descartar archivos binarios antes de repartir el presupuesto
+TAMANO_MUESTRA = 1024
+
+# Bytes que se reservan por archivo para la marca de truncado que añade lectura.leer_fragmento
+RESERVA_MARCA = 100
+
+
+def _buscar(ruta_json: str, prompt: str, k: int) -> List[Tuple[Dict, float, str]]:
+    return [(documento, relevancia, ruta_json) for documento, relevancia in indice_bm25(ruta_json).buscar(prompt, k)]
+
+
+def directorios_relevantes(ruta: str, prompt: str, k: int = 3) -> List[Tuple[Dict, float, str]]:
+    """
+    Los k directorios más relevantes para el prompt según el índice BM25 de la
+    estructura (o de todos los fragmentos de un almacén, consultados a la vez).
+
+    Returns:
+        list: (documento BM25, relevancia, ruta del JSON que lo contiene), de mayor
+              a menor relevancia y por encima de RELEVANCIA_MINIMA
+    """
+    if es_almacen_fragmentos(ruta):
+        # La relevancia ya está normalizada a [0, 1] en cada fragmento
+        partes = en_paralelo(ruta, lambda ruta_json: _buscar(ruta_json, prompt, k))
+        candidatos = heapq.nlargest(k, (trio for _, trios in partes for trio in trios), key=lambda trio: trio[1])
+    else:
+        candidatos = _buscar(ruta, prompt, k)
+    return [trio for trio in candidatos if trio[1] > RELEVANCIA_MINIMA]
+
+
+def archivos_candidatos(
+    directorios: List[Tuple[Dict, float, str]],
+    prompt: str,
+    max_archivos: int = 8,
+    profundidad: int = 1
+) -> List[Dict]:
+    """
+    Elige los archivos de texto que leer de los directorios relevantes: los de
+    cada directorio y sus subdirectorios hasta 'profundidad' niveles. Primero los
+    que tienen en el nombre más términos del prompt; a igualdad, los del
+    directorio más relevante y los menos profundos. Los vacíos y los binarios
+    (según sus primeros TAMANO_MUESTRA bytes) se descartan.
+
+    Returns:
+        list: Hasta max_archivos {"path", "directorio", "coincidencias"}
+    """
+    terminos = set(tokenizar(prompt))
+    candidatos = []
+    vistos = set()
+    for posicion, (documento, _, ruta_json) in enumerate(directorios):
+        raiz = indice_directorios(ruta_json).por_full_path.get(documento['full_path'])
+        if raiz is None:
+            continue
+        pila = [(raiz, 0)]
+        while pila:
+            nodo, nivel = pila.pop()
+            for hijo in nodo.get('children', []):
+                if hijo.get('type') == 'directory' and nivel < profundidad:
+                    pila.append((hijo, nivel + 1))
+                elif hijo.get('type') == 'file' and hijo.get('full_path') and hijo['full_path'] not in vistos:
+                    vistos.add(hijo['full_path'])
+                    coincidencias = len(terminos & set(tokenizar(hijo.get('name', ''))))
+                    candidatos.append(((-coincidencias, posicion, nivel, len(candidatos)), {
+                        'path': hijo['full_path'],
+                        'directorio': documento['full_path'],
+                        'coincidencias': coincidencias
+                    }))
+    candidatos.sort(key=lambda par: par[0])
+
+    elegidos = []
+    for _, candidato in candidatos:
+        if len(elegidos) >= max_archivos:
+            break
+        try:
+            with open(candidato['path'], 'rb') as f:
+                muestra = f.read(TAMANO_MUESTRA)
+        except OSError:
+            continue
+        if muestra and not es_binario(muestra):
+            elegidos.append(candidato)
+    return elegidos
+
+
+def _recortar_utf8(texto: str, max_bytes: int) -> str:
+    """Los primeros max_bytes bytes del texto en UTF-8, sin partir ningún carácter."""
+    return texto.encode('utf-8')[:max(0, max_bytes)].decode('utf-8', errors='ignore')
+
+
+def ajustar_directorios(directorios: List[Dict], presupuesto: int) -> Tuple[List[Dict], int]:
+    """
+    Deja los directorios (de más a menos relevante) que caben en el presupuesto
+    contando su full_path y su descripción. El primero que no cabe entero entra
+    con la descripción recortada ('descripcion_truncada') si cabe al menos su
+    full_path; ese y los siguientes se descartan si no.
+
+    Returns:
+        Tuple[list, int]: (directorios que entran, bytes que ocupan)
+    """
+    elegidos = []
+    usados = 0
+    for directorio in directorios:
+        ruta = len(directorio['full_path'].encode('utf-8'))
+        descripcion = len(directorio['descripcion'].encode('utf-8'))
+        if usados + ruta + descripcion <= presupuesto:
+            elegidos.append(directorio)
+            usados += ruta + descripcion
+            continue
+        if usados + ruta < presupuesto:
+            recortada = _recortar_utf8(directorio['descripcion'], presupuesto - usados - ruta)
+            elegidos.append(dict(directorio, descripcion=recortada, descripcion_truncada=True))
+            usados += ruta + len(recortada.encode('utf-8'))
+        break
+    return elegidos, usados
+
+
+def repartir(tamanos: List[int], presupuesto: int, max_bytes_archivo: Optional[int] = None) -> List[int]:
+    """
+    Reparte el presupuesto entre archivos a partes iguales, pasando lo que no usa
+    un archivo pequeño a los demás: nadie recibe menos que su parte justa si lo necesita.
+
+    Returns:
+        list: Bytes asignados a cada archivo, en el mismo orden
+    """
+    asignaciones = [0] * len(tamanos)
+    restante = max(0, presupuesto)
+    orden = sorted(range(len(tamanos)), key=lambda i: tamanos[i])
+    for pendientes, i in zip(range(len(orden), 0, -1), orden):
+        parte = restante // pendientes
+        if max_bytes_archivo is not None:
+            parte = min(parte, max_bytes_archivo)
+        asignaciones[i] = min(tamanos[i], parte)
+        restante -= asignaciones[i]
+    return asignaciones
+
+
+def leer_extractos(
+    archivos: List[Dict],
+    presupuesto: int,
+    max_bytes_archivo: Optional[int] = None
+) -> Dict:
+    """
+    Lee el principio de cada archivo sin pasarse del presupuesto entre todos
+    (ver repartir), en paralelo con lectura.leer_lote. Los recortados llevan al
+    final la marca con el offset para seguir leyendo. El presupuesto se aplica
+    al contenido devuelto (en UTF-8, con las marcas): si aun así se pasa, se
+    quitan archivos desde el último.
+
+    Returns:
+        dict: {"archivos": [{"path", "directorio", "contenido", "bytes_totales", "truncado"}],
+               "bytes_leidos", "bytes_contenido", "presupuesto_agotado"}
+    """
+    tamanos = []
+    for archivo in archivos:
+        try:
+            tamanos.append(os.path.getsize(archivo['path']))
+        except OSError:
+            tamanos.append(0)
+    asignaciones = repartir(tamanos, presupuesto - RESERVA_MARCA * len(archivos), max_bytes_archivo)
+    # Los que se quedan sin presupuesto ni se abren
+    elegidos = [(archivo, asignacion) for archivo, asignacion in zip(archivos, asignaciones) if asignacion > 0]
+
+    lote = leer_lote([{'path': archivo['path'], 'longitud': asignacion} for archivo, asignacion in elegidos])
+    extractos = [
+        {
+            'path': archivo['path'],
+            'directorio': archivo['directorio'],
+            'contenido': resultado['contenido'],
+            'bytes_totales': resultado['bytes_totales'],
+            'truncado': resultado['truncado']
+        }
+        for (archivo, _), resultado in zip(elegidos, lote['resultados'])
+        if not resultado.get('error')
+    ]
+    ocupados = [len(extracto['contenido'].encode('utf-8')) for extracto in extractos]
+    agotado = sum(asignaciones) < sum(tamanos)
+    while extractos and sum(ocupados) > presupuesto:
+        extractos.pop()
+        ocupados.pop()
+        agotado = True
+    return {
+        'archivos': extractos,
+        'bytes_leidos': lote['bytes_leidos'],
+        'bytes_contenido': sum(ocupados),
+        'presupuesto_agotado': agotado
+    }
@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Trabajos de E/S bloqueante (rastreos, lecturas, volcados) que se ejecutan a la
+# vez; el resto espera turno en la cola sin ocupar el bucle de eventos
+MAX_TRABAJOS_IO = int(os.environ.get("MCP_MAX_TRABAJOS_IO", "4"))
+
+
+class Cancelado(Exception):
+    """La llamada que lanzó el trabajo se canceló antes de que terminara."""
+
+
+# Evento de cancelación del trabajo en curso (None fuera del pool)
+_cancelacion: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar(
+    "_cancelacion", default=None
+)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_max_trabajos = MAX_TRABAJOS_IO
+_LOCK = threading.Lock()
+_en_curso = 0
+_en_espera = 0
+_cancelados = 0
+
+
+def cancelado() -> bool:
+    """True si el trabajo en curso se ha cancelado. Fuera del pool siempre es False."""
+    evento = _cancelacion.get()
+    return evento is not None and evento.is_set()
+
+
+def comprobar_cancelacion():
+    """
+    Punto de cancelación para bucles largos: lanza Cancelado si la llamada que
+    lanzó el trabajo se ha cancelado.
+
+    Raises:
+        Cancelado: Si el trabajo en curso está cancelado
+    """
+    if cancelado():
+        raise Cancelado("Operación cancelada")
+
+
+def configurar(max_trabajos: int):
+    """
+    Cambia el número de trabajos simultáneos. Los que ya están en marcha terminan
+    en el pool anterior; los nuevos van al nuevo.
+    """
+    global _pool, _max_trabajos
+    if max_trabajos < 1:
+        raise ValueError("max_trabajos debe ser mayor que 0")
+    with _LOCK:
+        anterior, _pool = _pool, None
+        _max_trabajos = max_trabajos
+    if anterior is not None:
+        anterior.shutdown(wait=False)
+
+
+def _obtener_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _LOCK:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_max_trabajos, thread_name_prefix="trabajo_io")
+        return _pool
+
+
+def estado() -> Dict:
+    """Trabajos en curso, en espera y cancelados desde el arranque, y el límite actual."""
+    with _LOCK:
+        return {
+            "max_trabajos": _max_trabajos,
+            "en_curso": _en_curso,
+            "en_espera": _en_espera,
+            "cancelados": _cancelados
+        }
+
+
+async def ejecutar_bloqueante(funcion: Callable, *args, **kwargs) -> Any:
+    """
+    Ejecuta una función bloqueante en el pool acotado y espera su resultado sin
+    bloquear el bucle de eventos. El trabajo hereda las variables de contexto
+    (métricas de la llamada incluidas).
+
+    Si la corrutina se cancela, un trabajo que aún no ha empezado se descarta y
+    uno en marcha se marca como cancelado: se detiene en su siguiente
+    comprobar_cancelacion().
+    """
+    global _en_espera, _cancelados
+    evento = threading.Event()
+    contexto = contextvars.copy_context()
+    contexto.run(_cancelacion.set, evento)
+
+    def trabajo():
+        global _en_curso, _en_espera
+        with _LOCK:
+            _en_espera -= 1
+            _en_curso += 1
+        try:
+            return contexto.run(funcion, *args, **kwargs)
+        finally:
+            with _LOCK:
+                _en_curso -= 1
+
+    with _LOCK:
+        _en_espera += 1
+    futuro = _obtener_pool().submit(trabajo)
+    try:
+        return await asyncio.wrap_future(futuro)
+    except asyncio.CancelledError:
+        evento.set()
+        with _LOCK:
+            _cancelados += 1
+            if futuro.cancel():
+                # No llegó a empezar: nadie más descontará su espera
+                _en_espera -= 1
+        raise
+
+
+def version_asincrona(funcion: Callable) -> Callable:
+    """
+    Versión async de una herramienta síncrona que la ejecuta con
+    ejecutar_bloqueante. Conserva nombre, docstring y firma, de forma que se
+    registra con @mcp.tool() en lugar de la original, que sigue disponible para
+    llamarla directamente.
+    """
+    @functools.wraps(funcion)
+    async def envoltura(*args, **kwargs):
+        return await ejecutar_bloqueante(funcion, *args, **kwargs)
+    return envoltura
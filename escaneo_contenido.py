@@ -0,0 +1,321 @@
+import atexit
+import codecs
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from indice_trigramas import literales_requeridos
+
+# Bytes iniciales que se examinan para decidir si un archivo es binario
+TAMANO_MUESTRA_BINARIO = 8 * 1024
+
+# A partir de este tamaño el archivo se recorre con mmap en lugar de leerlo entero
+UMBRAL_MMAP = 1024 * 1024
+
+# Por debajo de este número de archivos se escanea en el propio proceso
+MIN_ARCHIVOS_PROCESOS = 16
+
+# Letras ASCII a las que re.IGNORECASE iguala también caracteres no ASCII
+# ('k' coincide con el signo Kelvin); el prefiltro de bytes tiene que incluirlos
+_EQUIVALENTES_NO_ASCII = {'i': '\u0130\u0131', 'k': '\u212a', 's': '\u017f'}
+
+# Bloque con el que se comprueba que todo el archivo es UTF-8 válido
+TAMANO_BLOQUE_VALIDACION = 1024 * 1024
+
+# Pool de procesos compartido por todas las búsquedas. El servidor tiene hilos,
+# así que los procesos no se crean con fork (heredarían locks tomados por otros
+# hilos) sino con forkserver, o spawn donde no existe
+_pool: Optional[ProcessPoolExecutor] = None
+_procesos_pool = 0
+_LOCK = threading.Lock()
+
+
+def es_binario(muestra: bytes) -> bool:
+    """
+    Considera binario un bloque con bytes nulos o que no es UTF-8 válido
+    (una secuencia multibyte cortada al final de la muestra no cuenta).
+    """
+    if b'\0' in muestra:
+        return True
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(muestra, final=False)
+        return False
+    except UnicodeDecodeError:
+        return True
+
+
+def es_utf8_valido(buffer, limite: int) -> bool:
+    """True si los primeros 'limite' bytes del buffer son UTF-8 válido (por bloques, sin copiarlo entero)."""
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for inicio in range(0, limite, TAMANO_BLOQUE_VALIDACION):
+            fin = min(limite, inicio + TAMANO_BLOQUE_VALIDACION)
+            decodificador.decode(buffer[inicio:fin], final=fin == len(buffer))
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _prefiltro_literal(literal: str) -> bytes:
+    """
+    Patrón de bytes que encuentra el literal sin distinguir mayúsculas en el texto
+    UTF-8, incluidas las equivalencias no ASCII de re.IGNORECASE.
+    """
+    partes = []
+    for letra in literal:
+        equivalentes = _EQUIVALENTES_NO_ASCII.get(letra.lower())
+        if equivalentes:
+            opciones = [re.escape(letra.encode('ascii'))] + [re.escape(c.encode('utf-8')) for c in equivalentes]
+            partes.append(b'(?:' + b'|'.join(opciones) + b')')
+        else:
+            partes.append(re.escape(letra.encode('ascii')))
+    return b''.join(partes)
+
+
+@lru_cache(maxsize=64)
+def _compilar(patron: str) -> Tuple[Pattern, Optional[Pattern]]:
+    """
+    Compila el patrón de texto y, si tiene un literal ASCII obligatorio, un patrón
+    de bytes que localiza las líneas candidatas directamente sobre el buffer.
+    Toda línea que coincide con el patrón contiene alguna coincidencia del prefiltro.
+    """
+    regex = re.compile(patron, re.IGNORECASE)
+    literales = [l for l in literales_requeridos(patron) if l.isascii()]
+    if not literales:
+        return regex, None
+    literal = max(literales, key=len)
+    return regex, re.compile(_prefiltro_literal(literal), re.IGNORECASE)
+
+
+def _lineas_candidatas(buffer, prefiltro: Optional[Pattern], limite: int):
+    """Genera (inicio, fin) de las líneas del buffer que pueden coincidir, hasta 'limite'."""
+    if prefiltro is None:
+        inicio = 0
+        while inicio < limite:
+            fin = buffer.find(b'\n', inicio, limite)
+            fin = limite if fin == -1 else fin
+            yield inicio, fin
+            inicio = fin + 1
+        return
+
+    posicion = 0
+    while posicion < limite:
+        encontrado = prefiltro.search(buffer, posicion, limite)
+        if encontrado is None:
+            return
+        inicio = buffer.rfind(b'\n', 0, encontrado.start()) + 1
+        fin = buffer.find(b'\n', encontrado.end(), limite)
+        fin = limite if fin == -1 else fin
+        yield inicio, fin
+        posicion = fin + 1
+
+
+def escanear_archivo(path: str, patron: str, max_coincidencias: Optional[int] = None,
+                     max_bytes: Optional[int] = None) -> Dict:
+    """
+    Busca el patrón línea a línea en un archivo, trabajando sobre bytes y
+    decodificando solo las líneas candidatas. Igual que al leerlo en modo texto,
+    '\\r\\n' y '\\r' también separan líneas, y un archivo que no es UTF-8 válido
+    (en la parte que se escanea) no se busca: se marca como binario, como hace
+    el índice de trigramas con los ILEGIBLE.
+
+    Returns:
+        dict: path, coincidencias [{linea, texto}], bytes_escaneados, y las claves
+              'binario', 'parcial' o 'error' cuando corresponda
+    """
+    resultado = {'path': path, 'coincidencias': [], 'bytes_escaneados': 0}
+    regex, prefiltro = _compilar(patron)
+    try:
+        with open(path, 'rb') as f:
+            muestra = f.read(TAMANO_MUESTRA_BINARIO)
+            if es_binario(muestra):
+                resultado['binario'] = True
+                return resultado
+            tamano = os.fstat(f.fileno()).st_size
+            if tamano == 0:
+                return resultado
+            if tamano >= UMBRAL_MMAP:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = muestra + f.read()
+    except OSError as e:
+        resultado['error'] = str(e)
+        return resultado
+
+    try:
+        limite = len(buffer) if max_bytes is None else min(len(buffer), max_bytes)
+        if not es_utf8_valido(buffer, limite):
+            resultado['binario'] = True
+            return resultado
+        resultado['parcial'] = limite < len(buffer)
+        if buffer.find(b'\r', 0, limite) != -1:
+            # Saltos de línea universales: se normalizan sobre una copia del tramo
+            normalizado = bytes(buffer[:limite]).replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+            buffer = normalizado
+            limite = len(buffer)
+        lineas_previas = 0
+        posicion_previa = 0
+        for inicio, fin in _lineas_candidatas(buffer, prefiltro, limite):
+            linea = bytes(buffer[inicio:fin]).decode('utf-8', errors='replace')
+            if regex.search(linea):
+                # mmap no tiene count(): se cuenta sobre el tramo copiado
+                lineas_previas += buffer[posicion_previa:inicio].count(b'\n')
+                posicion_previa = inicio
+                resultado['coincidencias'].append({
+                    'linea': lineas_previas + 1,
+                    'texto': linea.strip()
+                })
+                if max_coincidencias is not None and len(resultado['coincidencias']) >= max_coincidencias:
+                    resultado['parcial'] = True
+                    limite = fin
+                    break
+        resultado['bytes_escaneados'] = limite
+    finally:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+    return resultado
+
+
+def _obtener_pool(procesos: int) -> ProcessPoolExecutor:
+    """Devuelve el pool compartido, creándolo (o rehaciéndolo con otro tamaño) si hace falta."""
+    global _pool, _procesos_pool
+    anterior = None
+    with _LOCK:
+        if _pool is None or _procesos_pool != procesos:
+            metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            anterior = _pool
+            _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context(metodo))
+            _procesos_pool = procesos
+        pool = _pool
+    if anterior is not None:
+        anterior.shutdown(wait=False)
+    return pool
+
+
+def _descartar_pool(pool: ProcessPoolExecutor):
+    """Quita el pool compartido si sigue siendo 'pool' (p. ej. porque murió un proceso)."""
+    global _pool
+    with _LOCK:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def cerrar_pool():
+    """Cierra el pool de procesos compartido; se llama al salir del proceso."""
+    global _pool
+    with _LOCK:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def escanear_archivos(
+    paths: List[str],
+    patron: str,
+    max_coincidencias: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    procesos: Optional[int] = None
+) -> Dict:
+    """
+    Escanea varios archivos repartiéndolos entre un pool de procesos y devuelve
+    los resultados en el orden de 'paths'. Con límite de coincidencias o de bytes
+    se deja de enviar trabajo en cuanto se alcanza y se devuelve lo obtenido.
+    En paralelo cada archivo recibe el presupuesto que quedaba al enviarlo, así
+    que el total de bytes puede rebasar el límite en lo que ya estaba en vuelo.
+
+    Args:
+        paths: Archivos a escanear
+        patron: Expresión regular (se ignoran mayúsculas)
+        max_coincidencias: Máximo de líneas coincidentes en total
+        max_bytes: Máximo de bytes escaneados en total
+        procesos: Tamaño del pool (1 para escanear en el propio proceso)
+
+    Returns:
+        dict: resultados (solo archivos con coincidencias), archivos_escaneados,
+              bytes_escaneados, binarios_omitidos, errores y 'parcial'
+    """
+    _compilar(patron)  # valida el patrón antes de repartir trabajo
+    resumen = {
+        'resultados': [],
+        'archivos_escaneados': 0,
+        'bytes_escaneados': 0,
+        'binarios_omitidos': 0,
+        'errores': [],
+        'parcial': False
+    }
+    total_coincidencias = 0
+
+    def restantes() -> Tuple[Optional[int], Optional[int]]:
+        return (
+            None if max_coincidencias is None else max_coincidencias - total_coincidencias,
+            None if max_bytes is None else max_bytes - resumen['bytes_escaneados']
+        )
+
+    def agotado() -> bool:
+        coincidencias, bytes_libres = restantes()
+        return (coincidencias is not None and coincidencias <= 0) or (bytes_libres is not None and bytes_libres <= 0)
+
+    def acumular(resultado: Dict):
+        nonlocal total_coincidencias
+        coincidencias = restantes()[0]
+        if coincidencias is not None and len(resultado['coincidencias']) > coincidencias:
+            del resultado['coincidencias'][coincidencias:]
+            resultado['parcial'] = True
+        resumen['archivos_escaneados'] += 1
+        resumen['bytes_escaneados'] += resultado['bytes_escaneados']
+        if resultado.get('binario'):
+            resumen['binarios_omitidos'] += 1
+        if 'error' in resultado:
+            resumen['errores'].append({'path': resultado['path'], 'mensaje': resultado['error']})
+        if resultado.get('parcial'):
+            resumen['parcial'] = True
+        if resultado['coincidencias']:
+            total_coincidencias += len(resultado['coincidencias'])
+            resumen['resultados'].append(resultado)
+
+    procesos = procesos or os.cpu_count() or 1
+    if procesos <= 1 or len(paths) < MIN_ARCHIVOS_PROCESOS:
+        for path in paths:
+            if agotado():
+                resumen['parcial'] = True
+                break
+            acumular(escanear_archivo(path, patron, *restantes()))
+        return resumen
+
+    # Ventana acotada de trabajos en vuelo: mantiene el orden y permite parar pronto
+    pool = _obtener_pool(procesos)
+    pendientes = iter(paths)
+    en_vuelo = deque()
+    try:
+        for path in pendientes:
+            en_vuelo.append(pool.submit(escanear_archivo, path, patron, *restantes()))
+            if len(en_vuelo) >= procesos * 2:
+                break
+        while en_vuelo:
+            acumular(en_vuelo.popleft().result())
+            if agotado():
+                resumen['parcial'] = resumen['parcial'] or bool(en_vuelo) or next(pendientes, None) is not None
+                break
+            path = next(pendientes, None)
+            if path is not None:
+                en_vuelo.append(pool.submit(escanear_archivo, path, patron, *restantes()))
+    except BrokenProcessPool:
+        # La siguiente búsqueda crea un pool nuevo
+        _descartar_pool(pool)
+        raise
+    finally:
+        # El pool es compartido: lo que sobra no se espera, se cancela
+        for futuro in en_vuelo:
+            futuro.cancel()
+    return resumen
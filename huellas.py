@@ -0,0 +1,198 @@
+import contextvars
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ejecutor import cancelado, comprobar_cancelacion
+
+# Algoritmo de las huellas; una huella de otro algoritmo no se reutiliza
+ALGORITMO = 'sha256'
+
+# Tamaño de cada bloque leído: hashlib suelta el GIL mientras lo procesa
+TAMANO_BLOQUE = 1024 * 1024
+
+# Hilos que leen y calculan a la vez (la lectura y el hash no retienen el GIL)
+MAX_HILOS_HUELLAS = min(16, (os.cpu_count() or 1) * 2)
+
+
+def firma(stat: os.stat_result) -> List[int]:
+    """
+    [tamaño, mtime_ns, inodo, ctime_ns]: si no cambia, la huella guardada sigue
+    siendo válida. El ctime detecta las restauraciones que conservan el mtime
+    aunque el sistema reutilice el inodo (utime no puede fijarlo).
+    """
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_ctime_ns]
+
+
+def huella_archivo(path: str, tamano_bloque: int = TAMANO_BLOQUE) -> Tuple[str, int]:
+    """
+    Calcula la huella del contenido de un archivo leyéndolo por bloques en un
+    búfer reutilizado.
+
+    Returns:
+        Tuple[str, int]: (huella en hexadecimal, bytes leídos)
+
+    Raises:
+        OSError: Si el archivo no se puede leer
+    """
+    calculo = hashlib.new(ALGORITMO)
+    bufer = bytearray(tamano_bloque)
+    vista = memoryview(bufer)
+    leidos = 0
+    with open(path, 'rb', buffering=0) as archivo:
+        while True:
+            cantidad = archivo.readinto(bufer)
+            if not cantidad:
+                break
+            calculo.update(vista[:cantidad])
+            leidos += cantidad
+    return calculo.hexdigest(), leidos
+
+
+def _archivos(estructura: Dict) -> Iterator[Dict]:
+    pila = [estructura]
+    while pila:
+        nodo = pila.pop()
+        if nodo.get('type') == 'directory':
+            pila.extend(reversed(nodo.get('children', [])))
+        elif nodo.get('type') == 'file' and nodo.get('full_path'):
+            yield nodo
+
+
+def huellas_guardadas(estructura: Optional[Dict]) -> Dict[str, Dict]:
+    """full_path -> metadata de los archivos de una estructura que ya tienen huella."""
+    if not estructura:
+        return {}
+    return {
+        nodo['full_path']: nodo['metadata']
+        for nodo in _archivos(estructura)
+        if nodo.get('metadata', {}).get('hash')
+    }
+
+
+def calcular_huellas(
+    estructura: Dict,
+    anteriores: Optional[Dict[str, Dict]] = None,
+    max_hilos: Optional[int] = None
+) -> Dict:
+    """
+    Guarda en metadata['hash'] la huella del contenido de cada archivo de la
+    estructura, junto con el algoritmo y la firma del archivo (tamaño, mtime,
+    inodo y ctime) cuando se calculó. Los archivos cuya firma coincide con la de
+    'anteriores' (ver huellas_guardadas) reutilizan su huella sin leerse; el
+    resto se leen por bloques en un pool de hilos.
+
+    Si el trabajo corre en el pool de ejecutor.py y la llamada se cancela, los
+    archivos pendientes no se leen y se lanza ejecutor.Cancelado.
+
+    Args:
+        estructura: Estructura recién rastreada (se modifica)
+        anteriores: Metadatos con huella de la estructura anterior, por full_path
+        max_hilos: Hilos de lectura (MAX_HILOS_HUELLAS por defecto)
+
+    Returns:
+        dict: Archivos calculados, reutilizados y con error, bytes leídos y MB/s
+    """
+    anteriores = anteriores or {}
+    inicio = time.perf_counter()
+    pendientes: List[Tuple[Dict, List[int]]] = []
+    reutilizados = errores = 0
+
+    for nodo in _archivos(estructura):
+        try:
+            actual = firma(os.stat(nodo['full_path']))
+        except OSError:
+            errores += 1
+            continue
+        previa = anteriores.get(nodo['full_path'], {})
+        if previa.get('firma_hash') == actual and previa.get('algoritmo_hash') == ALGORITMO:
+            nodo.setdefault('metadata', {}).update(
+                hash=previa['hash'], algoritmo_hash=ALGORITMO, firma_hash=actual
+            )
+            reutilizados += 1
+        else:
+            pendientes.append((nodo, actual))
+
+    def calcular(nodo: Dict, actual: List[int]) -> Optional[int]:
+        if cancelado():
+            return None
+        try:
+            huella, leidos = huella_archivo(nodo['full_path'])
+        except OSError:
+            return None
+        nodo.setdefault('metadata', {}).update(hash=huella, algoritmo_hash=ALGORITMO, firma_hash=actual)
+        return leidos
+
+    bytes_leidos = calculados = 0
+    if pendientes:
+        with ThreadPoolExecutor(max_workers=max_hilos or MAX_HILOS_HUELLAS, thread_name_prefix='huellas') as pool:
+            futuros = [
+                pool.submit(contextvars.copy_context().run, calcular, nodo, actual)
+                for nodo, actual in pendientes
+            ]
+            for futuro in futuros:
+                leidos = futuro.result()
+                if leidos is None:
+                    errores += 1
+                else:
+                    calculados += 1
+                    bytes_leidos += leidos
+    comprobar_cancelacion()
+
+    duracion = time.perf_counter() - inicio
+    return {
+        'algoritmo': ALGORITMO,
+        'calculados': calculados,
+        'reutilizados': reutilizados,
+        'errores': errores,
+        'bytes_leidos': bytes_leidos,
+        'duracion_segundos': round(duracion, 4),
+        'mb_por_segundo': round(bytes_leidos / duracion / (1024 * 1024), 1) if duracion > 0 else 0.0
+    }
+
+
+def duplicados(estructura: Dict, tamano_minimo: int = 1) -> Dict:
+    """
+    Agrupa los archivos con la misma huella. Los grupos se ordenan por los bytes
+    que se liberarían dejando una sola copia.
+
+    Args:
+        estructura: Estructura con huellas (ver calcular_huellas)
+        tamano_minimo: Bytes mínimos de un archivo para tenerlo en cuenta
+
+    Returns:
+        dict: {"grupos": [{"hash", "tamano", "copias", "bytes_recuperables", "rutas"}],
+               "archivos_con_huella", "archivos_duplicados", "bytes_recuperables"}
+    """
+    grupos: Dict[str, List[Dict]] = {}
+    con_huella = 0
+    for nodo in _archivos(estructura):
+        metadata = nodo.get('metadata', {})
+        if not metadata.get('hash'):
+            continue
+        con_huella += 1
+        if metadata['firma_hash'][0] >= tamano_minimo:
+            grupos.setdefault(metadata['hash'], []).append(nodo)
+
+    resultado = []
+    for huella, nodos in grupos.items():
+        if len(nodos) < 2:
+            continue
+        tamano = nodos[0]['metadata']['firma_hash'][0]
+        resultado.append({
+            'hash': huella,
+            'tamano': tamano,
+            'copias': len(nodos),
+            'bytes_recuperables': tamano * (len(nodos) - 1),
+            'rutas': [nodo['full_path'] for nodo in nodos]
+        })
+    resultado.sort(key=lambda grupo: (-grupo['bytes_recuperables'], grupo['rutas'][0]))
+
+    return {
+        'grupos': resultado,
+        'archivos_con_huella': con_huella,
+        'archivos_duplicados': sum(grupo['copias'] - 1 for grupo in resultado),
+        'bytes_recuperables': sum(grupo['bytes_recuperables'] for grupo in resultado)
+    }
@@ -0,0 +1,217 @@
+import heapq
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from cache_estructura import derivado, derivado_construido
+
+# Parámetros de BM25
+K1 = 1.2
+B = 0.75
+
+# Peso de cada campo en la frecuencia de un término (BM25F simplificado)
+PESO_DESCRIPCION = 1.0
+PESO_NOMBRE = 2.0
+PESO_RUTA = 0.5
+
+# Palabras vacías en español, ya sin tildes
+STOP_WORDS = {
+    'el', 'la', 'lo', 'los', 'las', 'un', 'una', 'uno', 'unos', 'unas',
+    'de', 'del', 'al', 'a', 'en', 'y', 'e', 'o', 'u', 'ni', 'se', 'su', 'sus',
+    'mi', 'mis', 'tu', 'tus', 'me', 'te', 'le', 'les', 'nos', 'es', 'son', 'fue',
+    'donde', 'como', 'cuando', 'que', 'cual', 'cuales', 'quien', 'quienes', 'cuanto',
+    'esta', 'estan', 'este', 'estos', 'estas', 'ese', 'esa', 'esos', 'esas',
+    'hay', 'tiene', 'tienen', 'puede', 'pueden', 'ser', 'estar', 'haber',
+    'para', 'por', 'con', 'sin', 'sobre', 'entre', 'desde', 'hasta', 'hacia', 'segun',
+    'porque', 'pues', 'ya', 'mas', 'menos', 'muy', 'tambien', 'pero', 'si', 'no',
+    'encuentro', 'encuentra', 'encontrar', 'busco', 'buscar', 'guardan', 'guarda'
+}
+
+_PALABRA = re.compile(r'[^\W_]+')
+
+
+def quitar_tildes(texto: str) -> str:
+    """Elimina tildes y diacríticos (á -> a, ñ -> n, ü -> u)."""
+    return ''.join(
+        c for c in unicodedata.normalize('NFKD', texto)
+        if not unicodedata.combining(c)
+    )
+
+
+def tokenizar(texto: str) -> List[str]:
+    """
+    Divide un texto en términos normalizados: minúsculas, sin tildes, sin palabras
+    vacías ni de una letra, y sin la 's' final de los plurales ('facturas' -> 'factura').
+    """
+    terminos = []
+    for palabra in _PALABRA.findall(quitar_tildes(texto.lower())):
+        if len(palabra) < 2 or palabra in STOP_WORDS:
+            continue
+        if len(palabra) > 3 and palabra.endswith('s'):
+            palabra = palabra[:-1]
+        terminos.append(palabra)
+    return terminos
+
+
+class IndiceBM25:
+    """
+    Índice invertido sobre los directorios de una estructura. Cada directorio es un
+    documento con tres campos: descripción, nombre y ruta. Las frecuencias de los
+    campos se suman ponderadas y se puntúan con BM25.
+    """
+
+    def __init__(self, estructura: Optional[Dict] = None):
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.documentos: Dict[int, Dict] = {}
+        self.por_full_path: Dict[str, int] = {}
+        self.longitud_total = 0.0
+        self._siguiente_id = 0
+        if estructura is not None:
+            self.sincronizar(estructura)
+
+    def _frecuencias(self, documento: Dict) -> Counter:
+        frecuencias = Counter()
+        for termino, n in documento['tf_descripcion'].items():
+            frecuencias[termino] += n * PESO_DESCRIPCION
+        for termino, n in documento['tf_fijo'].items():
+            frecuencias[termino] += n
+        return frecuencias
+
+    def _indexar(self, doc_id: int):
+        documento = self.documentos[doc_id]
+        frecuencias = self._frecuencias(documento)
+        documento['longitud'] = sum(frecuencias.values())
+        self.longitud_total += documento['longitud']
+        for termino, frecuencia in frecuencias.items():
+            self.postings.setdefault(termino, {})[doc_id] = frecuencia
+
+    def _desindexar(self, doc_id: int):
+        documento = self.documentos[doc_id]
+        self.longitud_total -= documento['longitud']
+        for termino in self._frecuencias(documento):
+            postings = self.postings.get(termino)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[termino]
+
+    def agregar(self, full_path: str, ruta: str, nombre: str, descripcion: str):
+        """Añade un directorio al índice (o lo reemplaza si ya estaba)."""
+        if full_path in self.por_full_path:
+            self.eliminar(full_path)
+        tf_fijo = Counter()
+        for termino in tokenizar(nombre):
+            tf_fijo[termino] += PESO_NOMBRE
+        for termino in tokenizar(full_path or ruta):
+            tf_fijo[termino] += PESO_RUTA
+        doc_id = self._siguiente_id
+        self._siguiente_id += 1
+        self.documentos[doc_id] = {
+            'full_path': full_path,
+            'ruta': ruta,
+            'descripcion': descripcion,
+            'tf_descripcion': Counter(tokenizar(descripcion)),
+            'tf_fijo': tf_fijo
+        }
+        self.por_full_path[full_path] = doc_id
+        self._indexar(doc_id)
+
+    def eliminar(self, full_path: str):
+        doc_id = self.por_full_path.pop(full_path, None)
+        if doc_id is not None:
+            self._desindexar(doc_id)
+            del self.documentos[doc_id]
+
+    def actualizar_descripcion(self, full_path: str, descripcion: str) -> bool:
+        """Reindexa solo la descripción de un directorio. Devuelve False si no está indexado."""
+        doc_id = self.por_full_path.get(full_path)
+        if doc_id is None:
+            return False
+        documento = self.documentos[doc_id]
+        if documento['descripcion'] == descripcion:
+            return True
+        self._desindexar(doc_id)
+        documento['descripcion'] = descripcion
+        documento['tf_descripcion'] = Counter(tokenizar(descripcion))
+        self._indexar(doc_id)
+        return True
+
+    def sincronizar(self, estructura: Dict) -> 'IndiceBM25':
+        """
+        Pone el índice al día con una estructura: añade los directorios nuevos,
+        reindexa las descripciones cambiadas y elimina los que ya no existen.
+        Los directorios sin cambios no se vuelven a tokenizar.
+        """
+        vistos = set()
+        pila = [(estructura, "")]
+        while pila:
+            nodo, ruta_actual = pila.pop()
+            if nodo.get('type') != 'directory':
+                continue
+            ruta = os.path.join(ruta_actual, nodo.get('name', ''))
+            full_path = nodo.get('full_path') or ruta
+            descripcion = nodo.get('description', '')
+            vistos.add(full_path)
+            doc_id = self.por_full_path.get(full_path)
+            if doc_id is None or self.documentos[doc_id]['ruta'] != ruta:
+                self.agregar(full_path, ruta, nodo.get('name', ''), descripcion)
+            else:
+                self.actualizar_descripcion(full_path, descripcion)
+            for hijo in nodo.get('children', []):
+                pila.append((hijo, ruta))
+
+        for full_path in [fp for fp in self.por_full_path if fp not in vistos]:
+            self.eliminar(full_path)
+        return self
+
+    def _idf(self, df: int) -> float:
+        n = len(self.documentos)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def buscar(self, texto: str, k: int = 3) -> List[Tuple[Dict, float]]:
+        """
+        Devuelve los k directorios con mayor puntuación BM25 para el texto.
+        La relevancia se normaliza a [0, 1] dividiendo por la puntuación máxima
+        alcanzable con los términos de la consulta.
+
+        Returns:
+            list: Pares (documento, relevancia) ordenados de mayor a menor
+        """
+        terminos = Counter(tokenizar(texto))
+        if not terminos or not self.documentos:
+            return []
+
+        longitud_media = self.longitud_total / len(self.documentos) or 1.0
+        puntuaciones: Dict[int, float] = {}
+        maximo = 0.0
+        for termino, repeticiones in terminos.items():
+            postings = self.postings.get(termino, {})
+            idf = self._idf(len(postings))
+            maximo += idf * (K1 + 1) * repeticiones
+            for doc_id, frecuencia in postings.items():
+                longitud = self.documentos[doc_id]['longitud']
+                norma = frecuencia + K1 * (1 - B + B * longitud / longitud_media)
+                puntuaciones[doc_id] = puntuaciones.get(doc_id, 0.0) + (
+                    idf * frecuencia * (K1 + 1) / norma * repeticiones
+                )
+
+        mejores = heapq.nlargest(k, puntuaciones.items(), key=lambda par: par[1])
+        return [(self.documentos[doc_id], puntuacion / maximo) for doc_id, puntuacion in mejores]
+
+
+def indice_bm25(ruta_json: str) -> IndiceBM25:
+    """
+    Índice BM25 de la estructura de ruta_json, cacheado junto a ella. Cuando el
+    archivo cambia en disco se sincroniza el índice existente en vez de rehacerlo.
+    """
+    return derivado(ruta_json, 'bm25', IndiceBM25, lambda indice, estructura: indice.sincronizar(estructura))
+
+
+def notificar_descripcion(ruta_json: str, full_path: str, descripcion: str):
+    """Actualiza el índice BM25 en memoria (si existe) tras cambiar una descripción en sitio."""
+    indice = derivado_construido(ruta_json, 'bm25')
+    if indice is not None:
+        indice.actualizar_descripcion(full_path, descripcion)
@@ -0,0 +1,227 @@
+import heapq
+import re
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from cache_estructura import derivado, derivado_construido
+from indice_bm25 import quitar_tildes
+from indice_nombres import IndiceNombres, indice_nombres, normalizar
+
+# Nombre del derivado en cache_estructura
+NOMBRE_INDICE = 'indice_difuso'
+
+# Distancia máxima con la que se construye el índice (ninguna consulta puede pedir más)
+DISTANCIA_MAXIMA = 2
+
+# Solo se generan borrados de los primeros caracteres de cada término (como SymSpell):
+# acota la memoria con términos largos y los candidatos se comprueban con la distancia completa
+LONGITUD_PREFIJO = 7
+
+# Términos de un nombre: tramos de letras o de dígitos ('Facturas_2023.pdf' -> facturas, 2023, pdf)
+_TERMINO = re.compile(r'[^\W\d_]+|\d+')
+
+
+def terminos(texto: str) -> List[str]:
+    """Términos normalizados de un nombre o de una consulta: sin mayúsculas ni tildes."""
+    texto = normalizar(texto)
+    return _TERMINO.findall(texto if texto.isascii() else quitar_tildes(texto))
+
+
+def tolerancia(termino: str, maxima: int) -> int:
+    """
+    Distancia admitida para un término según su longitud: ninguna hasta 2
+    letras, 1 hasta 5 y maxima a partir de ahí. Con más, un término corto
+    ('pdf', '2023') coincidiría con casi cualquier otro de su longitud.
+    """
+    if len(termino) <= 2:
+        return 0
+    return min(maxima, 1 if len(termino) <= 5 else 2)
+
+
+def distancia(a: str, b: str, maxima: int) -> int:
+    """
+    Distancia de edición entre a y b contando inserciones, borrados, sustituciones
+    y trasposiciones de dos letras contiguas ('factruas' -> 'facturas' cuesta 1).
+    En cuanto se sabe que supera maxima devuelve maxima + 1.
+    """
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > maxima:
+        return maxima + 1
+    anterior2: List[int] = []
+    anterior = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        actual = [i] + [0] * len(b)
+        letra = a[i - 1]
+        for j in range(1, len(b) + 1):
+            coste = 0 if letra == b[j - 1] else 1
+            valor = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + coste)
+            if i > 1 and j > 1 and letra == b[j - 2] and a[i - 2] == b[j - 1]:
+                valor = min(valor, anterior2[j - 2] + 1)
+            actual[j] = valor
+        # Una trasposición aún puede partir de la fila anterior
+        if min(actual) > maxima and min(anterior) >= maxima:
+            return maxima + 1
+        anterior2, anterior = anterior, actual
+    return min(anterior[-1], maxima + 1)
+
+
+def borrados(termino: str, maxima: int) -> Set[str]:
+    """El prefijo del término y todas las cadenas que salen de borrarle hasta maxima letras."""
+    nivel = {termino[:LONGITUD_PREFIJO]}
+    resultado = set(nivel)
+    for _ in range(maxima):
+        nivel = {
+            palabra[:i] + palabra[i + 1:]
+            for palabra in nivel
+            for i in range(len(palabra))
+        } - resultado
+        resultado |= nivel
+    return resultado
+
+
+class IndiceDifuso:
+    """
+    Índice de borrados simétricos (SymSpell) sobre los términos de los nombres
+    de una estructura, para buscar nombres con erratas. Dos términos a distancia
+    <= k comparten alguna cadena obtenida borrando hasta k letras de cada uno:
+    el índice guarda esas cadenas para todo el vocabulario, y una consulta solo
+    genera las suyas y comprueba la distancia en los términos que aparecen. El
+    coste depende de la longitud de la consulta y del número de coincidencias,
+    no del tamaño del árbol.
+    """
+
+    def __init__(self, nombres: IndiceNombres, distancia_maxima: int = DISTANCIA_MAXIMA):
+        self.nombres = nombres
+        self.distancia_maxima = distancia_maxima
+        self.vocabulario: List[str] = []
+        # Filas (en preorden) cuyo nombre contiene cada término del vocabulario
+        self.filas: List[array] = []
+        # Número de términos de cada nombre, para preferir los nombres más ajustados
+        self.longitudes = array('H')
+        # Borrado -> término (o lista de términos) que lo generan
+        self.borrados: Dict[str, object] = {}
+
+        self.ids: Dict[str, int] = {}
+        ids = self.ids
+        for fila, nombre in enumerate(nombres.nombres):
+            propios = terminos(nombre)
+            self.longitudes.append(min(len(propios), 0xFFFF))
+            for termino in set(propios):
+                termino_id = ids.get(termino)
+                if termino_id is None:
+                    termino_id = ids[termino] = len(self.vocabulario)
+                    self.vocabulario.append(termino)
+                    self.filas.append(array('i'))
+                    self._indexar(termino, termino_id)
+                self.filas[termino_id].append(fila)
+
+    def _indexar(self, termino: str, termino_id: int):
+        for borrado in borrados(termino, self.distancia_maxima):
+            previo = self.borrados.get(borrado)
+            if previo is None:
+                self.borrados[borrado] = termino_id
+            elif isinstance(previo, list):
+                previo.append(termino_id)
+            else:
+                self.borrados[borrado] = [previo, termino_id]
+
+    def cercanos(self, termino: str, maxima: int) -> List[Tuple[int, int]]:
+        """Pares (término del vocabulario, distancia) a distancia <= maxima del término."""
+        maxima = min(maxima, self.distancia_maxima)
+        candidatos: Set[int] = set()
+        for borrado in borrados(termino, maxima):
+            previo = self.borrados.get(borrado)
+            if previo is None:
+                continue
+            if isinstance(previo, list):
+                candidatos.update(previo)
+            else:
+                candidatos.add(previo)
+        resultado = []
+        for termino_id in candidatos:
+            d = distancia(termino, self.vocabulario[termino_id], maxima)
+            if d <= maxima:
+                resultado.append((termino_id, d))
+        return resultado
+
+    def buscar(
+        self,
+        texto: str,
+        maxima: int = DISTANCIA_MAXIMA,
+        limite: Optional[int] = 20,
+        solo_directorios: bool = False
+    ) -> List[Tuple[int, int, Dict[str, str]]]:
+        """
+        Nombres en los que cada término del texto está a distancia <= maxima
+        (ver tolerancia) de alguno de sus términos, ordenados por la suma de esas
+        distancias, luego por número de términos del nombre y luego en preorden.
+
+        Returns:
+            list: (fila, distancia, {término buscado: término encontrado}) de los
+                  limite mejores (todos si limite es None)
+        """
+        consulta = list(dict.fromkeys(terminos(texto)))
+        if not consulta:
+            return []
+
+        # Por cada término buscado: término del vocabulario -> distancia
+        cercanos: List[Dict[int, int]] = []
+        for termino in consulta:
+            encontrados = dict(self.cercanos(termino, tolerancia(termino, maxima)))
+            if not encontrados:
+                return []
+            cercanos.append(encontrados)
+
+        # Las filas salen del término buscado con menos apariciones; los demás
+        # se comprueban con los términos de cada una de esas filas
+        guia = min(range(len(consulta)), key=lambda i: sum(len(self.filas[t]) for t in cercanos[i]))
+        # Recorriendo de mayor a menor distancia, cada fila se queda con la menor
+        mejores: Dict[int, Tuple[int, Tuple[int, ...]]] = {}
+        for termino_id, d in sorted(cercanos[guia].items(), key=lambda par: -par[1]):
+            mejores.update(dict.fromkeys(self.filas[termino_id], (d, (termino_id,))))
+
+        nodos, nombres, ids = self.nombres.nodos, self.nombres.nombres, self.ids
+        if solo_directorios:
+            mejores = {fila: valor for fila, valor in mejores.items() if nodos[fila].get('type') == 'directory'}
+        if len(consulta) > 1:
+            completas = {}
+            for fila, (total, (termino_id,)) in mejores.items():
+                propios = [ids[termino] for termino in terminos(nombres[fila])]
+                elegidos = []
+                for i, encontrados in enumerate(cercanos):
+                    if i == guia:
+                        elegidos.append(termino_id)
+                        continue
+                    distancias = [(encontrados[t], t) for t in propios if t in encontrados]
+                    if not distancias:
+                        break
+                    d, t = min(distancias)
+                    elegidos.append(t)
+                    total += d
+                else:
+                    completas[fila] = (total, tuple(elegidos))
+            mejores = completas
+
+        def orden(fila: int) -> Tuple[int, int, int]:
+            return mejores[fila][0], self.longitudes[fila], fila
+
+        elegidas = sorted(mejores, key=orden) if limite is None else heapq.nsmallest(limite, mejores, key=orden)
+        return [
+            (
+                fila,
+                mejores[fila][0],
+                {termino: self.vocabulario[t] for termino, t in zip(consulta, mejores[fila][1])}
+            )
+            for fila in elegidas
+        ]
+
+
+def indice_difuso(ruta_json: str) -> IndiceDifuso:
+    """Índice de nombres con erratas de la estructura de ruta_json, cacheado junto a ella."""
+    return derivado(ruta_json, NOMBRE_INDICE, lambda estructura: IndiceDifuso(indice_nombres(ruta_json)))
+
+
+def indice_difuso_construido(ruta_json: str) -> Optional[IndiceDifuso]:
+    """El índice de ruta_json si ya está construido para la estructura cacheada, sin construirlo."""
+    return derivado_construido(ruta_json, NOMBRE_INDICE)
@@ -0,0 +1,120 @@
+import fnmatch
+import re
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from cache_estructura import derivado
+from indice_trigramas import literales_requeridos
+from tabla_metadatos import rutas_de_filas
+
+# Nombre del derivado en cache_estructura
+NOMBRE_INDICE = 'indice_nombres'
+
+# Separador entre nombres en el texto del índice (no puede aparecer en un nombre de archivo)
+_SEPARADOR = '\0'
+
+# Literales más cortos encuentran casi todos los nombres: sale más a cuenta probar el patrón en todos
+MIN_LITERAL = 2
+
+
+def normalizar(texto: str) -> str:
+    """
+    Forma en la que se comparan nombres y literales: casefold(), salvo para
+    'İ' y 'ı', que re.IGNORECASE iguala a una 'i' simple. Así un nombre que
+    coincide con el patrón siempre contiene sus literales normalizados.
+    """
+    return texto.replace('İ', 'i').casefold().replace('ı', 'i')
+
+
+@lru_cache(maxsize=256)
+def compilar_patron(patron: str, glob: bool = False) -> Tuple[re.Pattern, List[str]]:
+    """
+    Expresión compilada (sin distinguir mayúsculas) y literales requeridos de un
+    patrón, cacheados para las búsquedas repetidas. Un glob ('*.py', 'informe_??.pdf')
+    tiene que coincidir con el nombre entero.
+
+    Raises:
+        re.error: Si el patrón no es una expresión regular válida
+    """
+    if glob:
+        patron = '^' + fnmatch.translate(patron)
+    literales = [normalizar(literal) for literal in literales_requeridos(patron)]
+    return re.compile(patron, re.IGNORECASE), literales
+
+
+class IndiceNombres:
+    """
+    Nombres de todos los nodos de una estructura, en preorden, para buscar por
+    nombre sin recorrer el árbol. Los nombres normalizados se concatenan en un
+    único texto; el literal más largo del patrón se localiza en él con str.find
+    (en C) y la expresión regular solo se prueba en los nombres que lo contienen.
+    """
+
+    def __init__(self, estructura: Dict):
+        self.nodos: List[Dict] = []
+        self.padres = array('i')
+        self.nombres: List[str] = []
+        # Posición en self.texto donde empieza el nombre de cada nodo
+        self.inicios = array('q')
+
+        partes = []
+        posicion = 0
+        pila = [(estructura, -1)]
+        while pila:
+            nodo, padre = pila.pop()
+            fila = len(self.nodos)
+            nombre = nodo.get('name', '')
+            normalizado = normalizar(nombre)
+            self.nodos.append(nodo)
+            self.padres.append(padre)
+            self.nombres.append(nombre)
+            self.inicios.append(posicion)
+            partes.append(normalizado)
+            posicion += len(normalizado) + 1
+            if nodo.get('type') == 'directory':
+                pila.extend((hijo, fila) for hijo in reversed(nodo.get('children', [])))
+        self.texto = _SEPARADOR.join(partes)
+
+    def __len__(self) -> int:
+        return len(self.nodos)
+
+    def candidatos(self, literal: str) -> List[int]:
+        """Filas (en preorden) cuyo nombre normalizado contiene el literal."""
+        filas = []
+        texto, inicios = self.texto, self.inicios
+        total = len(inicios)
+        posicion = texto.find(literal)
+        while posicion != -1:
+            fila = bisect_right(inicios, posicion) - 1
+            filas.append(fila)
+            # Cada nombre cuenta una vez: se sigue buscando desde el siguiente
+            if fila + 1 >= total:
+                break
+            posicion = texto.find(literal, inicios[fila + 1])
+        return filas
+
+    def buscar(self, patron: str, glob: bool = False) -> List[int]:
+        """
+        Filas cuyo nombre coincide con el patrón, en preorden.
+
+        Raises:
+            re.error: Si el patrón no es una expresión regular válida
+        """
+        regex, literales = compilar_patron(patron, glob)
+        buscar = regex.search
+        nombres = self.nombres
+        literal = max(literales, key=len, default='')
+        if len(literal) < MIN_LITERAL:
+            return [fila for fila, nombre in enumerate(nombres) if buscar(nombre)]
+        return [fila for fila in self.candidatos(literal) if buscar(nombres[fila])]
+
+    def rutas(self, filas) -> List[str]:
+        """Ruta del directorio que contiene cada fila, como en los resultados de búsqueda."""
+        return rutas_de_filas(self.nodos, self.padres, filas)
+
+
+def indice_nombres(ruta_json: str) -> IndiceNombres:
+    """Índice de nombres de la estructura de ruta_json, cacheado junto a ella."""
+    return derivado(ruta_json, NOMBRE_INDICE, IndiceNombres)
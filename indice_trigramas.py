@@ -0,0 +1,276 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Archivos más grandes no se indexan: siempre son candidatos y se escanean
+MAX_TAMANO_INDEXABLE = 32 * 1024 * 1024
+
+# Por debajo de este número de archivos a indexar no compensa arrancar procesos
+MIN_ARCHIVOS_PROCESOS = 32
+
+# Estado de cada archivo en el índice
+INDEXADO = 1
+NO_INDEXADO = 0   # demasiado grande: puede coincidir con cualquier patrón
+ILEGIBLE = -1     # no es UTF-8 válido: la búsqueda por contenido nunca lo devuelve
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS archivos (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    tamano INTEGER NOT NULL,
+    estado INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trigramas (
+    trigrama TEXT NOT NULL,
+    archivo INTEGER NOT NULL,
+    PRIMARY KEY (trigrama, archivo)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_trigramas_archivo ON trigramas(archivo);
+"""
+
+
+def ruta_indice_trigramas(ruta_json: str) -> str:
+    """Ruta del índice de trigramas que acompaña a un archivo de estructura."""
+    return os.path.splitext(ruta_json)[0] + '.trigramas.db'
+
+
+def trigramas(texto: str) -> Set[str]:
+    """Trigramas distintos del texto en minúsculas (la búsqueda ignora mayúsculas)."""
+    texto = texto.lower()
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def literales_requeridos(patron: str) -> List[str]:
+    """
+    Extrae de una expresión regular las secuencias literales que cualquier
+    coincidencia debe contener (p. ej. 'factura' y '2024' en 'factura.*2024').
+    Si el patrón no se puede analizar se devuelve una lista vacía.
+    """
+    try:
+        arbol = sre_parse.parse(patron)
+    except Exception:
+        return []
+
+    literales = []
+    actual = []
+
+    def cerrar():
+        if actual:
+            literales.append(''.join(actual))
+            actual.clear()
+
+    def recorrer(elementos):
+        for op, valor in elementos:
+            if op is sre_parse.LITERAL:
+                actual.append(chr(valor))
+            elif op is sre_parse.SUBPATTERN:
+                recorrer(valor[-1])
+            elif op is sre_parse.AT:
+                continue
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                minimo, _, subpatron = valor
+                cerrar()
+                if minimo >= 1:
+                    recorrer(subpatron)
+                    cerrar()
+            else:
+                cerrar()
+
+    recorrer(arbol)
+    cerrar()
+    return literales
+
+
+def _analizar_archivo(path: str) -> Tuple[str, int, List[str]]:
+    """Lee un archivo y devuelve (path, estado, trigramas). Se ejecuta en otro proceso."""
+    try:
+        if os.path.getsize(path) > MAX_TAMANO_INDEXABLE:
+            return path, NO_INDEXADO, []
+        with open(path, 'r', encoding='utf-8') as f:
+            return path, INDEXADO, list(trigramas(f.read()))
+    except UnicodeDecodeError:
+        return path, ILEGIBLE, []
+    except OSError:
+        return path, NO_INDEXADO, []
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+class IndiceTrigramas:
+    """
+    Índice persistente de trigramas del contenido de archivos de texto, en SQLite.
+    Cada archivo se guarda con su mtime y tamaño, de modo que sincronizar()
+    solo vuelve a leer los que han cambiado.
+    """
+
+    def __init__(self, ruta_db: str):
+        self.ruta_db = ruta_db
+        self.conexion = sqlite3.connect(ruta_db)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.executescript(ESQUEMA)
+
+    def __enter__(self) -> 'IndiceTrigramas':
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        self.conexion.close()
+
+    def sincronizar(self, paths: Iterable[str], eliminar_ausentes: bool = True) -> Dict:
+        """
+        Pone el índice al día con la lista de archivos dada: indexa los nuevos y los
+        que han cambiado de mtime o tamaño, y elimina los que ya no están.
+
+        Returns:
+            dict: Número de archivos indexados, sin cambios y eliminados
+        """
+        inicio = time.perf_counter()
+        paths = list(dict.fromkeys(paths))
+        conocidos = {
+            path: (archivo_id, mtime_ns, tamano)
+            for archivo_id, path, mtime_ns, tamano in self.conexion.execute(
+                "SELECT id, path, mtime_ns, tamano FROM archivos"
+            )
+        }
+
+        with ThreadPoolExecutor() as pool:
+            firmas = dict(zip(paths, pool.map(_stat, paths)))
+
+        cambiados = [
+            path for path, firma in firmas.items()
+            if firma is not None and (path not in conocidos or conocidos[path][1:] != firma)
+        ]
+        ausentes = [path for path in conocidos if firmas.get(path) is None] if eliminar_ausentes else []
+
+        if len(cambiados) >= MIN_ARCHIVOS_PROCESOS:
+            try:
+                with ProcessPoolExecutor() as pool:
+                    analizados = list(pool.map(_analizar_archivo, cambiados, chunksize=16))
+            except (OSError, RuntimeError):
+                analizados = [_analizar_archivo(path) for path in cambiados]
+        else:
+            analizados = [_analizar_archivo(path) for path in cambiados]
+
+        with self.conexion:
+            for path in ausentes:
+                archivo_id = conocidos[path][0]
+                self.conexion.execute("DELETE FROM trigramas WHERE archivo = ?", (archivo_id,))
+                self.conexion.execute("DELETE FROM archivos WHERE id = ?", (archivo_id,))
+
+            for path, estado, lista in analizados:
+                mtime_ns, tamano = firmas[path]
+                if path in conocidos:
+                    archivo_id = conocidos[path][0]
+                    self.conexion.execute("DELETE FROM trigramas WHERE archivo = ?", (archivo_id,))
+                    self.conexion.execute(
+                        "UPDATE archivos SET mtime_ns = ?, tamano = ?, estado = ? WHERE id = ?",
+                        (mtime_ns, tamano, estado, archivo_id)
+                    )
+                else:
+                    archivo_id = self.conexion.execute(
+                        "INSERT INTO archivos (path, mtime_ns, tamano, estado) VALUES (?, ?, ?, ?)",
+                        (path, mtime_ns, tamano, estado)
+                    ).lastrowid
+                self.conexion.executemany(
+                    "INSERT INTO trigramas (trigrama, archivo) VALUES (?, ?)",
+                    ((t, archivo_id) for t in lista)
+                )
+
+        return {
+            'indexados': len(analizados),
+            'sin_cambios': len(paths) - len(cambiados),
+            'eliminados': len(ausentes),
+            'duracion_segundos': round(time.perf_counter() - inicio, 4)
+        }
+
+    def filtro(self, patron: str) -> Callable[[str], bool]:
+        """
+        Devuelve una función puede_coincidir(path) que descarta los archivos
+        indexados que no contienen todos los trigramas de los literales del patrón.
+        Los archivos que el índice no conoce siempre pueden coincidir, y también
+        los que ha descartado pero cuyo mtime o tamaño ya no es el guardado (han
+        cambiado desde la última sincronización).
+        """
+        requeridos = set()
+        for literal in literales_requeridos(patron):
+            requeridos |= trigramas(literal)
+
+        estados = {}
+        firmas = {}
+        for archivo_id, path, estado, mtime_ns, tamano in self.conexion.execute(
+            "SELECT id, path, estado, mtime_ns, tamano FROM archivos"
+        ):
+            estados[archivo_id] = (path, estado)
+            firmas[path] = (mtime_ns, tamano)
+        descartados = {path for path, estado in estados.values() if estado == ILEGIBLE}
+
+        if requeridos:
+            candidatos: Optional[Set[int]] = None
+            # Empezar por los trigramas menos frecuentes reduce el tamaño de la intersección
+            for trigrama in sorted(requeridos, key=self._frecuencia):
+                ids = {fila[0] for fila in self.conexion.execute(
+                    "SELECT archivo FROM trigramas WHERE trigrama = ?", (trigrama,)
+                )}
+                candidatos = ids if candidatos is None else candidatos & ids
+                if not candidatos:
+                    break
+            descartados |= {
+                path for archivo_id, (path, estado) in estados.items()
+                if estado == INDEXADO and archivo_id not in candidatos
+            }
+
+        # Lo guardado solo vale para archivos sin cambios; los que no existen se siguen descartando
+        with ThreadPoolExecutor() as pool:
+            actuales = dict(zip(descartados, pool.map(_stat, descartados)))
+        descartados = {
+            path for path, firma in actuales.items()
+            if firma is None or firma == firmas[path]
+        }
+
+        return lambda path: path not in descartados
+
+    def _frecuencia(self, trigrama: str) -> int:
+        return self.conexion.execute(
+            "SELECT COUNT(*) FROM trigramas WHERE trigrama = ?", (trigrama,)
+        ).fetchone()[0]
+
+
+def archivos_de_estructura(estructura: Dict) -> List[str]:
+    """Devuelve el full_path de todos los archivos de una estructura anidada."""
+    archivos = []
+    pila = [estructura]
+    while pila:
+        nodo = pila.pop()
+        if nodo.get('type') == 'file':
+            if nodo.get('full_path'):
+                archivos.append(nodo['full_path'])
+        else:
+            pila.extend(nodo.get('children', []))
+    return archivos
+
+
+def indexar_archivos(archivos: Iterable[str], ruta_json: str) -> Dict:
+    """Sincroniza el índice de trigramas asociado a ruta_json con esa lista de archivos."""
+    with IndiceTrigramas(ruta_indice_trigramas(ruta_json)) as indice:
+        return indice.sincronizar(archivos)
+
+
+def indexar_estructura(estructura: Dict, ruta_json: str) -> Dict:
+    """Sincroniza el índice de trigramas asociado a ruta_json con los archivos de la estructura."""
+    return indexar_archivos(archivos_de_estructura(estructura), ruta_json)
@@ -0,0 +1,46 @@
+from typing import Dict, List, Optional
+
+from cache_estructura import derivado
+
+
+class IndiceDirectorios:
+    """
+    Índices sobre los nodos de directorio de una estructura: por nombre (todos
+    los directorios con ese nombre, en preorden) y por full_path.
+    Los valores son los propios nodos, así que modificarlos modifica la estructura.
+    """
+
+    def __init__(self, estructura: Dict):
+        self.estructura = estructura
+        self.por_nombre: Dict[str, List[Dict]] = {}
+        self.por_full_path: Dict[str, Dict] = {}
+
+        pila = [estructura]
+        while pila:
+            nodo = pila.pop()
+            if nodo.get('type') != 'directory':
+                continue
+            self.por_nombre.setdefault(nodo.get('name'), []).append(nodo)
+            if nodo.get('full_path'):
+                self.por_full_path[nodo['full_path']] = nodo
+            pila.extend(reversed(nodo.get('children', [])))
+
+    def primero_por_nombre(self, nombre: str) -> Optional[Dict]:
+        """Primer directorio con ese nombre en el recorrido en profundidad."""
+        nodos = self.por_nombre.get(nombre)
+        return nodos[0] if nodos else None
+
+    def resolver(self, clave: str) -> List[Dict]:
+        """
+        Devuelve los directorios que corresponden a una clave: el de ese full_path
+        si existe o, si no, todos los que tienen ese nombre.
+        """
+        nodo = self.por_full_path.get(clave)
+        if nodo is not None:
+            return [nodo]
+        return self.por_nombre.get(clave, [])
+
+
+def indice_directorios(ruta_json: str) -> IndiceDirectorios:
+    """Índice de directorios de la estructura guardada en ruta_json, cacheado junto a ella."""
+    return derivado(ruta_json, 'indice_directorios', IndiceDirectorios)
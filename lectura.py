@@ -0,0 +1,154 @@
+import codecs
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from ejecutor import cancelado, comprobar_cancelacion
+
+# Hilos por defecto para lecturas en lote (la E/S libera el GIL)
+MAX_HILOS_LECTURA = 8
+
+
+def _normalizar_solicitud(solicitud: Union[str, Dict]) -> Dict:
+    if isinstance(solicitud, str):
+        return {'path': solicitud, 'offset': 0, 'longitud': None}
+    return {
+        'path': solicitud['path'],
+        'offset': max(0, int(solicitud.get('offset') or 0)),
+        'longitud': solicitud.get('longitud')
+    }
+
+
+def _decodificar(datos: bytes, desde_inicio: bool, final: bool) -> Tuple[str, int]:
+    """
+    Decodifica un tramo UTF-8 que puede empezar o acabar a mitad de un carácter:
+    se saltan los bytes de continuación iniciales y, si no es el final del archivo,
+    el carácter incompleto del final se deja para la siguiente lectura.
+    Convierte los saltos de línea igual que open() en modo texto.
+
+    Returns:
+        Tuple[str, int]: (texto, bytes consumidos del tramo)
+    """
+    inicio = 0
+    if not desde_inicio:
+        while inicio < min(3, len(datos)) and 0x80 <= datos[inicio] <= 0xBF:
+            inicio += 1
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    texto = decodificador.decode(datos[inicio:], final=final)
+    pendientes = len(decodificador.getstate()[0])
+    return texto.replace('\r\n', '\n').replace('\r', '\n'), len(datos) - pendientes
+
+
+def leer_fragmento(path: str, offset: int = 0, longitud: Optional[int] = None) -> Dict:
+    """
+    Lee como texto UTF-8 'longitud' bytes de un archivo a partir de 'offset'
+    (hasta el final si longitud es None). Si longitud no llega a un carácter
+    completo se lee ese carácter entero (hasta 3 bytes más), para que quien
+    siga con el offset devuelto siempre avance.
+
+    Returns:
+        dict: contenido, offset, bytes_leidos, bytes_totales y 'truncado' si queda
+              contenido detrás, o error y mensaje si no se pudo leer
+    """
+    try:
+        with open(path, 'rb') as f:
+            total = os.fstat(f.fileno()).st_size
+            f.seek(offset)
+            datos = f.read() if longitud is None else f.read(max(0, longitud))
+            contenido, consumidos = _decodificar(
+                datos, desde_inicio=offset == 0, final=offset + len(datos) >= total
+            )
+            # Un carácter UTF-8 ocupa como mucho 4 bytes
+            while datos and not consumidos and len(datos) < 4 and offset + len(datos) < total:
+                datos += f.read(1)
+                contenido, consumidos = _decodificar(
+                    datos, desde_inicio=offset == 0, final=offset + len(datos) >= total
+                )
+    except Exception as e:
+        return {"path": path, "error": True, "mensaje": f"No se pudo leer el archivo: {str(e)}"}
+
+    siguiente = offset + consumidos
+    resultado = {
+        "path": path,
+        "error": False,
+        "contenido": contenido,
+        "offset": offset,
+        "bytes_leidos": consumidos,
+        "bytes_totales": total,
+        "truncado": siguiente < total
+    }
+    if resultado["truncado"]:
+        resultado["contenido"] += (
+            f"\n[... truncado: quedan {total - siguiente} bytes; "
+            f"continuar con offset={siguiente} ...]"
+        )
+    return resultado
+
+
+def leer_lote(
+    solicitudes: List[Union[str, Dict]],
+    max_bytes_total: Optional[int] = None,
+    max_bytes_archivo: Optional[int] = None,
+    hilos: int = MAX_HILOS_LECTURA
+) -> Dict:
+    """
+    Lee varios archivos en un pool de hilos respetando un presupuesto de bytes.
+    Primero se consulta el tamaño de todos, después se reparte el presupuesto en
+    el orden de las solicitudes y por último se leen a la vez. Los resultados
+    vuelven en el mismo orden que las solicitudes. Si la llamada se cancela
+    (ver ejecutor.py), los archivos pendientes no se leen y se lanza Cancelado.
+
+    Args:
+        solicitudes: Paths o diccionarios {"path", "offset", "longitud"} (en bytes)
+        max_bytes_total: Bytes máximos entre todos los archivos
+        max_bytes_archivo: Bytes máximos por archivo
+        hilos: Tamaño del pool de hilos
+
+    Returns:
+        dict: {"resultados": [...], "bytes_leidos": int, "presupuesto_agotado": bool}
+    """
+    solicitudes = [_normalizar_solicitud(s) for s in solicitudes]
+
+    def tamano(solicitud: Dict) -> Optional[int]:
+        try:
+            return os.path.getsize(solicitud['path'])
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, hilos)) as pool:
+        tamanos = list(pool.map(tamano, solicitudes))
+
+        restante = max_bytes_total
+        recortado = False
+        asignaciones = []
+        for solicitud, total in zip(solicitudes, tamanos):
+            disponible = 0 if total is None else max(0, total - solicitud['offset'])
+            for limite in (solicitud['longitud'], max_bytes_archivo):
+                if limite is not None:
+                    disponible = min(disponible, max(0, limite))
+            if restante is not None:
+                # Solo se agota el presupuesto si deja algo sin leer
+                recortado = recortado or disponible > restante
+                disponible = min(disponible, max(0, restante))
+                restante -= disponible
+            asignaciones.append(disponible)
+
+        def leer(solicitud: Dict, asignacion: int) -> Optional[Dict]:
+            # Tras una cancelación los archivos que faltan ya no se leen
+            if cancelado():
+                return None
+            return leer_fragmento(solicitud['path'], solicitud['offset'], asignacion)
+
+        futuros = [
+            pool.submit(contextvars.copy_context().run, leer, solicitud, asignacion)
+            for solicitud, asignacion in zip(solicitudes, asignaciones)
+        ]
+        resultados = [futuro.result() for futuro in futuros]
+    comprobar_cancelacion()
+
+    return {
+        "resultados": resultados,
+        "bytes_leidos": sum(r.get("bytes_leidos", 0) for r in resultados),
+        "presupuesto_agotado": recortado
+    }
@@ -0,0 +1,236 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# Límites (en segundos) de los cubos del histograma de latencias: de 0,1 ms a ~2 min
+LIMITES_CUBOS: List[float] = [0.0001 * 1.5 ** i for i in range(36)]
+
+# Se mide el tamaño de la respuesta serializada en 1 de cada N llamadas
+MUESTREO_BYTES_DEVUELTOS = 10
+
+# Volcado periódico opcional, configurable por entorno
+ARCHIVO_VOLCADO = os.environ.get("MCP_METRICAS_ARCHIVO")
+INTERVALO_VOLCADO = float(os.environ.get("MCP_METRICAS_INTERVALO", "60"))
+
+_llamada_actual: contextvars.ContextVar = contextvars.ContextVar("llamada_actual", default=None)
+
+
+class EstadisticasHerramienta:
+    """Contadores acumulados de una herramienta."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.llamadas = 0
+        self.errores = 0
+        self.tiempo_total = 0.0
+        self.tiempo_max = 0.0
+        self.cubos = [0] * (len(LIMITES_CUBOS) + 1)
+        self.fases: Dict[str, List[float]] = {}
+        self.bytes_leidos = 0
+        self.bytes_muestreados = 0
+        self.muestras = 0
+
+    def _percentil(self, p: float) -> float:
+        objetivo = p * self.llamadas
+        acumulado = 0
+        for i, cantidad in enumerate(self.cubos):
+            acumulado += cantidad
+            if acumulado >= objetivo and cantidad:
+                # Límite superior del cubo, acotado por el máximo observado
+                return min(LIMITES_CUBOS[i], self.tiempo_max) if i < len(LIMITES_CUBOS) else self.tiempo_max
+        return self.tiempo_max
+
+    def como_dict(self) -> Dict:
+        with self.lock:
+            if not self.llamadas:
+                return {"llamadas": 0}
+            return {
+                "llamadas": self.llamadas,
+                "errores": self.errores,
+                "latencia_ms": {
+                    "media": round(self.tiempo_total / self.llamadas * 1000, 3),
+                    "p50": round(self._percentil(0.50) * 1000, 3),
+                    "p95": round(self._percentil(0.95) * 1000, 3),
+                    "p99": round(self._percentil(0.99) * 1000, 3),
+                    "max": round(self.tiempo_max * 1000, 3)
+                },
+                "fases_ms": {
+                    fase: {"llamadas": int(n), "media": round(total / n * 1000, 3), "total": round(total * 1000, 3)}
+                    for fase, (n, total) in self.fases.items()
+                },
+                "bytes_leidos": self.bytes_leidos,
+                "bytes_devueltos_estimados": (
+                    int(self.bytes_muestreados / self.muestras * self.llamadas) if self.muestras else None
+                )
+            }
+
+
+class _Llamada:
+    """Datos de la llamada en curso: fases y bytes leídos, se vuelcan al terminar."""
+
+    __slots__ = ("fases", "bytes_leidos")
+
+    def __init__(self):
+        self.fases: Dict[str, float] = {}
+        self.bytes_leidos = 0
+
+
+_ESTADISTICAS: Dict[str, EstadisticasHerramienta] = {}
+_LOCK = threading.Lock()
+_inicio = datetime.now()
+
+
+def _estadisticas(nombre: str) -> EstadisticasHerramienta:
+    estadisticas = _ESTADISTICAS.get(nombre)
+    if estadisticas is None:
+        with _LOCK:
+            estadisticas = _ESTADISTICAS.setdefault(nombre, EstadisticasHerramienta())
+    return estadisticas
+
+
+def _es_error(resultado: Any) -> bool:
+    return isinstance(resultado, dict) and bool(resultado.get("error"))
+
+
+def _registrar(nombre: str, duracion: float, llamada: _Llamada, resultado: Any, fallo: bool):
+    estadisticas = _estadisticas(nombre)
+    muestrear = False
+    with estadisticas.lock:
+        estadisticas.llamadas += 1
+        estadisticas.errores += int(fallo or _es_error(resultado))
+        estadisticas.tiempo_total += duracion
+        estadisticas.tiempo_max = max(estadisticas.tiempo_max, duracion)
+        estadisticas.cubos[bisect.bisect_left(LIMITES_CUBOS, duracion)] += 1
+        for fase, segundos in llamada.fases.items():
+            acumulado = estadisticas.fases.setdefault(fase, [0, 0.0])
+            acumulado[0] += 1
+            acumulado[1] += segundos
+        estadisticas.bytes_leidos += llamada.bytes_leidos
+        muestrear = not fallo and estadisticas.llamadas % MUESTREO_BYTES_DEVUELTOS == 1
+
+    if muestrear:
+        try:
+            tamano = len(json.dumps(resultado, ensure_ascii=False, default=str).encode("utf-8"))
+        except Exception:
+            return
+        with estadisticas.lock:
+            estadisticas.bytes_muestreados += tamano
+            estadisticas.muestras += 1
+
+
+def instrumentar(funcion: Callable) -> Callable:
+    """
+    Decorador para herramientas MCP: registra llamadas, errores, latencia, fases
+    y bytes leídos. Se coloca debajo de @mcp.tool() para que se registre la
+    función instrumentada; conserva la firma original.
+    """
+    nombre = funcion.__name__
+
+    if inspect.iscoroutinefunction(funcion):
+        @functools.wraps(funcion)
+        async def envoltura_asincrona(*args, **kwargs):
+            llamada = _Llamada()
+            token = _llamada_actual.set(llamada)
+            inicio = time.perf_counter()
+            resultado, fallo = None, True
+            try:
+                resultado = await funcion(*args, **kwargs)
+                fallo = False
+                return resultado
+            finally:
+                _llamada_actual.reset(token)
+                _registrar(nombre, time.perf_counter() - inicio, llamada, resultado, fallo)
+        return envoltura_asincrona
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        llamada = _Llamada()
+        token = _llamada_actual.set(llamada)
+        inicio = time.perf_counter()
+        resultado, fallo = None, True
+        try:
+            resultado = funcion(*args, **kwargs)
+            fallo = False
+            return resultado
+        finally:
+            _llamada_actual.reset(token)
+            _registrar(nombre, time.perf_counter() - inicio, llamada, resultado, fallo)
+    return envoltura
+
+
+@contextmanager
+def fase(nombre: str):
+    """Mide una fase (carga, recorrido, escritura...) dentro de la herramienta en curso."""
+    llamada = _llamada_actual.get()
+    if llamada is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        llamada.fases[nombre] = llamada.fases.get(nombre, 0.0) + time.perf_counter() - inicio
+
+
+def registrar_bytes_leidos(cantidad: int):
+    """Suma bytes leídos de disco a la herramienta en curso (si la hay)."""
+    llamada = _llamada_actual.get()
+    if llamada is not None:
+        llamada.bytes_leidos += cantidad
+
+
+def obtener_metricas(reiniciar: bool = False) -> Dict:
+    """Instantánea de las métricas de todas las herramientas instrumentadas."""
+    global _inicio
+    with _LOCK:
+        nombres = sorted(_ESTADISTICAS)
+    instantanea = {
+        "desde": _inicio.isoformat(),
+        "generado": datetime.now().isoformat(),
+        "herramientas": {nombre: _ESTADISTICAS[nombre].como_dict() for nombre in nombres}
+    }
+    if reiniciar:
+        with _LOCK:
+            _ESTADISTICAS.clear()
+            _inicio = datetime.now()
+    return instantanea
+
+
+def volcar_metricas(ruta: str):
+    """Escribe la instantánea de métricas en un archivo JSON (reemplazo atómico)."""
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(obtener_metricas(), f, ensure_ascii=False, indent=4)
+    os.replace(temporal, ruta)
+
+
+def iniciar_volcado_periodico(ruta: Optional[str] = None, intervalo: Optional[float] = None) -> Optional[threading.Thread]:
+    """
+    Arranca un hilo demonio que vuelca las métricas cada 'intervalo' segundos.
+    Sin ruta (ni MCP_METRICAS_ARCHIVO) no hace nada.
+    """
+    ruta = ruta or ARCHIVO_VOLCADO
+    intervalo = intervalo or INTERVALO_VOLCADO
+    if not ruta:
+        return None
+
+    def bucle():
+        while True:
+            time.sleep(intervalo)
+            try:
+                volcar_metricas(ruta)
+            except Exception as e:
+                print(f"Error al volcar métricas: {e}", file=sys.stderr)
+
+    hilo = threading.Thread(target=bucle, name="volcado_metricas", daemon=True)
+    hilo.start()
+    return hilo
@@ -0,0 +1,228 @@
+import base64
+import os
+from typing import Dict, List, Optional, Tuple
+
+from arbol_compacto import ES_DIRECTORIO, ArbolCompacto
+from cache_estructura import derivado, huella_estructura
+
+
+class CursorInvalido(ValueError):
+    """El cursor está mal formado o pertenece a una versión anterior de la estructura."""
+
+
+def codificar_cursor(*campos: Optional[int]) -> str:
+    """Empaqueta enteros (o None) en un cursor opaco apto para devolver al cliente."""
+    texto = ':'.join('' if campo is None else str(campo) for campo in campos)
+    return base64.urlsafe_b64encode(texto.encode('ascii')).decode('ascii')
+
+
+def decodificar_cursor(cursor: str, campos: int) -> List[Optional[int]]:
+    try:
+        valores = [
+            None if valor == '' else int(valor)
+            for valor in base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split(':')
+        ]
+    except Exception:
+        raise CursorInvalido("Cursor mal formado")
+    if len(valores) != campos:
+        raise CursorInvalido("Cursor mal formado")
+    return valores
+
+
+class IndicePreorden:
+    """
+    Nodos de una estructura aplanados en preorden, con la profundidad de cada uno
+    y el final de su subárbol (posición siguiente a su último descendiente).
+    Así un subárbol es un tramo contiguo y los nodos por debajo de max_depth se
+    saltan de golpe: cada página cuesta O(limit), sea cual sea el tamaño del árbol.
+
+    La versión va en los cursores: indice_preorden usa la huella del archivo
+    (ver cache_estructura.huella_estructura), así que un cursor sigue valiendo
+    tras reiniciar el servidor solo si la estructura guardada no ha cambiado.
+    Sin versión (una estructura que no está en disco) se sortea una, y sus
+    cursores no valen para ningún otro índice.
+    """
+
+    def __init__(self, estructura: Dict, solo_directorios: bool = True, version: Optional[int] = None):
+        self.version = int.from_bytes(os.urandom(8), 'big') if version is None else version
+        self.nodos: List[Dict] = []
+        self.profundidades: List[int] = []
+        self.fin: List[int] = []
+        self.posiciones: Dict[str, int] = {}
+
+        abiertos: List[int] = []
+        pila = [(estructura, 0)]
+        while pila:
+            nodo, profundidad = pila.pop()
+            # Los directorios abiertos a esta profundidad o más ya no tienen más descendientes
+            while abiertos and self.profundidades[abiertos[-1]] >= profundidad:
+                self.fin[abiertos.pop()] = len(self.nodos)
+            es_directorio = nodo.get('type') == 'directory'
+            if solo_directorios and not es_directorio:
+                continue
+            posicion = len(self.nodos)
+            self.nodos.append(nodo)
+            self.profundidades.append(profundidad)
+            self.fin.append(posicion + 1)
+            if nodo.get('full_path'):
+                self.posiciones.setdefault(nodo['full_path'], posicion)
+            if es_directorio:
+                abiertos.append(posicion)
+                pila.extend((hijo, profundidad + 1) for hijo in reversed(nodo.get('children', [])))
+        for posicion in abiertos:
+            self.fin[posicion] = len(self.nodos)
+
+    def pagina(
+        self,
+        subtree: Optional[str] = None,
+        max_depth: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Tuple[Dict, int]], Optional[str]]:
+        """
+        Devuelve una página del recorrido en preorden.
+
+        Args:
+            subtree: full_path del nodo desde el que recorrer (la raíz por defecto)
+            max_depth: Profundidad máxima relativa a ese nodo (0 = solo el nodo)
+            limit: Nodos por página (todos si es None)
+            cursor: Cursor devuelto por la página anterior; si se indica, manda
+                sobre subtree y max_depth
+
+        Returns:
+            Tuple[list, Optional[str]]: Pares (nodo, profundidad relativa) y el
+                cursor de la página siguiente (None si no hay más)
+
+        Raises:
+            KeyError: Si subtree no está en la estructura
+            CursorInvalido: Si el cursor no corresponde a esta versión de la estructura
+        """
+        if cursor:
+            version, inicio, fin, base, max_depth = decodificar_cursor(cursor, 5)
+            if version != self.version:
+                raise CursorInvalido("La estructura ha cambiado desde la página anterior; vuelve a pedir la primera")
+        elif not self.nodos:
+            return [], None
+        else:
+            inicio = self.posiciones[subtree] if subtree else 0
+            fin = self.fin[inicio]
+            base = self.profundidades[inicio]
+
+        resultado = []
+        posicion = inicio
+        while posicion < fin and (limit is None or len(resultado) < limit):
+            profundidad = self.profundidades[posicion] - base
+            resultado.append((self.nodos[posicion], profundidad))
+            if max_depth is not None and profundidad >= max_depth:
+                posicion = self.fin[posicion]
+            else:
+                posicion += 1
+
+        siguiente = codificar_cursor(self.version, posicion, fin, base, max_depth) if posicion < fin else None
+        return resultado, siguiente
+
+
+def pagina_compacta(
+    arbol: ArbolCompacto,
+    subtree: Optional[str] = None,
+    max_depth: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    solo_directorios: bool = True,
+    version: Optional[int] = None
+) -> Tuple[List[Tuple[int, int]], Optional[str]]:
+    """
+    Igual que IndicePreorden.pagina pero sobre un ArbolCompacto, que ya guarda
+    los nodos en preorden con su profundidad y el final de su subárbol: no hace
+    falta construir ningún índice. Devuelve índices del árbol en lugar de nodos
+    (ver ArbolCompacto.nodo y ArbolCompacto.resumen). Con solo_directorios los
+    archivos se saltan al recorrer la página.
+
+    Raises:
+        KeyError: Si subtree no está en la estructura
+        CursorInvalido: Si el cursor no corresponde a esta versión de la estructura
+    """
+    version = int.from_bytes(os.urandom(8), 'big') if version is None else version
+    if cursor:
+        # Un campo más que los de IndicePreorden: sus cursores (con posiciones de
+        # otro índice) no valen aquí, ni los de la otra variante de solo_directorios
+        version_cursor, inicio, fin, base, max_depth, solo = decodificar_cursor(cursor, 6)
+        if solo != int(solo_directorios):
+            raise CursorInvalido("Cursor mal formado")
+        if version_cursor != version:
+            raise CursorInvalido("La estructura ha cambiado desde la página anterior; vuelve a pedir la primera")
+    elif not len(arbol):
+        return [], None
+    else:
+        inicio = arbol.buscar(subtree) if subtree else 0
+        if inicio is None or (solo_directorios and not arbol.es_directorio(inicio)):
+            raise KeyError(subtree)
+        fin = arbol.fines[inicio]
+        base = arbol.profundidades[inicio]
+
+    banderas = arbol.banderas
+    resultado = []
+    posicion = inicio
+    while True:
+        # Los archivos no cuentan para la página ni para decidir si hay otra
+        while solo_directorios and posicion < fin and not banderas[posicion] & ES_DIRECTORIO:
+            posicion = arbol.fines[posicion]
+        if posicion >= fin or (limit is not None and len(resultado) >= limit):
+            break
+        profundidad = arbol.profundidades[posicion] - base
+        resultado.append((posicion, profundidad))
+        if max_depth is not None and profundidad >= max_depth:
+            posicion = arbol.fines[posicion]
+        else:
+            posicion += 1
+
+    siguiente = codificar_cursor(version, posicion, fin, base, max_depth, int(solo_directorios)) if posicion < fin else None
+    return resultado, siguiente
+
+
+def indice_preorden(ruta_json: str, solo_directorios: bool = True) -> IndicePreorden:
+    """Índice en preorden de la estructura de ruta_json (solo directorios o todos los nodos), cacheado junto a ella."""
+    nombre = 'preorden_directorios' if solo_directorios else 'preorden_nodos'
+    return derivado(
+        ruta_json,
+        nombre,
+        lambda estructura: IndicePreorden(estructura, solo_directorios, huella_estructura(ruta_json))
+    )
+
+
+def podar(nodo: Dict, max_depth: Optional[int], profundidad: int = 0) -> Dict:
+    """
+    Copia de un nodo con sus descendientes hasta max_depth niveles por debajo.
+    Los directorios cortados llevan 'children' vacío, 'truncado' y 'hijos_omitidos'.
+    Sin max_depth devuelve el propio nodo, sin copiarlo.
+    """
+    if max_depth is None:
+        return nodo
+    copia = {clave: valor for clave, valor in nodo.items() if clave != 'children'}
+    if 'children' in nodo:
+        if profundidad >= max_depth:
+            copia['children'] = []
+            if nodo['children']:
+                copia['truncado'] = True
+                copia['hijos_omitidos'] = len(nodo['children'])
+        else:
+            copia['children'] = [podar(hijo, max_depth, profundidad + 1) for hijo in nodo['children']]
+    return copia
+
+
+def resumen_nodo(nodo: Dict, profundidad: int) -> Dict:
+    """Nodo sin sus descendientes, para las páginas planas: los directorios indican cuántos hijos tienen."""
+    resumen = {clave: valor for clave, valor in nodo.items() if clave != 'children'}
+    resumen['profundidad'] = profundidad
+    if nodo.get('type') == 'directory':
+        resumen['hijos'] = len(nodo.get('children', []))
+    return resumen
+
+
+def validar_paginacion(max_depth: Optional[int], limit: Optional[int]) -> Optional[str]:
+    """Mensaje de error si los parámetros de paginación no son válidos, o None."""
+    if max_depth is not None and max_depth < 0:
+        return "max_depth no puede ser negativo"
+    if limit is not None and limit <= 0:
+        return "limit debe ser mayor que 0"
+    return None
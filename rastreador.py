@@ -0,0 +1,301 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+from arbol_compacto import CON_DESCRIPCION, CON_HIJOS, CON_RUTA, ES_DIRECTORIO, ArbolCompacto
+from ejecutor import cancelado, comprobar_cancelacion
+from resumenes import calcular_resumenes
+
+# Número de hilos por defecto para recorrer subárboles en paralelo
+MAX_HILOS_RASTREO = min(32, (os.cpu_count() or 1) * 4)
+
+
+class EstadisticasRastreo:
+    """
+    Contadores de un rastreo: entradas visitadas y llamadas al sistema realizadas.
+    Cada hilo acumula en local y vuelca aquí una vez por directorio.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.inicio = time.perf_counter()
+        self.fin: Optional[float] = None
+        self.entradas = 0
+        self.directorios = 0
+        self.archivos = 0
+        self.llamadas_scandir = 0
+        self.llamadas_stat = 0
+
+    def sumar(self, entradas: int = 0, directorios: int = 0, archivos: int = 0,
+              scandir: int = 0, stat: int = 0):
+        with self._lock:
+            self.entradas += entradas
+            self.directorios += directorios
+            self.archivos += archivos
+            self.llamadas_scandir += scandir
+            self.llamadas_stat += stat
+
+    def terminar(self):
+        self.fin = time.perf_counter()
+
+    def como_dict(self) -> Dict:
+        duracion = (self.fin or time.perf_counter()) - self.inicio
+        return {
+            'entradas': self.entradas,
+            'directorios': self.directorios,
+            'archivos': self.archivos,
+            'duracion_segundos': round(duracion, 4),
+            'entradas_por_segundo': round(self.entradas / duracion, 1) if duracion > 0 else 0.0,
+            'llamadas_scandir': self.llamadas_scandir,
+            'llamadas_stat': self.llamadas_stat,
+            'llamadas_sistema': self.llamadas_scandir + self.llamadas_stat
+        }
+
+
+def nodo_directorio(nombre: str, path: str) -> Dict[str, Union[str, List]]:
+    """Crea un nodo de directorio vacío con el formato de estructura.json."""
+    return {
+        'name': nombre,
+        'type': 'directory',
+        'description': '',
+        'children': [],
+        'full_path': os.path.abspath(path)
+    }
+
+
+def metadatos_basicos(stat: os.stat_result, ahora: Optional[str] = None) -> Dict:
+    """
+    Metadatos de un nodo a partir de su stat, con los mismos campos que
+    agregar_metadatos_basicos (fechas ISO, tamaño y permisos).
+    """
+    return {
+        'creado': datetime.fromtimestamp(stat.st_ctime).isoformat(),
+        'modificado': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        'tamano': stat.st_size,
+        'permisos': oct(stat.st_mode)[-3:],
+        'ultima_actualizacion': ahora or datetime.now().isoformat()
+    }
+
+
+def _metadatos_de(entrada: Union[os.DirEntry, str], ahora: str) -> Dict:
+    try:
+        stat = entrada.stat() if isinstance(entrada, os.DirEntry) else os.stat(entrada)
+    except OSError:
+        return {'ultima_actualizacion': ahora}
+    return metadatos_basicos(stat, ahora)
+
+
+def es_directorio(entrada: os.DirEntry) -> Tuple[bool, int]:
+    """
+    Equivalente a os.path.isdir sobre un DirEntry.
+    El tipo sale de d_type sin llamadas extra; solo los enlaces simbólicos
+    necesitan un stat para seguirse.
+
+    Returns:
+        Tuple[bool, int]: (es_directorio, llamadas_stat_realizadas)
+    """
+    if entrada.is_symlink():
+        return entrada.is_dir(follow_symlinks=True), 1
+    return entrada.is_dir(follow_symlinks=False), 0
+
+
+def listar_directorio(
+    nodo: Dict,
+    path: str,
+    estadisticas: EstadisticasRastreo,
+    metadatos: bool = False
+) -> List[Tuple[Dict, str]]:
+    """
+    Lista un directorio con os.scandir y rellena nodo['children'] en orden alfabético,
+    ignorando los elementos ocultos. Con metadatos, cada hijo lleva 'metadata'
+    sacado de un stat (uno por entrada).
+
+    Returns:
+        list: Pares (nodo_subdirectorio, path) pendientes de explorar
+    """
+    pendientes = []
+    entradas = directorios = archivos = stats = 0
+    ahora = datetime.now().isoformat() if metadatos else None
+    try:
+        with os.scandir(path) as iterador:
+            elementos = sorted(
+                (e for e in iterador if not e.name.startswith('.')),
+                key=lambda e: e.name
+            )
+        for entrada in elementos:
+            entradas += 1
+            es_dir, coste = es_directorio(entrada)
+            stats += coste
+            if es_dir:
+                directorios += 1
+                hijo = nodo_directorio(entrada.name, entrada.path)
+                pendientes.append((hijo, entrada.path))
+            else:
+                archivos += 1
+                hijo = {
+                    'name': entrada.name,
+                    'type': 'file',
+                    'full_path': os.path.abspath(entrada.path)
+                }
+            if metadatos:
+                hijo['metadata'] = _metadatos_de(entrada, ahora)
+                stats += 1
+            nodo['children'].append(hijo)
+    except PermissionError:
+        nodo['error'] = 'Sin permisos de acceso'
+    except Exception as e:
+        nodo['error'] = str(e)
+    finally:
+        estadisticas.sumar(entradas, directorios, archivos, scandir=1, stat=stats)
+    return pendientes
+
+
+def explorar_arbol(
+    ruta_raiz: str,
+    max_hilos: Optional[int] = None,
+    estadisticas: Optional[EstadisticasRastreo] = None,
+    metadatos: bool = False
+) -> Dict[str, Union[str, List]]:
+    """
+    Recorre un árbol de directorios con os.scandir y devuelve la estructura anidada
+    (name/type/description/children/full_path), idéntica a la del recorrido con
+    os.listdir + os.path.isdir pero sin un stat por entrada.
+
+    Con metadatos se hace un stat por entrada para guardar 'metadata' en cada
+    nodo (ver metadatos_basicos) y, al terminar, el resumen de cada directorio
+    (ver resumenes.py), de abajo arriba.
+
+    Cada directorio es una tarea independiente en un pool de hilos acotado, de forma
+    que los subárboles se recorren a la vez. El orden de los hijos no depende del
+    orden de ejecución: el nodo de cada subdirectorio se inserta al listar su padre
+    y el hilo que lo explora solo rellena sus hijos.
+
+    Si el rastreo corre en el pool de ejecutor.py y la llamada se cancela, deja de
+    listar directorios y lanza ejecutor.Cancelado.
+
+    Args:
+        ruta_raiz: Path del directorio a analizar
+        max_hilos: Hilos del pool (1 para recorrido secuencial, MAX_HILOS_RASTREO por defecto)
+        estadisticas: Contadores donde acumular entradas y llamadas al sistema
+        metadatos: Si es True, guarda metadatos y resúmenes
+
+    Returns:
+        dict: Estructura de directorios en formato diccionario anidado
+    """
+    estadisticas = estadisticas or EstadisticasRastreo()
+    max_hilos = max_hilos or MAX_HILOS_RASTREO
+    raiz = nodo_directorio(os.path.basename(ruta_raiz), ruta_raiz)
+    if metadatos:
+        raiz['metadata'] = _metadatos_de(ruta_raiz, datetime.now().isoformat())
+        estadisticas.sumar(stat=1)
+
+    if max_hilos <= 1:
+        pila = [(raiz, ruta_raiz)]
+        while pila:
+            comprobar_cancelacion()
+            nodo, path = pila.pop()
+            pila.extend(reversed(listar_directorio(nodo, path, estadisticas, metadatos)))
+        if metadatos:
+            calcular_resumenes(raiz)
+        estadisticas.terminar()
+        return raiz
+
+    condicion = threading.Condition()
+    en_curso = [0]
+
+    with ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix='rastreo') as pool:
+        def enviar(nodo: Dict, path: str):
+            with condicion:
+                en_curso[0] += 1
+            # Cada tarea hereda el contexto de quien la envía (cancelación incluida)
+            pool.submit(contextvars.copy_context().run, tarea, nodo, path)
+
+        def tarea(nodo: Dict, path: str):
+            try:
+                if not cancelado():
+                    for subestructura, subpath in listar_directorio(nodo, path, estadisticas, metadatos):
+                        enviar(subestructura, subpath)
+            finally:
+                with condicion:
+                    en_curso[0] -= 1
+                    if en_curso[0] == 0:
+                        condicion.notify_all()
+
+        enviar(raiz, ruta_raiz)
+        with condicion:
+            while en_curso[0]:
+                condicion.wait()
+
+    comprobar_cancelacion()
+    if metadatos:
+        calcular_resumenes(raiz)
+    estadisticas.terminar()
+    return raiz
+
+
+def explorar_compacto(
+    ruta_raiz: str,
+    estadisticas: Optional[EstadisticasRastreo] = None
+) -> ArbolCompacto:
+    """
+    Recorre el árbol igual que explorar_arbol pero vuelca cada entrada directamente
+    en un ArbolCompacto, sin crear un diccionario por nodo: en árboles de millones
+    de entradas la memoria se queda en unos pocos bytes por nodo.
+    arbol.a_estructura() devuelve la misma estructura que explorar_arbol sin
+    metadatos (los metadatos y resúmenes solo los guarda explorar_arbol).
+
+    El recorrido es secuencial y en profundidad, que es el orden (preorden) en el
+    que el árbol compacto guarda los nodos.
+
+    Args:
+        ruta_raiz: Path del directorio a analizar
+        estadisticas: Contadores donde acumular entradas y llamadas al sistema
+
+    Returns:
+        ArbolCompacto: Árbol con todos los nodos
+    """
+    estadisticas = estadisticas or EstadisticasRastreo()
+    arbol = ArbolCompacto(os.path.abspath(ruta_raiz))
+    banderas_directorio = ES_DIRECTORIO | CON_DESCRIPCION | CON_HIJOS | CON_RUTA
+
+    # (padre, nombre, path, es_directorio); los hermanos se apilan al revés para salir en orden
+    pila = [(-1, os.path.basename(ruta_raiz), ruta_raiz, True)]
+    while pila:
+        comprobar_cancelacion()
+        padre, nombre, path, es_dir = pila.pop()
+        if not es_dir:
+            arbol.anadir(padre, nombre, CON_RUTA)
+            continue
+
+        indice = arbol.anadir(padre, nombre, banderas_directorio)
+        hijos = []
+        entradas = directorios = archivos = stats = 0
+        try:
+            with os.scandir(path) as iterador:
+                elementos = sorted(
+                    (e for e in iterador if not e.name.startswith('.')),
+                    key=lambda e: e.name
+                )
+            for entrada in elementos:
+                entradas += 1
+                es_subdirectorio, coste = es_directorio(entrada)
+                stats += coste
+                if es_subdirectorio:
+                    directorios += 1
+                else:
+                    archivos += 1
+                hijos.append((indice, entrada.name, entrada.path, es_subdirectorio))
+        except PermissionError:
+            arbol.extras[indice] = {'error': 'Sin permisos de acceso'}
+        except Exception as e:
+            arbol.extras[indice] = {'error': str(e)}
+        finally:
+            estadisticas.sumar(entradas, directorios, archivos, scandir=1, stat=stats)
+        pila.extend(reversed(hijos))
+
+    estadisticas.terminar()
+    return arbol.terminar()
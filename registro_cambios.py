@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Sin fcntl (Windows) el bloqueo del registro solo vale entre hilos
+    fcntl = None
+
+# Extensión del registro de cambios que acompaña a cada estructura.json
+EXTENSION_REGISTRO = '.wal'
+
+# Se compacta el registro en el archivo base al superar cualquiera de estos umbrales
+UMBRAL_CAMBIOS = 1000
+UMBRAL_BYTES = 1024 * 1024
+
+# fsync tras cada escritura: un cambio confirmado sobrevive a un corte de luz
+SINCRONIZAR = True
+
+
+def ruta_registro(ruta_json: str) -> str:
+    """Ruta del registro de cambios de un archivo de estructura (estructura.json.wal)."""
+    return f"{ruta_json}{EXTENSION_REGISTRO}"
+
+
+class _Bloqueo:
+    """
+    Bloqueo reentrante de un registro: un RLock entre los hilos del proceso y,
+    mientras algún hilo lo tiene, fcntl.flock sobre un archivo '.lock' junto al
+    registro entre procesos (server.py y app.py comparten la estructura). No se
+    bloquea el propio registro porque recortar_registro lo reemplaza.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._lock = threading.RLock()
+        self._nivel = 0
+        self._fd: Optional[int] = None
+
+    def __enter__(self) -> '_Bloqueo':
+        self._lock.acquire()
+        try:
+            if self._nivel == 0 and fcntl is not None:
+                fd = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                self._fd = fd
+        except BaseException:
+            self._lock.release()
+            raise
+        self._nivel += 1
+        return self
+
+    def __exit__(self, *excepcion):
+        self._nivel -= 1
+        if self._nivel == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+
+_BLOQUEOS: Dict[str, _Bloqueo] = {}
+_LOCK_BLOQUEOS = threading.Lock()
+
+
+def bloqueo_registro(ruta_json: str) -> _Bloqueo:
+    """
+    Bloqueo que serializa, también entre procesos, los anexos al registro de
+    una estructura, su lectura junto con el archivo base y su recorte.
+    """
+    ruta = os.path.abspath(ruta_registro(ruta_json)) + '.lock'
+    with _LOCK_BLOQUEOS:
+        bloqueo = _BLOQUEOS.get(ruta)
+        if bloqueo is None:
+            bloqueo = _BLOQUEOS[ruta] = _Bloqueo(ruta)
+        return bloqueo
+
+
+def cambio_descripcion(descripcion: str, full_path: Optional[str] = None, ruta: Optional[List[str]] = None) -> Dict:
+    """Cambio que fija la descripción de un directorio, localizado por full_path o por nombres desde la raíz."""
+    cambio = {'op': 'descripcion', 'descripcion': descripcion}
+    if full_path:
+        cambio['full_path'] = full_path
+    else:
+        cambio['ruta'] = ruta or []
+    return cambio
+
+
+def cambio_metadatos(metadata: Dict, full_path: Optional[str] = None, ruta: Optional[List[str]] = None) -> Dict:
+    """Cambio que mezcla 'metadata' en los metadatos de un nodo."""
+    cambio = {'op': 'metadatos', 'metadata': metadata}
+    if full_path:
+        cambio['full_path'] = full_path
+    else:
+        cambio['ruta'] = ruta or []
+    return cambio
+
+
+def anexar(ruta: str, cambios: List[Dict]) -> int:
+    """
+    Añade cambios al final del registro, una línea JSON por cambio.
+
+    Returns:
+        int: Tamaño del registro tras escribir
+    """
+    datos = ''.join(
+        json.dumps(cambio, ensure_ascii=False, separators=(',', ':')) + '\n' for cambio in cambios
+    ).encode('utf-8')
+    with open(ruta, 'ab') as f:
+        f.write(datos)
+        f.flush()
+        if SINCRONIZAR:
+            os.fsync(f.fileno())
+        return f.tell()
+
+
+def leer_registro(ruta: str) -> Tuple[List[Dict], int]:
+    """
+    Lee los cambios de un registro. Una última línea incompleta (escritura
+    interrumpida) se ignora junto con lo que venga detrás.
+
+    Returns:
+        Tuple[List[Dict], int]: (cambios, bytes válidos)
+    """
+    try:
+        with open(ruta, 'rb') as f:
+            datos = f.read()
+    except FileNotFoundError:
+        return [], 0
+
+    cambios = []
+    validos = 0
+    for linea in datos.splitlines(keepends=True):
+        if not linea.endswith(b'\n'):
+            break
+        try:
+            cambios.append(json.loads(linea))
+        except ValueError:
+            break
+        validos += len(linea)
+    return cambios, validos
+
+
+def recortar_registro(ruta: str, inicio: int):
+    """
+    Descarta los primeros 'inicio' bytes del registro (ya incorporados al archivo
+    base) conservando lo escrito después. El reemplazo es atómico.
+    """
+    try:
+        with open(ruta, 'rb') as f:
+            f.seek(inicio)
+            resto = f.read()
+    except FileNotFoundError:
+        return
+    if not resto:
+        os.remove(ruta)
+        return
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(resto)
+        f.flush()
+        if SINCRONIZAR:
+            os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def _nodo_por_ruta(estructura: Dict, partes: List[str]) -> Optional[Dict]:
+    nodo = estructura
+    for parte in partes:
+        nodo = next((h for h in nodo.get('children', []) if h.get('name') == parte), None)
+        if nodo is None:
+            return None
+    return nodo
+
+
+def aplicar_cambios(estructura: Dict, cambios: List[Dict]) -> int:
+    """
+    Reaplica cambios del registro sobre una estructura recién cargada.
+    Los cambios son idempotentes: aplicar uno que ya estaba incorporado no altera nada.
+
+    Returns:
+        int: Cambios aplicados (los que apuntan a nodos inexistentes se ignoran)
+    """
+    por_full_path: Optional[Dict[str, Dict]] = None
+    aplicados = 0
+    for cambio in cambios:
+        if 'full_path' in cambio:
+            if por_full_path is None:
+                por_full_path = {}
+                pila = [estructura]
+                while pila:
+                    nodo = pila.pop()
+                    if nodo.get('full_path'):
+                        por_full_path[nodo['full_path']] = nodo
+                    pila.extend(nodo.get('children', []))
+            nodo = por_full_path.get(cambio['full_path'])
+        else:
+            nodo = _nodo_por_ruta(estructura, cambio.get('ruta', []))
+        if nodo is None:
+            continue
+
+        if cambio.get('op') == 'descripcion':
+            nodo['description'] = cambio['descripcion']
+        elif cambio.get('op') == 'metadatos':
+            nodo.setdefault('metadata', {}).update(cambio['metadata'])
+        else:
+            continue
+        aplicados += 1
+    return aplicados
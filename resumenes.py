@@ -0,0 +1,106 @@
+import os
+from typing import Dict, Iterable, Optional
+
+# Clave del resumen en los nodos de directorio
+CLAVE_RESUMEN = 'resumen'
+
+# Nombre del derivado en cache_estructura con los resúmenes de una estructura que no los guarda
+NOMBRE_RESUMENES = 'resumenes'
+
+
+def extension_de(nombre: str) -> str:
+    """Extensión con la que se agrupan los archivos (la misma que en estadisticas_busqueda)."""
+    return os.path.splitext(nombre)[1] or "sin_extension"
+
+
+def calcular_resumen(nodo: Dict, aparte: Optional[Dict[int, Dict]] = None) -> Dict:
+    """
+    Calcula y guarda en nodo['resumen'] los totales de su subárbol: bytes y
+    número de archivos, número de subdirectorios, archivos por extensión y la
+    fecha de modificación más reciente (ISO, como 'modificado' en metadata).
+
+    Usa el resumen de cada subdirectorio, así que recorriendo de abajo arriba
+    cada directorio cuesta lo que sus hijos directos. Los subdirectorios sin
+    resumen (estructuras antiguas) se calculan antes.
+
+    Con 'aparte' los resúmenes se leen y se guardan ahí (por id del nodo) en
+    lugar de en los nodos, para no modificar una estructura compartida.
+    """
+    total_bytes = archivos = directorios = 0
+    extensiones: Dict[str, int] = {}
+    modificado_max = nodo.get('metadata', {}).get('modificado')
+
+    for hijo in nodo.get('children', []):
+        if hijo.get('type') == 'directory':
+            resumen = (hijo.get(CLAVE_RESUMEN) if aparte is None else aparte.get(id(hijo))) or calcular_resumen(hijo, aparte)
+            total_bytes += resumen['bytes']
+            archivos += resumen['archivos']
+            directorios += 1 + resumen['directorios']
+            for extension, cantidad in resumen['extensiones'].items():
+                extensiones[extension] = extensiones.get(extension, 0) + cantidad
+            modificado = resumen['modificado_max']
+        else:
+            metadata = hijo.get('metadata', {})
+            total_bytes += metadata.get('tamano', 0)
+            archivos += 1
+            extension = extension_de(hijo.get('name', ''))
+            extensiones[extension] = extensiones.get(extension, 0) + 1
+            modificado = metadata.get('modificado')
+        # Las fechas ISO del mismo formato se ordenan igual como texto
+        if modificado and (modificado_max is None or modificado > modificado_max):
+            modificado_max = modificado
+
+    resumen = {
+        'bytes': total_bytes,
+        'archivos': archivos,
+        'directorios': directorios,
+        'extensiones': extensiones,
+        'modificado_max': modificado_max
+    }
+    if aparte is None:
+        nodo[CLAVE_RESUMEN] = resumen
+    else:
+        aparte[id(nodo)] = resumen
+    return resumen
+
+
+def calcular_resumenes(estructura: Dict, aparte: Optional[Dict[int, Dict]] = None) -> Optional[Dict[int, Dict]]:
+    """
+    Calcula el resumen de todos los directorios de la estructura, de abajo arriba
+    y sin recursión (en los nodos, o en 'aparte', que se devuelve; ver calcular_resumen).
+    """
+    directorios = []
+    pila = [estructura]
+    while pila:
+        nodo = pila.pop()
+        if nodo.get('type') == 'directory':
+            directorios.append(nodo)
+            pila.extend(nodo.get('children', []))
+    # En preorden al revés cada directorio va detrás de todos sus descendientes
+    for nodo in reversed(directorios):
+        calcular_resumen(nodo, aparte)
+    return aparte
+
+
+def tiene_resumenes(estructura: Dict) -> bool:
+    """True si la estructura se generó con resúmenes (y por tanto hay que mantenerlos)."""
+    return CLAVE_RESUMEN in estructura
+
+
+def recalcular_ancestros(directorios: Dict[str, Dict], paths: Iterable[str]):
+    """
+    Recalcula el resumen de los directorios cuyos hijos han cambiado y el de
+    todos sus ancestros, cada uno una sola vez y de abajo arriba.
+    'directorios' es un índice full_path -> nodo; cada cadena se corta en el
+    primer path que no esté en él.
+    """
+    pendientes = set()
+    for path in paths:
+        while path in directorios and path not in pendientes:
+            pendientes.add(path)
+            padre = os.path.dirname(path)
+            if padre == path:
+                break
+            path = padre
+    for path in sorted(pendientes, key=lambda p: p.count(os.sep), reverse=True):
+        calcular_resumen(directorios[path])
@@ -4,6 +4,11 @@ import json
 from typing import Dict, List, Union, Tuple, Optional
 from datetime import datetime
 import mcp.types as types
+from cache_estructura import (cargar_estructura, fijar_derivado, guardar_estructura, marcar_derivados_obsoletos,
+                              registrar_cambios)
+from registro_cambios import cambio_descripcion, cambio_metadatos
+from tabla_metadatos import NOMBRE_TABLA, TablaMetadatos
+from resumenes import calcular_resumen
 
 # PROMPTS = {
 #     "encontrar-recurso": types.Prompt(
@@ -186,8 +191,8 @@ def guardar_memoria(datos: Dict, ruta: Optional[str] = None, force: bool = False
                 os.remove(ruta_backup)
             os.rename(ruta_json, ruta_backup)
         
-        with open(ruta_json, 'w', encoding='utf-8') as f:
-            json.dump(datos, f, ensure_ascii=False, indent=4)
+        # Escritura atómica; incorpora y vacía el registro de cambios
+        guardar_estructura(ruta_json, datos)
             
         return True, MEMORIA_FILENAME, ""
         
@@ -255,8 +260,7 @@ def actualizar_descripcion_directorio(ruta_relativa: str, descripcion: str, ruta
         if not os.path.exists(ruta_json):
             return {"error": "No existe el archivo de estructura"}
             
-        with open(ruta_json, 'r', encoding='utf-8') as f:
-            estructura = json.load(f)
+        estructura = cargar_estructura(ruta_json)
             
         def actualizar_nodo(nodo: Dict, path_parts: List[str]) -> bool:
             if not path_parts:
@@ -276,9 +280,8 @@ def actualizar_descripcion_directorio(ruta_relativa: str, descripcion: str, ruta
             
         path_parts = [p for p in ruta_relativa.split('/') if p]
         if actualizar_nodo(estructura, path_parts):
-            exito, _, error = guardar_memoria(estructura, ruta, force=True)
-            if not exito:
-                return {"error": error}
+            # Solo se anota el cambio; el archivo completo se reescribe al compactar
+            registrar_cambios(ruta_json, [cambio_descripcion(descripcion, ruta=path_parts)])
             return estructura
         else:
             return {"error": "No se encontró el directorio especificado"}
@@ -300,7 +303,10 @@ def leer_estructura_directorios(ruta_analizar: str, ruta_guardar: Optional[str]
     Returns:
         dict: Estructura de directorios en formato diccionario anidado
     """
-    def explorar_directorio(path: str) -> Dict[str, Union[str, List]]:
+    # Tabla de metadatos en columnas, rellenada con los mismos stat que los metadatos
+    tabla = TablaMetadatos()
+
+    def explorar_directorio(path: str, padre: int = -1) -> Dict[str, Union[str, List]]:
         nombre = os.path.basename(path)
         # Si es un directorio oculto (excepto el directorio actual), retornamos None
         if nombre.startswith('.') and nombre != os.path.basename(ruta_analizar):
@@ -315,7 +321,9 @@ def leer_estructura_directorios(ruta_analizar: str, ruta_guardar: Optional[str]
         }
         
         # Agregar metadatos básicos
-        estructura = agregar_metadatos_basicos(estructura, path)
+        stat = _stat(path)
+        estructura = agregar_metadatos_basicos(estructura, path, stat)
+        fila = tabla.anadir(estructura, padre, stat)
         
         try:
             elementos = os.listdir(path)
@@ -328,7 +336,7 @@ def leer_estructura_directorios(ruta_analizar: str, ruta_guardar: Optional[str]
                 ruta_completa = os.path.join(path, elemento)
                 
                 if os.path.isdir(ruta_completa):
-                    subestructura = explorar_directorio(ruta_completa)
+                    subestructura = explorar_directorio(ruta_completa, fila)
                     # Solo agregamos la subestructura si no es None (no es oculta)
                     if subestructura is not None:
                         estructura['children'].append(subestructura)
@@ -339,14 +347,18 @@ def leer_estructura_directorios(ruta_analizar: str, ruta_guardar: Optional[str]
                         'full_path': os.path.abspath(ruta_completa)  # Agregamos el path completo
                     }
                     # Agregar metadatos básicos al archivo
-                    archivo = agregar_metadatos_basicos(archivo, ruta_completa)
+                    stat_archivo = _stat(ruta_completa)
+                    archivo = agregar_metadatos_basicos(archivo, ruta_completa, stat_archivo)
+                    tabla.anadir(archivo, fila, stat_archivo)
                     estructura['children'].append(archivo)
                     
         except PermissionError:
             estructura['error'] = 'Sin permisos de acceso'
         except Exception as e:
             estructura['error'] = str(e)
-            
+
+        # Totales del subárbol a partir de los de los hijos, ya calculados
+        calcular_resumen(estructura)
         return estructura
 
     if not os.path.exists(ruta_analizar):
@@ -360,6 +372,8 @@ def leer_estructura_directorios(ruta_analizar: str, ruta_guardar: Optional[str]
     exito, nombre_archivo, error = guardar_memoria(resultado, ruta_guardar, force=force)
     
     if exito:
+        # La primera consulta de filtrar_por_metadata no tendrá que construir la tabla
+        fijar_derivado(get_memoria_path(ruta_guardar), NOMBRE_TABLA, resultado, tabla.cerrar())
         resultado['archivo_generado'] = nombre_archivo
     else:
         resultado['error_guardado'] = error
@@ -367,13 +381,19 @@ def leer_estructura_directorios(ruta_analizar: str, ruta_guardar: Optional[str]
     return resultado
 
 @mcp.tool()
-def actualizar_memoria(ruta: Optional[str] = None) -> Dict:
+def actualizar_memoria(ruta: Optional[str] = None, incremental: bool = False) -> Dict:
     """
     Actualiza la estructura de directorios existente con nuevos archivos y directorios,
     manteniendo las descripciones y metadatos existentes.
+
+    En modo incremental se compara el mtime e inodo guardados de cada directorio con
+    los actuales: los directorios sin cambios no se vuelven a listar y conservan sus
+    hijos tal cual; solo se comprueban sus subdirectorios, porque un cambio profundo
+    no altera el mtime de los directorios superiores.
     
     Args:
         ruta: Path opcional donde está el archivo JSON (usa MEMORIA_PATH por defecto)
+        incremental: Si es True, solo se vuelven a listar los directorios modificados
         
     Returns:
         dict: Estructura actualizada con los nuevos elementos
@@ -384,19 +404,37 @@ def actualizar_memoria(ruta: Optional[str] = None) -> Dict:
         if not os.path.exists(ruta_json):
             return {"error": "No existe el archivo de estructura"}
             
-        with open(ruta_json, 'r', encoding='utf-8') as f:
-            estructura_actual = json.load(f)
+        estructura_actual = cargar_estructura(ruta_json)
             
         # Obtener la ruta base del directorio a analizar
-        ruta_base = os.path.dirname(ruta_json)
+        ruta_base = estructura_actual.get('full_path') or os.path.dirname(ruta_json)
         
-        def actualizar_nodo(nodo_actual: Dict, path: str) -> Dict:
+        def actualizar_nodo(nodo_actual: Dict, path: str, stat_dir: Optional[os.stat_result] = None) -> Dict:
             """
             Actualiza recursivamente un nodo de la estructura, preservando metadatos.
             """
             # Si el nodo es un archivo, no necesita actualización
             if nodo_actual['type'] == 'file':
                 return nodo_actual
+
+            try:
+                stat_dir = stat_dir or os.stat(path)
+            except OSError as e:
+                nodo_actual['error'] = str(e)
+                return nodo_actual
+
+            # Directorio sin cambios: se conservan sus hijos y solo se revisan los subdirectorios
+            if (incremental
+                    and nodo_actual.get('mtime_ns') == stat_dir.st_mtime_ns
+                    and nodo_actual.get('inodo') == stat_dir.st_ino):
+                for child in nodo_actual.get('children', []):
+                    if child['type'] == 'directory':
+                        actualizar_nodo(child, os.path.join(path, child['name']))
+                calcular_resumen(nodo_actual)
+                return nodo_actual
+
+            nodo_actual.setdefault('full_path', os.path.abspath(path))
+            agregar_metadatos_basicos(nodo_actual, path, stat_dir)
                 
             # Crear diccionario de elementos existentes para búsqueda rápida
             elementos_existentes = {
@@ -407,37 +445,45 @@ def actualizar_memoria(ruta: Optional[str] = None) -> Dict:
             nuevos_elementos = []
             try:
                 # Listar contenido actual del directorio
-                for elemento in sorted(os.listdir(path)):
-                    ruta_elemento = os.path.join(path, elemento)
+                with os.scandir(path) as iterador:
+                    entradas = sorted(iterador, key=lambda e: e.name)
+
+                for entrada in entradas:
+                    elemento = entrada.name
+                    ruta_elemento = entrada.path
                     
                     # Ignorar elementos ocultos
                     if elemento.startswith('.'):
                         continue
-                        
-                    # Si el elemento ya existe, actualizarlo recursivamente
-                    if elemento in elementos_existentes:
-                        if os.path.isdir(ruta_elemento):
-                            nuevo_nodo = actualizar_nodo(
-                                elementos_existentes[elemento],
-                                ruta_elemento
-                            )
-                        else:
-                            nuevo_nodo = elementos_existentes[elemento]
+
+                    es_directorio = entrada.is_dir()
+                    # Si el elemento ya existe con el mismo tipo, se reutiliza su nodo
+                    existente = elementos_existentes.get(elemento)
+                    if existente is not None and (existente['type'] == 'directory') == es_directorio:
+                        nuevo_nodo = existente
                     # Si es nuevo, crear entrada
+                    elif es_directorio:
+                        nuevo_nodo = {
+                            'name': elemento,
+                            'type': 'directory',
+                            'description': '',
+                            'children': []
+                        }
+                    else:
+                        nuevo_nodo = {
+                            'name': elemento,
+                            'type': 'file'
+                        }
+                    nuevo_nodo.setdefault('full_path', os.path.abspath(ruta_elemento))
+
+                    try:
+                        stat_elemento = entrada.stat()
+                    except OSError:
+                        stat_elemento = None
+                    if es_directorio:
+                        nuevo_nodo = actualizar_nodo(nuevo_nodo, ruta_elemento, stat_elemento)
                     else:
-                        if os.path.isdir(ruta_elemento):
-                            nuevo_nodo = {
-                                'name': elemento,
-                                'type': 'directory',
-                                'description': '',
-                                'children': []
-                            }
-                            nuevo_nodo = actualizar_nodo(nuevo_nodo, ruta_elemento)
-                        else:
-                            nuevo_nodo = {
-                                'name': elemento,
-                                'type': 'file'
-                            }
+                        agregar_metadatos_basicos(nuevo_nodo, ruta_elemento, stat_elemento)
                     
                     nuevos_elementos.append(nuevo_nodo)
                     
@@ -448,6 +494,7 @@ def actualizar_memoria(ruta: Optional[str] = None) -> Dict:
             
             # Actualizar children manteniendo el resto de la estructura igual
             nodo_actual['children'] = nuevos_elementos
+            calcular_resumen(nodo_actual)
             return nodo_actual
             
         # Actualizar estructura completa
@@ -458,6 +505,8 @@ def actualizar_memoria(ruta: Optional[str] = None) -> Dict:
         
         if not exito:
             return {"error": error}
+        # Se ha modificado en sitio la estructura cacheada: índices y tabla de metadatos se rehacen
+        marcar_derivados_obsoletos(get_memoria_path(ruta))
             
         return estructura_actualizada
         
@@ -482,17 +531,17 @@ def agregar_metadatos(ruta_relativa: str, metadatos: Dict, ruta: Optional[str] =
         if not os.path.exists(ruta_json):
             return {"error": "No existe el archivo de estructura"}
             
-        with open(ruta_json, 'r', encoding='utf-8') as f:
-            estructura = json.load(f)
+        estructura = cargar_estructura(ruta_json)
             
         def actualizar_nodo(nodo: Dict, path_parts: List[str]) -> bool:
             if not path_parts:
                 # Agregar/actualizar metadatos preservando los existentes
                 nodo_meta = nodo.get('metadata', {})
-                nodo_meta.update({
+                cambios_meta.update({
                     **metadatos,
                     'ultima_modificacion': datetime.now().isoformat()
                 })
+                nodo_meta.update(cambios_meta)
                 nodo['metadata'] = nodo_meta
                 return True
                 
@@ -505,11 +554,11 @@ def agregar_metadatos(ruta_relativa: str, metadatos: Dict, ruta: Optional[str] =
                     return actualizar_nodo(child, path_parts[1:])
             return False
             
+        cambios_meta = {}
         path_parts = [p for p in ruta_relativa.split('/') if p]
         if actualizar_nodo(estructura, path_parts):
-            exito, _, error = guardar_memoria(estructura, ruta, force=True)
-            if not exito:
-                return {"error": error}
+            registrar_cambios(ruta_json, [cambio_metadatos(cambios_meta, ruta=path_parts)])
+            marcar_derivados_obsoletos(ruta_json, [NOMBRE_TABLA])
             return estructura
         else:
             return {"error": "No se encontró el elemento especificado"}
@@ -517,23 +566,34 @@ def agregar_metadatos(ruta_relativa: str, metadatos: Dict, ruta: Optional[str] =
     except Exception as e:
         return {"error": f"Error al actualizar metadatos: {str(e)}"}
 
-def agregar_metadatos_basicos(nodo: Dict, ruta: str) -> Dict:
+def _stat(ruta: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(ruta)
+    except OSError:
+        return None
+
+def agregar_metadatos_basicos(nodo: Dict, ruta: str, stat: Optional[os.stat_result] = None) -> Dict:
     """
     Agrega metadatos básicos a un nodo de la estructura.
+    Los campos de stat se actualizan sin borrar los metadatos añadidos por el usuario.
+    En los directorios se guardan además 'mtime_ns' e 'inodo' para la actualización incremental.
     """
+    metadata = nodo.get('metadata', {})
     try:
-        stat = os.stat(ruta)
-        nodo['metadata'] = {
+        stat = stat or os.stat(ruta)
+        metadata.update({
             'creado': datetime.fromtimestamp(stat.st_ctime).isoformat(),
             'modificado': datetime.fromtimestamp(stat.st_mtime).isoformat(),
             'tamano': stat.st_size,
             'permisos': oct(stat.st_mode)[-3:],
             'ultima_actualizacion': datetime.now().isoformat()
-        }
+        })
+        if nodo.get('type') == 'directory':
+            nodo['mtime_ns'] = stat.st_mtime_ns
+            nodo['inodo'] = stat.st_ino
     except:
-        nodo['metadata'] = {
-            'ultima_actualizacion': datetime.now().isoformat()
-        }
+        metadata['ultima_actualizacion'] = datetime.now().isoformat()
+    nodo['metadata'] = metadata
     return nodo
 
 @mcp.tool()
@@ -557,8 +617,7 @@ def encontrar_directorio_relevante(prompt: str) -> Dict:
         if not os.path.exists(ruta_json):
             return {"error": "No existe el archivo de estructura"}
             
-        with open(ruta_json, 'r', encoding='utf-8') as f:
-            estructura = json.load(f)
+        estructura = cargar_estructura(ruta_json)
             
         # Obtener lista de todos los directorios con sus descripciones
         resultado = listar_directorios()
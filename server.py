@@ -1,83 +1,158 @@
 from mcp.server.fastmcp import FastMCP
 import os
+import sys
 import json
 from typing import Dict, List, Union, Tuple, Optional
 from datetime import datetime
 import mcp.types as types
+from arbol_compacto import ArbolCompacto
+from rastreador import EstadisticasRastreo, explorar_arbol, explorar_compacto
+from almacen_sqlite import AlmacenSQLite, es_ruta_sqlite, exportar_json, importar_json
+import almacen_dividido
+import almacen_fragmentos
+from almacen_dividido import dividir, dividir_json, es_ruta_dividida, unir_json
+from almacen_fragmentos import es_almacen_fragmentos, registrar_fragmento, ruta_fragmento
+from cache_estructura import (cargar_compacto, cargar_estructura, compartiendo_estructuras, guardar_compacto,
+                              guardar_estructura, huella_estructura, registrar_cambios)
+from registro_cambios import cambio_descripcion
+from resumenes import tiene_resumenes
+from indices import indice_directorios
+from indice_trigramas import indexar_archivos, indexar_estructura
+from indice_bm25 import notificar_descripcion
+from indice_difuso import indice_difuso_construido
+from paginacion import (CursorInvalido, IndicePreorden, indice_preorden, pagina_compacta, podar, resumen_nodo,
+                        validar_paginacion)
+from vigilante import detener_vigilancia, iniciar_vigilancia
+from huellas import calcular_huellas, duplicados, huellas_guardadas
+from ejecutor import comprobar_cancelacion, estado as estado_ejecutor, version_asincrona
+from metricas import fase, iniciar_volcado_periodico, instrumentar, obtener_metricas, registrar_bytes_leidos
 
 mcp = FastMCP("filesystem_pro")
 
+# Archivo donde leer_estructura_directorios guarda la estructura
+RUTA_ESTRUCTURA = "/Users/msaez/Desktop/Gesco/estructura.json"
+
+# Con MCP_ESTRUCTURA_COMPACTA=1 las estructuras JSON se rastrean y consultan como
+# ArbolCompacto (ver arbol_compacto.py) en lugar de como diccionarios anidados
+ESTRUCTURA_COMPACTA = os.environ.get("MCP_ESTRUCTURA_COMPACTA") == "1"
+
 
-@mcp.tool()
 def guardar_memoria(resultado, ruta):
     """
     Guarda un resultado (diccionario JSON) en la ruta especificada.
+    Si la ruta es un almacén SQLite (.db, .sqlite, .sqlite3) o una estructura
+    dividida (directorio .dividida) se reemplaza su contenido.
 
     Parámetros:
     - resultado (dict): El contenido JSON a guardar.
     - ruta (str): Ruta completa del archivo (incluyendo nombre y extensión), ej: "/directorio/estructura_directorios.json"
     """
     try:
+        if es_ruta_sqlite(ruta):
+            with AlmacenSQLite(ruta) as almacen:
+                almacen.importar(resultado)
+            print(f"Resultado guardado en: {ruta}", file=sys.stderr)
+            return
+
+        if es_ruta_dividida(ruta):
+            with fase('escritura'):
+                dividir(resultado, ruta)
+            print(f"Resultado guardado en: {ruta}", file=sys.stderr)
+            return
+
         # Crear el directorio si no existe
         os.makedirs(os.path.dirname(ruta), exist_ok=True)
 
         # Guardar el resultado en formato JSON
-        with open(ruta, 'w', encoding='utf-8') as archivo:
-            json.dump(resultado, archivo, ensure_ascii=False, indent=4)
+        with fase('escritura'):
+            guardar_estructura(ruta, resultado)
 
-        print(f"Resultado guardado en: {ruta}")
+        print(f"Resultado guardado en: {ruta}", file=sys.stderr)
     except Exception as e:
-        print(f"Error al guardar el archivo: {e}")
-
-@mcp.tool()
-def leer_estructura_directorios(ruta_analizar: str, force: bool = False) -> Dict[str, Union[str, List]]:
+        print(f"Error al guardar el archivo: {e}", file=sys.stderr)
+
+def leer_estructura_directorios(
+    ruta_analizar: str,
+    force: bool = False,
+    max_hilos: Optional[int] = None,
+    indexar_contenido: bool = False,
+    max_depth: Optional[int] = None,
+    subtree: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    calcular_hashes: bool = False,
+    almacen: Optional[str] = None,
+    metadatos: bool = False
+) -> Dict[str, Union[str, List]]:
     """
     Lee la estructura de directorios del path especificado, guarda el resultado
     en el path especificado y devuelve la estructura.
 
+    El recorrido usa os.scandir y explora los subárboles en paralelo; en la clave
+    'estadisticas_rastreo' se devuelven entradas por segundo y llamadas al sistema.
+    Con MCP_ESTRUCTURA_COMPACTA=1 (y sin metadatos, calcular_hashes ni almacen)
+    el recorrido es secuencial y vuelca en un ArbolCompacto; la respuesta y el
+    archivo guardado son los mismos.
+
+    La estructura completa se guarda siempre, pero la respuesta se puede acotar:
+    con max_depth y/o subtree se devuelve ese trozo del árbol anidado; con limit
+    se devuelve una página plana de nodos en preorden ('nodos') y, si quedan más,
+    'siguiente_cursor'. Al pasar cursor no se vuelve a recorrer el disco: la
+    página sale de la estructura ya guardada.
+
     Args:
         ruta_analizar: Path del directorio a analizar
         force: Si es True, sobreescribe el archivo sin preguntar
+        max_hilos: Hilos para el recorrido (1 = secuencial, por defecto MAX_HILOS_RASTREO)
+        indexar_contenido: Si es True, actualiza también el índice de trigramas del
+            contenido (solo relee los archivos nuevos o modificados)
+        max_depth: Niveles a devolver por debajo del nodo inicial (0 = solo el nodo)
+        subtree: full_path del directorio a devolver (la raíz por defecto)
+        limit: Nodos por página
+        cursor: 'siguiente_cursor' de la página anterior
+        calcular_hashes: Si es True, guarda en metadata['hash'] la huella del
+            contenido de cada archivo (ver huellas.py). Los archivos con el mismo
+            tamaño, mtime, inodo y ctime que en la estructura anterior no se releen
+        almacen: Directorio de un almacén por fragmentos (ver almacen_fragmentos.py).
+            La estructura se guarda como el fragmento de ruta_analizar, sin
+            reescribir ni recargar los de otras raíces, en lugar de en RUTA_ESTRUCTURA
+        metadatos: Si es True, guarda los metadatos de cada nodo (un stat por
+            entrada) y el resumen de cada directorio (ver resumenes.py), que usan
+            resumen_directorio y filtrar_por_metadata. Si la estructura guardada
+            ya los tiene se mantienen aunque no se pida; si no, el rastreo no
+            hace ningún stat por entrada
 
     Returns:
         dict: Estructura de directorios en formato diccionario anidado
     """
-    def explorar_directorio(path: str) -> Dict[str, Union[str, List]]:
-        nombre = os.path.basename(path)
-        if nombre.startswith('.') and nombre != os.path.basename(ruta_analizar):
-            return None
-
-        estructura = {
-            'name': nombre,
-            'type': 'directory',
-            'description': '',
-            'children': [],
-            'full_path': os.path.abspath(path)
-        }
+    error = validar_paginacion(max_depth, limit)
+    if error:
+        return {'error': error}
+
+    # Archivo donde se guarda (y de donde salen las páginas con cursor)
+    ruta_guardar = ruta_fragmento(almacen, ruta_analizar) if almacen else RUTA_ESTRUCTURA
 
+    if cursor:
         try:
-            elementos = os.listdir(path)
-            for elemento in sorted(elementos):
-                if elemento.startswith('.'):
-                    continue
-                ruta_completa = os.path.join(path, elemento)
-                if os.path.isdir(ruta_completa):
-                    subestructura = explorar_directorio(ruta_completa)
-                    if subestructura is not None:
-                        estructura['children'].append(subestructura)
-                else:
-                    archivo = {
-                        'name': elemento,
-                        'type': 'file',
-                        'full_path': os.path.abspath(ruta_completa)
-                    }
-                    estructura['children'].append(archivo)
-        except PermissionError:
-            estructura['error'] = 'Sin permisos de acceso'
+            if ESTRUCTURA_COMPACTA and not almacen:
+                arbol = cargar_compacto(ruta_guardar)
+                indices, siguiente = pagina_compacta(
+                    arbol, limit=limit, cursor=cursor, solo_directorios=False,
+                    version=huella_estructura(ruta_guardar)
+                )
+                return {
+                    'nodos': [arbol.resumen(i, profundidad) for i, profundidad in indices],
+                    'siguiente_cursor': siguiente
+                }
+            nodos, siguiente = indice_preorden(ruta_guardar, solo_directorios=False).pagina(limit=limit, cursor=cursor)
+        except CursorInvalido as e:
+            return {'error': str(e)}
         except Exception as e:
-            estructura['error'] = str(e)
-
-        return estructura
+            return {'error': f"No se pudo leer la estructura guardada: {str(e)}"}
+        return {
+            'nodos': [resumen_nodo(nodo, profundidad) for nodo, profundidad in nodos],
+            'siguiente_cursor': siguiente
+        }
 
     if not os.path.exists(ruta_analizar):
         return {'error': 'La ruta no existe'}
@@ -85,97 +160,579 @@ def leer_estructura_directorios(ruta_analizar: str, force: bool = False) -> Dict
     if not os.path.isdir(ruta_analizar):
         return {'error': 'La ruta no es un directorio'}
 
-    resultado = explorar_directorio(ruta_analizar)
+    # El árbol compacto no guarda metadatos ni huellas, y los fragmentos de un
+    # almacén se siguen leyendo como diccionarios
+    compacta = ESTRUCTURA_COMPACTA and not almacen and not calcular_hashes
 
-    # Ruta fija de guardado
-    ruta_guardar = "/Users/msaez/Desktop/Gesco/estructura.json"
+    if not metadatos and os.path.exists(ruta_guardar):
+        try:
+            # Una estructura rastreada con resúmenes no los pierde al volver a rastrearla
+            if compacta:
+                metadatos = tiene_resumenes(cargar_compacto(ruta_guardar).nodo(0))
+            else:
+                metadatos = tiene_resumenes(cargar_estructura(ruta_guardar))
+        except Exception:
+            pass
+    compacta = compacta and not metadatos
+
+    estadisticas = EstadisticasRastreo()
+    with fase('recorrido'):
+        if compacta:
+            arbol = explorar_compacto(ruta_analizar, estadisticas=estadisticas)
+        else:
+            estructura = explorar_arbol(
+                ruta_analizar, max_hilos=max_hilos, estadisticas=estadisticas, metadatos=metadatos
+            )
+
+    # La estructura guardada queda en caché: la respuesta se anota sobre una copia
+    anotaciones = {}
+
+    if calcular_hashes:
+        comprobar_cancelacion()
+        try:
+            anteriores = huellas_guardadas(cargar_estructura(ruta_guardar)) if os.path.exists(ruta_guardar) else {}
+        except Exception:
+            # Sin estructura anterior legible se calculan todas
+            anteriores = {}
+        with fase('huellas'):
+            anotaciones['huellas'] = calcular_huellas(estructura, anteriores)
+        registrar_bytes_leidos(anotaciones['huellas']['bytes_leidos'])
 
     try:
         # Crear el directorio si no existe (aunque en este caso siempre existe)
         os.makedirs(os.path.dirname(ruta_guardar), exist_ok=True)
 
-        with open(ruta_guardar, 'w', encoding='utf-8') as archivo:
-            json.dump(resultado, archivo, ensure_ascii=False, indent=4)
+        with fase('escritura'):
+            if compacta:
+                guardar_compacto(ruta_guardar, arbol)
+            else:
+                guardar_estructura(ruta_guardar, estructura)
 
-        print(f"Resultado guardado en: {ruta_guardar}")
-        resultado['archivo_generado'] = ruta_guardar
+        print(f"Resultado guardado en: {ruta_guardar}", file=sys.stderr)
+        anotaciones['archivo_generado'] = ruta_guardar
+        if almacen:
+            anotaciones['fragmento'] = registrar_fragmento(almacen, ruta_analizar, estadisticas.entradas)
     except Exception as e:
-        resultado['error_guardado'] = f"Error al guardar el archivo JSON: {str(e)}"
+        anotaciones['error_guardado'] = f"Error al guardar el archivo JSON: {str(e)}"
 
-    return resultado
+    if indexar_contenido:
+        comprobar_cancelacion()
+        try:
+            with fase('indexado'):
+                if compacta:
+                    anotaciones['indice_contenido'] = indexar_archivos(arbol.archivos(), ruta_guardar)
+                else:
+                    anotaciones['indice_contenido'] = indexar_estructura(estructura, ruta_guardar)
+        except Exception as e:
+            anotaciones['indice_contenido'] = {'error': f"Error al indexar el contenido: {str(e)}"}
+
+    anotaciones['estadisticas_rastreo'] = estadisticas.como_dict()
+
+    if compacta:
+        return _respuesta_compacta(arbol, ruta_guardar, anotaciones, max_depth, subtree, limit)
+
+    if max_depth is None and subtree is None and limit is None:
+        return dict(estructura, **anotaciones)
+
+    with fase('serializacion'):
+        if 'archivo_generado' in anotaciones:
+            indice = indice_preorden(ruta_guardar, solo_directorios=False)
+        else:
+            indice = IndicePreorden(estructura, solo_directorios=False)
+        if subtree and subtree not in indice.posiciones:
+            return dict(anotaciones, error=f"No se encontró {subtree} en la estructura")
+
+        if limit is not None:
+            nodos, siguiente = indice.pagina(subtree, max_depth, limit)
+            return dict(
+                anotaciones,
+                nodos=[resumen_nodo(nodo, profundidad) for nodo, profundidad in nodos],
+                siguiente_cursor=siguiente
+            )
+        nodo = indice.nodos[indice.posiciones[subtree]] if subtree else estructura
+        return dict(podar(nodo, max_depth), **anotaciones)
+
+def _respuesta_compacta(
+    arbol: ArbolCompacto,
+    ruta_guardar: str,
+    anotaciones: Dict,
+    max_depth: Optional[int],
+    subtree: Optional[str],
+    limit: Optional[int]
+) -> Dict:
+    """Respuesta de leer_estructura_directorios a partir del árbol compacto recién rastreado."""
+    with fase('serializacion'):
+        if max_depth is None and subtree is None and limit is None:
+            return dict(arbol.a_estructura(), **anotaciones)
+
+        inicio = arbol.buscar(subtree) if subtree else 0
+        if inicio is None:
+            return dict(anotaciones, error=f"No se encontró {subtree} en la estructura")
+
+        if limit is not None:
+            # Sin archivo guardado la versión se sortea, como en IndicePreorden
+            version = huella_estructura(ruta_guardar) if 'archivo_generado' in anotaciones else None
+            indices, siguiente = pagina_compacta(arbol, subtree, max_depth, limit, solo_directorios=False, version=version)
+            return dict(
+                anotaciones,
+                nodos=[arbol.resumen(i, profundidad) for i, profundidad in indices],
+                siguiente_cursor=siguiente
+            )
+        return dict(arbol.podar(inicio, max_depth), **anotaciones)
 
 @mcp.tool()
+@instrumentar
+@compartiendo_estructuras
 def agregar_descripcion_repo(json_path: str, nombre_repo: str, descripcion: str) -> dict:
     """
     Añade o modifica la descripción de un directorio (repo) en el JSON de estructura de directorios.
 
     Parámetros:
-    - json_path (str): Ruta al archivo JSON.
+    - json_path (str): Ruta al archivo JSON, al almacén SQLite o a la estructura dividida.
     - nombre_repo (str): Nombre del directorio (repo) al que se le quiere añadir la descripción.
     - descripcion (str): Descripción a añadir.
 
     Returns:
-        dict: Resultado de la operación (éxito o error)
+        dict: Resultado de la operación (éxito o error). Si el repo no está en el
+        JSON, 'sugerencias' lleva los directorios con un nombre parecido (si el
+        índice de buscar_nombre_aproximado ya está construido).
     """
-    import json
+    if es_ruta_sqlite(json_path):
+        try:
+            with AlmacenSQLite(json_path) as almacen:
+                encontrado = almacen.actualizar_descripcion(nombre_repo, descripcion)
+        except Exception as e:
+            return {"error": f"No se pudo actualizar el almacén SQLite: {str(e)}"}
+        if encontrado:
+            return {"success": f"Descripción añadida/modificada para el repo '{nombre_repo}'."}
+        return {"error": f"No se encontró el repo '{nombre_repo}' en la estructura."}
+
+    if es_ruta_dividida(json_path):
+        # Solo se leen los subárboles que contienen un directorio con ese nombre
+        try:
+            estructura = almacen_dividido.abrir(json_path)
+            with fase('carga'):
+                encontrados = estructura.por_nombre(nombre_repo, todos=False)
+            if not encontrados:
+                return {"error": f"No se encontró el repo '{nombre_repo}' en la estructura."}
+            with fase('escritura'):
+                estructura.fijar_descripciones([encontrados[0] + (descripcion,)])
+        except Exception as e:
+            return {"error": f"No se pudo actualizar la estructura dividida: {str(e)}"}
+        return {"success": f"Descripción añadida/modificada para el repo '{nombre_repo}'."}
+
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            estructura = json.load(f)
+        with fase('carga'):
+            if ESTRUCTURA_COMPACTA:
+                arbol = cargar_compacto(json_path)
+            else:
+                indice = indice_directorios(json_path)
     except Exception as e:
         return {"error": f"No se pudo leer el archivo JSON: {str(e)}"}
 
-    def buscar_y_actualizar(nodo):
-        if nodo.get('type') == 'directory' and nodo.get('name') == nombre_repo:
-            nodo['description'] = descripcion
-            return True
-        for child in nodo.get('children', []):
-            if buscar_y_actualizar(child):
-                return True
-        return False
+    if ESTRUCTURA_COMPACTA:
+        # Primer directorio con ese nombre en preorden, como primero_por_nombre
+        encontrados = arbol.directorios_por_nombre(nombre_repo)
+        if encontrados:
+            try:
+                arbol.fijar_descripcion(encontrados[0], descripcion)
+                full_path = arbol.ruta_guardada(encontrados[0])
+                with fase('escritura'):
+                    if full_path:
+                        registrar_cambios(json_path, [cambio_descripcion(descripcion, full_path=full_path)], arbol)
+                    else:
+                        guardar_compacto(json_path, arbol)
+                notificar_descripcion(json_path, full_path, descripcion)
+                return {"success": f"Descripción añadida/modificada para el repo '{nombre_repo}'."}
+            except Exception as e:
+                return {"error": f"No se pudo guardar el archivo JSON: {str(e)}"}
+    else:
+        # Primer directorio con ese nombre en profundidad, igual que el recorrido original
+        nodo = indice.primero_por_nombre(nombre_repo)
+
+        if nodo is not None:
+            try:
+                nodo['description'] = descripcion
+                with fase('escritura'):
+                    # Solo se anota el cambio en el registro; el árbol se reescribe al compactar
+                    if nodo.get('full_path'):
+                        registrar_cambios(json_path, [cambio_descripcion(descripcion, full_path=nodo['full_path'])])
+                    else:
+                        guardar_estructura(json_path, indice.estructura)
+                notificar_descripcion(json_path, nodo.get('full_path', ''), descripcion)
+                return {"success": f"Descripción añadida/modificada para el repo '{nombre_repo}'."}
+            except Exception as e:
+                return {"error": f"No se pudo guardar el archivo JSON: {str(e)}"}
+
+    respuesta = {"error": f"No se encontró el repo '{nombre_repo}' en la estructura."}
+    # Directorios con un nombre parecido, por si es una errata. Solo si el
+    # índice ya está construido: construirlo aquí bloquearía la llamada
+    try:
+        difuso = indice_difuso_construido(json_path)
+        if difuso is not None:
+            with fase('sugerencias'):
+                parecidos = difuso.buscar(nombre_repo, limite=5, solo_directorios=True)
+            if parecidos:
+                respuesta["sugerencias"] = [
+                    difuso.nombres.nodos[fila].get('full_path', difuso.nombres.nombres[fila])
+                    for fila, _, _ in parecidos
+                ]
+    except Exception:
+        # Las sugerencias son un extra: sin ellas el error sigue siendo válido
+        pass
+    return respuesta
+
+@mcp.tool()
+@instrumentar
+@compartiendo_estructuras
+def agregar_descripciones_lote(json_path: str, descripciones: Dict[str, str]) -> dict:
+    """
+    Añade o modifica las descripciones de varios directorios con una sola lectura
+    de la estructura y una sola escritura en su registro de cambios.
+
+    Parámetros:
+    - json_path (str): Ruta al archivo JSON, al almacén SQLite o a la estructura dividida.
+    - descripciones (dict): {full_path o nombre_directorio: descripcion, ...}.
+      Un nombre que corresponde a varios directorios no se aplica y se informa
+      en 'ambiguos' con sus full_path para repetirlo con la ruta completa.
 
-    encontrado = buscar_y_actualizar(estructura)
+    Returns:
+        dict: {"actualizados": [...], "ambiguos": {nombre: [full_path, ...]}, "no_encontrados": [...]}
+    """
+    if es_ruta_sqlite(json_path):
+        try:
+            with AlmacenSQLite(json_path) as almacen:
+                return almacen.actualizar_descripciones(descripciones)
+        except Exception as e:
+            return {"error": f"No se pudo actualizar el almacén SQLite: {str(e)}"}
 
-    if encontrado:
+    if es_ruta_dividida(json_path):
         try:
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(estructura, f, ensure_ascii=False, indent=4)
-            return {"success": f"Descripción añadida/modificada para el repo '{nombre_repo}'."}
+            estructura = almacen_dividido.abrir(json_path)
+            informe = {"actualizados": [], "ambiguos": {}, "no_encontrados": []}
+            cambios = []
+            with fase('carga'):
+                for clave, descripcion in descripciones.items():
+                    nodo, resumen = estructura.nodo(clave)
+                    encontrados = [(nodo, resumen)] if nodo is not None and nodo.get('type') == 'directory' else estructura.por_nombre(clave)
+                    if not encontrados:
+                        informe["no_encontrados"].append(clave)
+                    elif len(encontrados) > 1:
+                        informe["ambiguos"][clave] = [n.get('full_path', '') for n, _ in encontrados]
+                    else:
+                        cambios.append(encontrados[0] + (descripcion,))
+                        informe["actualizados"].append(encontrados[0][0].get('full_path', clave))
+            if cambios:
+                with fase('escritura'):
+                    estructura.fijar_descripciones(cambios)
+        except Exception as e:
+            return {"error": f"No se pudo actualizar la estructura dividida: {str(e)}"}
+        return informe
+
+    if ESTRUCTURA_COMPACTA:
+        return _descripciones_lote_compacto(json_path, descripciones)
+
+    try:
+        with fase('carga'):
+            indice = indice_directorios(json_path)
+    except Exception as e:
+        return {"error": f"No se pudo leer el archivo JSON: {str(e)}"}
+
+    informe = {"actualizados": [], "ambiguos": {}, "no_encontrados": []}
+    cambios = []
+    actualizados = []
+    for clave, descripcion in descripciones.items():
+        nodos = indice.resolver(clave)
+        if not nodos:
+            informe["no_encontrados"].append(clave)
+        elif len(nodos) > 1:
+            informe["ambiguos"][clave] = [n.get('full_path', '') for n in nodos]
+        else:
+            nodos[0]['description'] = descripcion
+            actualizados.append(nodos[0])
+            informe["actualizados"].append(nodos[0].get('full_path', clave))
+            cambios.append(cambio_descripcion(descripcion, full_path=nodos[0].get('full_path')))
+
+    if informe["actualizados"]:
+        try:
+            with fase('escritura'):
+                if all(c.get('full_path') for c in cambios):
+                    registrar_cambios(json_path, cambios)
+                else:
+                    guardar_estructura(json_path, indice.estructura)
         except Exception as e:
             return {"error": f"No se pudo guardar el archivo JSON: {str(e)}"}
-    else:
-        return {"error": f"No se encontró el repo '{nombre_repo}' en la estructura."}
+        for nodo in actualizados:
+            notificar_descripcion(json_path, nodo.get('full_path', ''), nodo['description'])
+    return informe
 
-@mcp.tool()
-def obtener_descripciones_directorios(json_path: str) -> dict:
+def _descripciones_lote_compacto(json_path: str, descripciones: Dict[str, str]) -> dict:
+    """agregar_descripciones_lote sobre el árbol compacto de json_path (MCP_ESTRUCTURA_COMPACTA)."""
+    try:
+        with fase('carga'):
+            arbol = cargar_compacto(json_path)
+    except Exception as e:
+        return {"error": f"No se pudo leer el archivo JSON: {str(e)}"}
+
+    informe = {"actualizados": [], "ambiguos": {}, "no_encontrados": []}
+    cambios = []
+    actualizados = []
+    for clave, descripcion in descripciones.items():
+        indices = arbol.resolver(clave)
+        if not indices:
+            informe["no_encontrados"].append(clave)
+        elif len(indices) > 1:
+            informe["ambiguos"][clave] = [arbol.ruta_guardada(i) for i in indices]
+        else:
+            arbol.fijar_descripcion(indices[0], descripcion)
+            full_path = arbol.ruta_guardada(indices[0])
+            actualizados.append((full_path, descripcion))
+            informe["actualizados"].append(full_path or clave)
+            cambios.append(cambio_descripcion(descripcion, full_path=full_path))
+
+    if informe["actualizados"]:
+        try:
+            with fase('escritura'):
+                if all(c.get('full_path') for c in cambios):
+                    registrar_cambios(json_path, cambios, arbol)
+                else:
+                    guardar_compacto(json_path, arbol)
+        except Exception as e:
+            return {"error": f"No se pudo guardar el archivo JSON: {str(e)}"}
+        for full_path, descripcion in actualizados:
+            notificar_descripcion(json_path, full_path, descripcion)
+    return informe
+
+def obtener_descripciones_directorios(
+    json_path: str,
+    max_depth: Optional[int] = None,
+    subtree: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> dict:
     """
     Devuelve un diccionario con el nombre de cada directorio, su descripción y su path completo.
 
     Parámetros:
-    - json_path (str): Ruta al archivo JSON.
+    - json_path (str): Ruta al archivo JSON, al almacén SQLite, a una estructura dividida
+      (solo se leen los subárboles a los que llega la página) o al directorio de un almacén
+      por fragmentos (se recorren sus fragmentos uno detrás de otro).
+    - max_depth (int): Niveles de subdirectorios a incluir (0 = solo el directorio inicial).
+    - subtree (str): full_path del directorio desde el que listar (la raíz por defecto).
+    - limit (int): Directorios por página.
+    - cursor (str): 'siguiente_cursor' de la página anterior.
 
     Returns:
         dict: {nombre_directorio: {"descripcion": ..., "full_path": ...}, ...}
+              Con limit o cursor: {"descripciones": {...}, "siguiente_cursor": ...}
+    """
+    error = validar_paginacion(max_depth, limit)
+    if error:
+        return {"error": error}
+
+    try:
+        if es_ruta_sqlite(json_path):
+            with AlmacenSQLite(json_path) as almacen:
+                directorios, siguiente = almacen.pagina_directorios(subtree, max_depth, limit, cursor)
+            descripciones = {
+                d['name']: {'descripcion': d['descripcion'], 'full_path': d['full_path']}
+                for d in directorios
+            }
+        else:
+            if es_ruta_dividida(json_path):
+                # Cada subárbol de primer nivel se carga cuando la página baja a él
+                with fase('recorrido'):
+                    nodos, siguiente = almacen_dividido.abrir(json_path).pagina(subtree, max_depth, limit, cursor)
+            elif es_almacen_fragmentos(json_path):
+                # Cada fragmento se carga cuando la página llega a él
+                with fase('recorrido'):
+                    nodos, siguiente = almacen_fragmentos.pagina(json_path, subtree, max_depth, limit, cursor)
+            elif ESTRUCTURA_COMPACTA:
+                # El árbol compacto ya está en preorden: la página sale sin índice aparte
+                with fase('carga'):
+                    arbol = cargar_compacto(json_path)
+                with fase('recorrido'):
+                    indices, siguiente = pagina_compacta(
+                        arbol, subtree, max_depth, limit, cursor, version=huella_estructura(json_path)
+                    )
+                    nodos = [(arbol.nodo(i), profundidad) for i, profundidad in indices]
+            else:
+                with fase('carga'):
+                    indice = indice_preorden(json_path)
+                with fase('recorrido'):
+                    nodos, siguiente = indice.pagina(subtree, max_depth, limit, cursor)
+            descripciones = {
+                nodo.get('name'): {
+                    'descripcion': nodo.get('description', ''),
+                    'full_path': nodo.get('full_path', '')
+                }
+                for nodo, _ in nodos
+            }
+    except KeyError:
+        return {"error": f"No se encontró el directorio {subtree}"}
+    except CursorInvalido as e:
+        return {"error": str(e)}
+    except Exception as e:
+        return {"error": f"No se pudo leer la estructura: {str(e)}"}
+
+    if limit is not None or cursor:
+        return {"descripciones": descripciones, "siguiente_cursor": siguiente}
+    return descripciones
+
+def importar_estructura_sqlite(json_path: str, db_path: str) -> dict:
+    """
+    Importa un archivo JSON de estructura a un almacén SQLite, donde las lecturas
+    y actualizaciones solo tocan las filas necesarias.
+
+    Parámetros:
+    - json_path (str): Ruta al archivo JSON existente.
+    - db_path (str): Ruta del almacén SQLite (.db, .sqlite o .sqlite3).
+
+    Returns:
+        dict: Resultado de la operación (éxito o error)
     """
-    import json
+    if not es_ruta_sqlite(db_path):
+        return {"error": "El almacén debe tener extensión .db, .sqlite o .sqlite3"}
+    return importar_json(json_path, db_path)
+
+def exportar_estructura_sqlite(db_path: str, json_path: str) -> dict:
+    """
+    Exporta un almacén SQLite al formato JSON de estructura de directorios.
+
+    Parámetros:
+    - db_path (str): Ruta del almacén SQLite.
+    - json_path (str): Ruta del archivo JSON a generar.
+
+    Returns:
+        dict: Resultado de la operación (éxito o error)
+    """
+    return exportar_json(db_path, json_path)
+
+@mcp.tool()
+@instrumentar
+@compartiendo_estructuras
+def buscar_duplicados(json_path: Optional[str] = None, tamano_minimo: int = 1) -> dict:
+    """
+    Informe de archivos con el mismo contenido, según las huellas guardadas por
+    leer_estructura_directorios(..., calcular_hashes=True). Los grupos van
+    ordenados por los bytes que se liberarían dejando una sola copia.
+
+    Parámetros:
+    - json_path (str): Archivo JSON de estructura (RUTA_ESTRUCTURA por defecto).
+    - tamano_minimo (int): Bytes mínimos de un archivo para tenerlo en cuenta.
+
+    Returns:
+        dict: Grupos de duplicados con sus rutas, archivos duplicados y bytes recuperables
+    """
+    json_path = json_path or RUTA_ESTRUCTURA
+    if es_ruta_sqlite(json_path):
+        return {"error": "El informe de duplicados solo está disponible para estructuras JSON"}
+    if not os.path.exists(json_path):
+        return {"error": f"No existe el archivo de estructura {json_path}"}
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            estructura = json.load(f)
+        with fase('carga'):
+            estructura = cargar_estructura(json_path)
+        with fase('recorrido'):
+            informe = duplicados(estructura, tamano_minimo)
     except Exception as e:
-        return {"error": f"No se pudo leer el archivo JSON: {str(e)}"}
+        return {"error": f"No se pudo generar el informe de duplicados: {str(e)}"}
+    if not informe['archivos_con_huella']:
+        informe['aviso'] = "La estructura no tiene huellas: genérala con calcular_hashes=True"
+    return informe
 
-    descripciones = {}
+def dividir_estructura(json_path: str, directorio: str) -> dict:
+    """
+    Convierte un archivo JSON de estructura al formato dividido: la raíz y los
+    directorios de primer nivel (con sus descripciones) en una cabecera y cada
+    subárbol de primer nivel en su propio archivo, que solo se lee cuando una
+    herramienta baja a él.
 
-    def recolectar(nodo):
-        if nodo.get('type') == 'directory':
-            descripciones[nodo.get('name')] = {
-                'descripcion': nodo.get('description', ''),
-                'full_path': nodo.get('full_path', '')
-            }
-            for child in nodo.get('children', []):
-                recolectar(child)
+    Parámetros:
+    - json_path (str): Ruta al archivo JSON existente.
+    - directorio (str): Directorio de la estructura dividida (terminado en .dividida).
 
-    recolectar(estructura)
-    return descripciones
+    Returns:
+        dict: Resultado de la operación (éxito o error)
+    """
+    if not es_ruta_dividida(directorio):
+        return {"error": "El directorio de la estructura dividida debe terminar en .dividida"}
+    return dividir_json(json_path, directorio)
+
+def unir_estructura(directorio: str, json_path: str) -> dict:
+    """
+    Reúne una estructura dividida en un único archivo JSON de estructura.
+
+    Parámetros:
+    - directorio (str): Directorio de la estructura dividida.
+    - json_path (str): Ruta del archivo JSON a generar.
+
+    Returns:
+        dict: Resultado de la operación (éxito o error)
+    """
+    return unir_json(directorio, json_path)
+
+@mcp.tool()
+@instrumentar
+def vigilar_estructura(json_path: Optional[str] = None, activar: bool = True, debounce_segundos: float = 2.0, intervalo_sondeo: float = 5.0) -> dict:
+    """
+    Activa o desactiva la vigilancia en segundo plano del árbol de una estructura.
+    Mientras está activa, las creaciones, borrados y renombrados del sistema de
+    archivos se aplican a la estructura en memoria (conservando descripciones) y
+    se escriben en disco agrupados, sin volver a recorrer todo el árbol.
+    Usa inotify en Linux y, si no está disponible, sondeo por mtime.
+
+    Parámetros:
+    - json_path (str): Archivo JSON de estructura (RUTA_ESTRUCTURA por defecto).
+    - activar (bool): True para arrancar la vigilancia, False para detenerla.
+    - debounce_segundos (float): Segundos sin cambios antes de escribir en disco.
+    - intervalo_sondeo (float): Segundos entre barridos cuando no hay inotify.
+
+    Returns:
+        dict: Estado del vigilante (modo, directorios vigilados, cambios, guardados...)
+    """
+    json_path = json_path or RUTA_ESTRUCTURA
+    if es_ruta_sqlite(json_path):
+        return {"error": "La vigilancia solo está disponible para estructuras JSON"}
+    try:
+        if not activar:
+            estado = detener_vigilancia(json_path)
+            return estado or {"error": f"No había vigilancia activa para {json_path}"}
+        if not os.path.exists(json_path):
+            return {"error": f"No existe el archivo de estructura {json_path}"}
+        return iniciar_vigilancia(json_path, debounce=debounce_segundos, intervalo_sondeo=intervalo_sondeo).estado()
+    except Exception as e:
+        return {"error": f"No se pudo cambiar la vigilancia: {str(e)}"}
+
+# Herramientas con E/S pesada: se registran en versión async, que las ejecuta en
+# el pool acotado de ejecutor.py (MCP_MAX_TRABAJOS_IO trabajos a la vez) para que
+# el resto de herramientas siga respondiendo mientras tanto. Las funciones
+# síncronas siguen disponibles para llamarlas directamente. Todas (salvo
+# vigilar_estructura, que espera al vigilante al detenerlo) recorren las
+# estructuras cacheadas con lectura_estructuras tomado, para que el vigilante
+# no las modifique a la vez.
+for _herramienta in (guardar_memoria, leer_estructura_directorios, obtener_descripciones_directorios,
+                     importar_estructura_sqlite, exportar_estructura_sqlite, dividir_estructura, unir_estructura):
+    mcp.tool()(instrumentar(version_asincrona(compartiendo_estructuras(_herramienta))))
+
+@mcp.tool()
+def metricas(reiniciar: bool = False) -> dict:
+    """
+    Devuelve las métricas de uso de las herramientas de este servidor: llamadas,
+    errores, latencias (media, p50, p95, p99, máxima), tiempo por fase (carga,
+    recorrido, huellas, escritura, indexado), bytes leídos de disco y bytes devueltos
+    (estimados por muestreo). En 'ejecutor', los trabajos de E/S en curso, en
+    espera y cancelados.
+
+    Parámetros:
+    - reiniciar (bool): Si es True, pone los contadores a cero después de leerlos.
+
+    Returns:
+        dict: Instantánea de las métricas por herramienta.
+    """
+    return dict(obtener_metricas(reiniciar), ejecutor=estado_ejecutor())
 
 if __name__ == "__main__":
+    iniciar_volcado_periodico()
+    if os.environ.get("MCP_VIGILAR_ESTRUCTURA") and os.path.exists(RUTA_ESTRUCTURA):
+        iniciar_vigilancia(RUTA_ESTRUCTURA)
     mcp.run()
\ No newline at end of file
@@ -0,0 +1,292 @@
+import math
+import operator
+import os
+from array import array
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_estructura import derivado
+
+try:
+    import numpy as np
+except ImportError:  # Sin NumPy las columnas se quedan en array y los filtros recorren las filas en Python
+    np = None
+
+# Nombre del derivado en cache_estructura
+NOMBRE_TABLA = 'tabla_metadatos'
+
+# Fecha que el buscador asume para los nodos sin 'modificado'
+FECHA_POR_DEFECTO = "1970-01-01"
+
+# Límites (en bytes) de los tramos de distribucion_tamanos
+TRAMOS_TAMANO = (1024, 1024 * 1024, 100 * 1024 * 1024)
+NOMBRES_TRAMOS = ("0-1KB", "1KB-1MB", "1MB-100MB", "100MB+")
+
+
+def _fecha(texto: Any) -> Tuple[float, int]:
+    """(segundos desde epoch, año*12 + mes-1) de una fecha ISO, o (nan, -1) si no es válida."""
+    try:
+        fecha = datetime.fromisoformat(texto)
+        return fecha.timestamp(), fecha.year * 12 + fecha.month - 1
+    except (TypeError, ValueError, OverflowError, OSError):
+        return math.nan, -1
+
+
+def _pertenece(columna, valores: frozenset):
+    if np is not None and isinstance(columna, np.ndarray):
+        return np.isin(columna, list(valores))
+    return columna in valores
+
+
+def rutas_de_filas(nodos: List[Dict], padres, filas) -> List[str]:
+    """
+    Ruta del directorio que contiene cada fila, desde el nombre de la raíz ('' para
+    la raíz), como las devuelve search.py. Las de los directorios se calculan una
+    sola vez aunque contengan muchas filas.
+    """
+    memo: Dict[int, str] = {-1: ""}
+
+    def ruta_directorio(fila: int) -> str:
+        pendientes = []
+        while fila not in memo:
+            pendientes.append(fila)
+            fila = padres[fila]
+        for directorio in reversed(pendientes):
+            memo[directorio] = os.path.join(memo[padres[directorio]], nodos[directorio]['name'])
+        return memo[pendientes[0]] if pendientes else memo[fila]
+
+    return [ruta_directorio(padres[fila]) for fila in filas]
+
+
+class _Valores:
+    """Tabla de valores internados: cada valor distinto se guarda una vez y las filas llevan su id."""
+
+    def __init__(self):
+        self.valores: List[Any] = []
+        self._ids: Dict[Any, int] = {}
+
+    def id(self, valor: Any) -> int:
+        identificador = self._ids.get(valor)
+        if identificador is None:
+            identificador = self._ids[valor] = len(self.valores)
+            self.valores.append(valor)
+        return identificador
+
+    def buscar(self, valor: Any) -> int:
+        """Id del valor, o -1 si ninguna fila lo tiene."""
+        return self._ids.get(valor, -1)
+
+
+class TablaMetadatos:
+    """
+    Metadatos de todos los nodos de una estructura en columnas (una fila por nodo,
+    en el mismo preorden en que los recorre search.py): tamaño, fechas de
+    modificación y creación en segundos desde epoch, mes de modificación, y
+    tipo, extensión y permisos como ids de valores internados.
+
+    Las fechas se convierten una sola vez al construir la tabla; los filtros y
+    las estadísticas son operaciones sobre columnas enteras (máscaras y
+    agregados de NumPy si está instalado).
+    """
+
+    def __init__(self):
+        self.nodos: List[Dict] = []
+        self.padres = array('i')
+        self.tamanos = array('q')
+        self.modificados = array('d')
+        self.creados = array('d')
+        self.meses = array('i')
+        self.tipos = array('i')
+        self.extensiones = array('i')
+        self.permisos = array('i')
+        self.valores_tipo = _Valores()
+        self.valores_extension = _Valores()
+        self.valores_permisos = _Valores()
+        # Hay nombres con puntos pero sin extensión ('.bashrc'): solo ellos pueden acabar
+        # en un sufijo con punto sin que su extensión acabe en él
+        self.puntos_sin_extension = False
+        self._cerrada = False
+
+    def __len__(self) -> int:
+        return len(self.nodos)
+
+    def anadir(self, nodo: Dict, padre: int = -1, stat: Optional[os.stat_result] = None) -> int:
+        """
+        Añade la fila de un nodo (después de la de su padre) y devuelve su índice.
+        Con el stat del rastreo no hace falta convertir las fechas ISO de 'metadata'.
+        """
+        if self._cerrada:
+            raise RuntimeError("La tabla ya está cerrada")
+        metadata = nodo.get('metadata', {})
+        if stat is not None:
+            tamano = stat.st_size
+            modificado = stat.st_mtime
+            fecha = datetime.fromtimestamp(modificado)
+            mes = fecha.year * 12 + fecha.month - 1
+            creado = stat.st_ctime
+            permisos = oct(stat.st_mode)[-3:]
+        else:
+            tamano = metadata.get('tamano', 0)
+            modificado, mes = _fecha(metadata.get('modificado', FECHA_POR_DEFECTO))
+            creado, _ = _fecha(metadata.get('creado'))
+            permisos = metadata.get('permisos')
+
+        fila = len(self.nodos)
+        self.nodos.append(nodo)
+        self.padres.append(padre)
+        self.tamanos.append(int(tamano) if isinstance(tamano, (int, float)) else 0)
+        self.modificados.append(modificado)
+        self.creados.append(creado)
+        self.meses.append(mes)
+        self.tipos.append(self.valores_tipo.id(nodo.get('type')))
+        nombre = nodo.get('name', '')
+        extension = os.path.splitext(nombre)[1]
+        if not extension and '.' in nombre:
+            self.puntos_sin_extension = True
+        self.extensiones.append(self.valores_extension.id(extension))
+        self.permisos.append(self.valores_permisos.id(permisos))
+        return fila
+
+    def cerrar(self) -> 'TablaMetadatos':
+        """Da la tabla por completa y pasa las columnas a arrays de NumPy (sin copiarlas)."""
+        if not self._cerrada and np is not None:
+            for nombre, tipo in (('tamanos', np.int64), ('modificados', np.float64), ('creados', np.float64),
+                                 ('meses', np.int32), ('tipos', np.int32), ('extensiones', np.int32),
+                                 ('permisos', np.int32)):
+                setattr(self, nombre, np.frombuffer(getattr(self, nombre), dtype=tipo))
+        self._cerrada = True
+        return self
+
+    @classmethod
+    def desde_estructura(cls, estructura: Dict) -> 'TablaMetadatos':
+        """Construye la tabla recorriendo una estructura ya cargada."""
+        tabla = cls()
+        pila = [(estructura, -1)]
+        while pila:
+            nodo, padre = pila.pop()
+            fila = tabla.anadir(nodo, padre)
+            if nodo.get('type') == 'directory':
+                pila.extend((hijo, fila) for hijo in reversed(nodo.get('children', [])))
+        return tabla.cerrar()
+
+    def rutas(self, filas) -> List[str]:
+        """Ruta del directorio que contiene cada nodo (ver rutas_de_filas)."""
+        return rutas_de_filas(self.nodos, self.padres, filas)
+
+    def _seleccionar(self, condiciones: List[Tuple[str, Callable, Any]]):
+        """Índices de las filas que cumplen todas las condiciones (columna, operador, valor)."""
+        if np is not None and self._cerrada:
+            mascara = np.ones(len(self), dtype=bool)
+            for columna, operacion, valor in condiciones:
+                mascara &= operacion(getattr(self, columna), valor)
+            return np.flatnonzero(mascara)
+        columnas = [(getattr(self, columna), operacion, valor) for columna, operacion, valor in condiciones]
+        return [
+            fila for fila in range(len(self))
+            if all(operacion(columna[fila], valor) for columna, operacion, valor in columnas)
+        ]
+
+    def filtrar(self, filtros: Dict[str, Any]):
+        """
+        Filas que cumplen los filtros de filtrar_por_metadata (tipo, tamano_min,
+        tamano_max, modificado_despues, permisos), en preorden.
+
+        Raises:
+            ValueError: Si modificado_despues no es una fecha ISO
+        """
+        condiciones = []
+        if "tipo" in filtros:
+            condiciones.append(('tipos', operator.eq, self.valores_tipo.buscar(filtros["tipo"])))
+        if "tamano_min" in filtros:
+            condiciones.append(('tamanos', operator.ge, filtros["tamano_min"]))
+        if "tamano_max" in filtros:
+            condiciones.append(('tamanos', operator.le, filtros["tamano_max"]))
+        if "modificado_despues" in filtros:
+            condiciones.append(('modificados', operator.ge, datetime.fromisoformat(filtros["modificado_despues"]).timestamp()))
+        if "permisos" in filtros:
+            condiciones.append(('permisos', operator.eq, self.valores_permisos.buscar(filtros["permisos"])))
+        return self._seleccionar(condiciones)
+
+    def estadisticas(self, criterios: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Estadísticas de estadisticas_busqueda sobre las filas que cumplen los
+        criterios (tipo, extension, fecha_inicio, fecha_fin).
+
+        Raises:
+            ValueError: Si fecha_inicio o fecha_fin no son fechas ISO
+        """
+        condiciones = []
+        if "tipo" in criterios:
+            condiciones.append(('tipos', operator.eq, self.valores_tipo.buscar(criterios["tipo"])))
+        dudosas: List[int] = []
+        if "extension" in criterios:
+            sufijo = criterios["extension"]
+            # Si la extensión del nombre acaba en el sufijo, el nombre también; si el sufijo
+            # es más largo que la extensión (".tar.gz", nombres sin extensión) hay que mirar el nombre
+            completas = [i for i, ext in enumerate(self.valores_extension.valores) if ext.endswith(sufijo)]
+            dudosas = [i for i, ext in enumerate(self.valores_extension.valores)
+                       if not ext.endswith(sufijo) and sufijo.endswith(ext)
+                       and (ext or '.' not in sufijo or self.puntos_sin_extension)]
+            condiciones.append(('extensiones', _pertenece, frozenset(completas + dudosas)))
+        if "fecha_inicio" in criterios:
+            condiciones.append(('modificados', operator.ge, datetime.fromisoformat(criterios["fecha_inicio"]).timestamp()))
+        if "fecha_fin" in criterios:
+            condiciones.append(('modificados', operator.le, datetime.fromisoformat(criterios["fecha_fin"]).timestamp()))
+
+        filas = self._seleccionar(condiciones)
+        if dudosas:
+            sufijo = criterios["extension"]
+            if np is not None and self._cerrada:
+                revisar = np.isin(self.extensiones[filas], dudosas)
+                nodos = self.nodos
+                descartes = [fila for fila in filas[revisar].tolist() if not nodos[fila]['name'].endswith(sufijo)]
+                filas = np.setdiff1d(filas, descartes, assume_unique=True)
+            else:
+                dudosas = set(dudosas)
+                filas = [
+                    fila for fila in filas
+                    if self.extensiones[fila] not in dudosas or self.nodos[fila]['name'].endswith(sufijo)
+                ]
+
+        id_archivo = self.valores_tipo.buscar('file')
+        if np is not None and self._cerrada:
+            archivos = filas[self.tipos[filas] == id_archivo]
+            tamanos = self.tamanos[archivos]
+            tramos = np.bincount(np.searchsorted(TRAMOS_TAMANO, tamanos, side='right'), minlength=len(NOMBRES_TRAMOS))
+            extensiones = np.bincount(self.extensiones[archivos], minlength=len(self.valores_extension.valores))
+            por_extension = {
+                self.valores_extension.valores[i] or "sin_extension": int(extensiones[i])
+                for i in np.flatnonzero(extensiones)
+            }
+            meses, cuentas = np.unique(self.meses[archivos], return_counts=True)
+            por_mes = dict(zip(meses.tolist(), cuentas.tolist()))
+            total, n_archivos, tamano_total = len(filas), len(archivos), int(tamanos.sum())
+            tramos = tramos.tolist()
+        else:
+            archivos = [fila for fila in filas if self.tipos[fila] == id_archivo]
+            tramos = [0] * len(NOMBRES_TRAMOS)
+            por_extension, por_mes = {}, {}
+            tamano_total = 0
+            for fila in archivos:
+                tamano = self.tamanos[fila]
+                tamano_total += tamano
+                tramos[sum(tamano >= limite for limite in TRAMOS_TAMANO)] += 1
+                extension = self.valores_extension.valores[self.extensiones[fila]] or "sin_extension"
+                por_extension[extension] = por_extension.get(extension, 0) + 1
+                por_mes[self.meses[fila]] = por_mes.get(self.meses[fila], 0) + 1
+            total, n_archivos = len(filas), len(archivos)
+
+        return {
+            "total_elementos": total,
+            "archivos": n_archivos,
+            "directorios": total - n_archivos,
+            "tamano_total": tamano_total,
+            "por_extension": por_extension,
+            "por_mes": {f"{mes // 12:04d}-{mes % 12 + 1:02d}": n for mes, n in por_mes.items() if mes >= 0},
+            "distribucion_tamanos": dict(zip(NOMBRES_TRAMOS, tramos))
+        }
+
+
+def tabla_metadatos(ruta_json: str) -> TablaMetadatos:
+    """Tabla de metadatos de la estructura de ruta_json, cacheada junto a ella."""
+    return derivado(ruta_json, NOMBRE_TABLA, TablaMetadatos.desde_estructura)
@@ -0,0 +1,664 @@
+import bisect
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from cache_estructura import cargar_estructura, edicion_estructuras, guardar_estructura, marcar_derivados_obsoletos
+from rastreador import es_directorio, explorar_arbol, metadatos_basicos
+from resumenes import recalcular_ancestros, tiene_resumenes
+
+# Segundos sin eventos antes de escribir los cambios acumulados en disco
+DEBOUNCE_SEGUNDOS = 2.0
+# Aunque sigan llegando eventos, no se retrasa la escritura más de DEBOUNCE * este factor
+FACTOR_ESPERA_MAXIMA = 10
+# Segundos entre barridos en el modo de sondeo por mtime
+INTERVALO_SONDEO = 5.0
+# Segundos que se espera el IN_MOVED_TO de un IN_MOVED_FROM (puede llegar en
+# otra lectura) antes de tratarlo como algo que ha salido del árbol vigilado
+ESPERA_MOVIDOS = 0.5
+
+# Constantes de inotify (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+# IN_CLOSE_WRITE e IN_ATTRIB avisan de cambios de contenido, fecha o permisos (para los
+# metadatos y resúmenes); IN_MODIFY no se usa porque llega en cada write()
+MASCARA_INOTIFY = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+                   | IN_CLOSE_WRITE | IN_ATTRIB | IN_ONLYDIR)
+_CABECERA_EVENTO = struct.Struct('iIII')
+
+
+def inotify_disponible() -> bool:
+    return sys.platform.startswith('linux') and ctypes.util.find_library('c') is not None
+
+
+class _Inotify:
+    """
+    Envoltorio mínimo de inotify con ctypes. Mantiene la correspondencia entre
+    descriptores de vigilancia (wd) y paths de directorio.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._lock = threading.Lock()
+        self._paths: Dict[int, str] = {}
+        self._wds: Dict[str, int] = {}
+
+    def vigilar(self, path: str):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), MASCARA_INOTIFY)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        with self._lock:
+            # Un directorio renombrado conserva su wd: solo cambia el path asociado
+            anterior = self._paths.get(wd)
+            if anterior is not None and self._wds.get(anterior) == wd:
+                del self._wds[anterior]
+            self._paths[wd] = path
+            self._wds[path] = wd
+
+    def olvidar(self, path: str):
+        with self._lock:
+            wd = self._wds.pop(path, None)
+            if wd is not None and self._paths.get(wd) == path:
+                del self._paths[wd]
+
+    def reemplazar(self, paths: List[str]):
+        """Deja de vigilar todo y vigila los paths indicados."""
+        with self._lock:
+            wds = list(self._paths)
+            self._paths.clear()
+            self._wds.clear()
+        for wd in wds:
+            self._libc.inotify_rm_watch(self.fd, wd)
+        for path in paths:
+            self.vigilar(path)
+
+    def renombrar(self, origen: str, destino: str):
+        """Actualiza los paths vigilados bajo un directorio que se ha movido."""
+        prefijo = origen + os.sep
+        with self._lock:
+            for wd, path in list(self._paths.items()):
+                if path == origen or path.startswith(prefijo):
+                    nuevo = destino + path[len(origen):]
+                    self._paths[wd] = nuevo
+                    if self._wds.get(path) == wd:
+                        del self._wds[path]
+                    self._wds[nuevo] = wd
+
+    def leer(self, timeout: float) -> List[Tuple[int, int, int, str]]:
+        """
+        Espera eventos hasta 'timeout' segundos.
+
+        Returns:
+            list: Tuplas (wd, mascara, cookie, nombre)
+        """
+        listos, _, _ = select.select([self.fd], [], [], timeout)
+        if not listos:
+            return []
+        try:
+            datos = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        eventos = []
+        posicion = 0
+        while posicion + _CABECERA_EVENTO.size <= len(datos):
+            wd, mascara, cookie, longitud = _CABECERA_EVENTO.unpack_from(datos, posicion)
+            posicion += _CABECERA_EVENTO.size
+            nombre = os.fsdecode(datos[posicion:posicion + longitud].rstrip(b'\0'))
+            posicion += longitud
+            eventos.append((wd, mascara, cookie, nombre))
+        return eventos
+
+    def path(self, wd: int, mascara: int) -> Optional[str]:
+        """
+        Path actual del directorio de un wd. Se resuelve al procesar cada evento
+        (no al leer el lote) para que los renombrados anteriores ya cuenten.
+        """
+        with self._lock:
+            path = self._paths.get(wd)
+            if mascara & IN_IGNORED:
+                self._paths.pop(wd, None)
+                if path is not None and self._wds.get(path) == wd:
+                    del self._wds[path]
+        return path
+
+    def cerrar(self):
+        os.close(self.fd)
+
+
+class Vigilante:
+    """
+    Mantiene al día en memoria la estructura de un estructura.json a partir de
+    los cambios del sistema de archivos (creaciones, borrados y renombrados) y
+    la escribe en disco agrupando los cambios tras un intervalo sin eventos.
+
+    Usa inotify en Linux y, si no está disponible (u otro sistema), sondea el
+    mtime de los directorios conocidos: solo se vuelven a listar los que han
+    cambiado. Las descripciones se conservan, también al renombrar.
+
+    Los cambios se aplican sobre la estructura cacheada por cache_estructura, de
+    modo que las herramientas de consulta los ven antes incluso de escribirse.
+    Cada lote se aplica con edicion_estructuras tomado: espera a que terminen
+    las herramientas que la están recorriendo y las demás esperan a que acabe.
+    """
+
+    def __init__(
+        self,
+        ruta_json: str,
+        debounce: float = DEBOUNCE_SEGUNDOS,
+        intervalo_sondeo: float = INTERVALO_SONDEO,
+        modo: Optional[str] = None
+    ):
+        """
+        Args:
+            ruta_json: Archivo de estructura a mantener
+            debounce: Segundos sin eventos antes de escribir a disco
+            intervalo_sondeo: Segundos entre barridos en el modo 'sondeo'
+            modo: 'inotify', 'sondeo' o None para elegir automáticamente
+        """
+        self.ruta_json = ruta_json
+        self.debounce = debounce
+        self.intervalo_sondeo = intervalo_sondeo
+        self.modo = modo or ('inotify' if inotify_disponible() else 'sondeo')
+        self._cola: queue.Queue = queue.Queue()
+        self._parar = threading.Event()
+        self._hilos: List[threading.Thread] = []
+        self._inotify: Optional[_Inotify] = None
+        # Solo el hilo aplicador modifica la estructura; el lock la protege de detener()
+        # y edicion_estructuras de las herramientas que la recorren
+        self._lock = threading.RLock()
+        self._estructura: Optional[Dict] = None
+        self._directorios: Dict[str, Dict] = {}
+        self._firmas: Dict[str, Tuple[int, int]] = {}
+        # Directorios cuyos hijos han cambiado desde la última anotación (para los resúmenes)
+        self._tocados: Set[str] = set()
+        self._primer_cambio: Optional[float] = None
+        self._ultimo_cambio = 0.0
+        self._proximo_sondeo = 0.0
+        self.eventos_recibidos = 0
+        self.cambios_aplicados = 0
+        self.guardados = 0
+        self.ultimo_guardado: Optional[str] = None
+        self.ultimo_error: Optional[str] = None
+
+    def iniciar(self) -> 'Vigilante':
+        if self.modo == 'inotify':
+            try:
+                self._inotify = _Inotify()
+            except OSError as e:
+                self.ultimo_error = f"inotify no disponible ({e}); se usa sondeo"
+                self.modo = 'sondeo'
+        aplicador = threading.Thread(target=self._bucle_aplicar, name='vigilante_aplicar', daemon=True)
+        self._hilos.append(aplicador)
+        aplicador.start()
+        return self
+
+    def detener(self, timeout: float = 5.0):
+        """Para los hilos y escribe los cambios pendientes."""
+        self._parar.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        if self._inotify is not None:
+            self._inotify.cerrar()
+            self._inotify = None
+
+    def estado(self) -> Dict:
+        return {
+            'ruta_json': self.ruta_json,
+            'modo': self.modo,
+            'activo': not self._parar.is_set() and any(h.is_alive() for h in self._hilos),
+            'directorios_vigilados': len(self._directorios),
+            'eventos_recibidos': self.eventos_recibidos,
+            'cambios_aplicados': self.cambios_aplicados,
+            'cambios_pendientes': self._primer_cambio is not None,
+            'guardados': self.guardados,
+            'ultimo_guardado': self.ultimo_guardado,
+            'ultimo_error': self.ultimo_error
+        }
+
+    def _bucle_inotify(self):
+        """Lee eventos de inotify y los encola como operaciones sobre paths."""
+        # IN_MOVED_FROM aún sin su IN_MOVED_TO: cookie -> (path, es_dir, momento)
+        movidos: Dict[int, Tuple[str, bool, float]] = {}
+        while not self._parar.is_set():
+            try:
+                eventos = self._inotify.leer(0.5)
+            except (OSError, ValueError, AttributeError):
+                break
+            ahora = time.monotonic()
+            operaciones: List[Tuple] = []
+            for wd, mascara, cookie, nombre in eventos:
+                if mascara & IN_Q_OVERFLOW:
+                    # Se han perdido eventos: la resincronización también cubre los movidos
+                    movidos.clear()
+                    operaciones.append(('resincronizar',))
+                    continue
+                directorio = self._inotify.path(wd, mascara)
+                if directorio is None or not nombre:
+                    continue
+                path = os.path.join(directorio, nombre)
+                es_dir = bool(mascara & IN_ISDIR)
+                if mascara & (IN_CREATE | IN_MOVED_TO) and not (mascara & IN_MOVED_TO and cookie in movidos):
+                    # El directorio se vigila ya, antes de que se creen cosas dentro
+                    if es_dir:
+                        self._vigilar(path)
+                    operaciones.append(('crear', path))
+                elif mascara & IN_MOVED_TO:
+                    origen, origen_es_dir, _ = movidos.pop(cookie)
+                    if origen_es_dir:
+                        self._inotify.renombrar(origen, path)
+                    operaciones.append(('renombrar', origen, path))
+                elif mascara & IN_MOVED_FROM:
+                    movidos[cookie] = (path, es_dir, ahora)
+                elif mascara & IN_DELETE:
+                    operaciones.append(('eliminar', path))
+                elif mascara & (IN_CLOSE_WRITE | IN_ATTRIB):
+                    operaciones.append(('actualizar', path))
+            # Un MOVED_FROM sin su MOVED_TO pasado ESPERA_MOVIDOS es algo que sale del
+            # árbol. Si entretanto se ha creado otra cosa con su nombre, _eliminar no la toca
+            for cookie, (path, _, momento) in list(movidos.items()):
+                if ahora - momento >= ESPERA_MOVIDOS:
+                    del movidos[cookie]
+                    operaciones.append(('eliminar', path))
+            for operacion in operaciones:
+                self._cola.put(operacion)
+
+    def _bucle_aplicar(self):
+        try:
+            with self._lock, edicion_estructuras():
+                self._registrar_todo()
+            if self.modo == 'inotify':
+                lector = threading.Thread(target=self._bucle_inotify, name='vigilante_inotify', daemon=True)
+                self._hilos.append(lector)
+                lector.start()
+            # Al arrancar se concilia una vez la estructura con el disco
+            self._barrer()
+        except Exception as e:
+            self.ultimo_error = f"Error al iniciar la vigilancia: {e}"
+            self._parar.set()
+            return
+
+        while not self._parar.is_set():
+            lote = []
+            try:
+                lote.append(self._cola.get(timeout=0.2))
+                while True:
+                    lote.append(self._cola.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                if lote:
+                    self._aplicar(lote)
+                if self.modo == 'sondeo' and time.monotonic() >= self._proximo_sondeo:
+                    self._barrer()
+                self._guardar_si_toca()
+            except Exception as e:
+                self.ultimo_error = f"{type(e).__name__}: {e}"
+        self._guardar()
+
+    def _estructura_actual(self) -> int:
+        """
+        Pasa a la estructura cacheada si otro proceso o herramienta la ha
+        reemplazado: se vuelve a registrar y se concilia entera con el disco,
+        porque los cambios aún sin guardar se aplicaron sobre la anterior (y con
+        inotify no hay barridos periódicos que los recuperen).
+
+        Returns:
+            int: Cambios aplicados al conciliar (sin anotar)
+        """
+        estructura = cargar_estructura(self.ruta_json)
+        if estructura is self._estructura:
+            return 0
+        self._registrar_todo(estructura)
+        return self._barrer(aplicar=False)
+
+    def _registrar_todo(self, estructura: Optional[Dict] = None):
+        self._estructura = estructura or cargar_estructura(self.ruta_json)
+        self._directorios = {}
+        self._firmas = {}
+        self._tocados = set()
+        self._primer_cambio = None
+        self._registrar(self._estructura, vigilar=False)
+        if self._inotify is not None:
+            try:
+                self._inotify.reemplazar(list(self._directorios))
+            except OSError as e:
+                # Sin descriptores suficientes (max_user_watches) se pasa a sondeo
+                self.ultimo_error = f"inotify: {e}; se usa sondeo"
+                self.modo = 'sondeo'
+
+    def _registrar(self, nodo: Dict, vigilar: bool = True):
+        pila = [nodo]
+        while pila:
+            actual = pila.pop()
+            if actual.get('type') != 'directory':
+                continue
+            path = actual.get('full_path')
+            if path:
+                self._directorios[path] = actual
+                if vigilar:
+                    self._vigilar(path)
+            pila.extend(actual.get('children', []))
+
+    def _desregistrar(self, nodo: Dict):
+        pila = [nodo]
+        while pila:
+            actual = pila.pop()
+            if actual.get('type') != 'directory':
+                continue
+            path = actual.get('full_path')
+            self._directorios.pop(path, None)
+            self._firmas.pop(path, None)
+            if self._inotify is not None:
+                self._inotify.olvidar(path)
+            pila.extend(actual.get('children', []))
+
+    def _vigilar(self, path: str):
+        if self._inotify is None or self.modo != 'inotify':
+            return
+        try:
+            self._inotify.vigilar(path)
+        except FileNotFoundError:
+            # Creado y borrado antes de poder vigilarlo: ya llegará su evento
+            pass
+        except OSError as e:
+            self.ultimo_error = f"No se pudo vigilar {path}: {e}"
+
+    @staticmethod
+    def _posicion(hijos: List[Dict], nombre: str) -> Tuple[int, bool]:
+        """Posición del hijo 'nombre' en una lista ordenada por nombre, y si existe."""
+        nombres = [h.get('name', '') for h in hijos]
+        indice = bisect.bisect_left(nombres, nombre)
+        return indice, indice < len(nombres) and nombres[indice] == nombre
+
+    def _quitar_hijo(self, padre: Dict, nombre: str) -> Optional[Dict]:
+        hijos = padre.setdefault('children', [])
+        indice, existe = self._posicion(hijos, nombre)
+        if not existe:
+            # Estructuras antiguas pueden no estar ordenadas
+            indice = next((i for i, h in enumerate(hijos) if h.get('name') == nombre), None)
+            if indice is None:
+                return None
+        nodo = hijos.pop(indice)
+        self._desregistrar(nodo)
+        self._tocados.add(padre.get('full_path'))
+        return nodo
+
+    def _insertar_hijo(self, padre: Dict, nodo: Dict):
+        hijos = padre.setdefault('children', [])
+        indice, _ = self._posicion(hijos, nodo['name'])
+        hijos.insert(indice, nodo)
+        self._registrar(nodo)
+        self._tocados.add(padre.get('full_path'))
+
+    def _con_metadatos(self) -> bool:
+        """Si la estructura se rastreó con metadatos y resúmenes, hay que mantenerlos."""
+        return self._estructura is not None and tiene_resumenes(self._estructura)
+
+    def _refrescar_metadatos(self, nodo: Dict, stat: Optional[os.stat_result] = None) -> bool:
+        """
+        Pone al día los campos de stat de 'metadata' (sin tocar los añadidos por
+        el usuario, como la huella) si han cambiado.
+
+        Returns:
+            bool: Si ha cambiado algo
+        """
+        try:
+            stat = stat or os.stat(nodo['full_path'])
+        except (OSError, KeyError):
+            return False
+        nuevos = metadatos_basicos(stat)
+        metadata = nodo.setdefault('metadata', {})
+        if all(metadata.get(clave) == valor for clave, valor in nuevos.items() if clave != 'ultima_actualizacion'):
+            return False
+        metadata.update(nuevos)
+        return True
+
+    def _crear(self, path: str) -> bool:
+        padre = self._directorios.get(os.path.dirname(path))
+        nombre = os.path.basename(path)
+        if padre is None or nombre.startswith('.'):
+            return False
+        es_dir = os.path.isdir(path)
+        if not es_dir and not os.path.lexists(path):
+            return False
+        indice, existe = self._posicion(padre.get('children', []), nombre)
+        if existe:
+            if (padre['children'][indice].get('type') == 'directory') == es_dir:
+                return False
+            self._quitar_hijo(padre, nombre)
+        if es_dir:
+            nodo = explorar_arbol(path, max_hilos=1, metadatos=self._con_metadatos())
+        else:
+            nodo = {'name': nombre, 'type': 'file', 'full_path': os.path.abspath(path)}
+            if self._con_metadatos():
+                self._refrescar_metadatos(nodo)
+        self._insertar_hijo(padre, nodo)
+        return True
+
+    def _actualizar(self, path: str) -> bool:
+        """Cambio de contenido, fecha o permisos de un nodo ya conocido: solo afecta a sus metadatos."""
+        padre = self._directorios.get(os.path.dirname(path))
+        if padre is None or not self._con_metadatos():
+            return False
+        indice, existe = self._posicion(padre.get('children', []), os.path.basename(path))
+        if not existe or not self._refrescar_metadatos(padre['children'][indice]):
+            return False
+        self._tocados.add(padre.get('full_path'))
+        return True
+
+    def _eliminar(self, path: str) -> bool:
+        padre = self._directorios.get(os.path.dirname(path))
+        if padre is None or os.path.lexists(path):
+            return False
+        return self._quitar_hijo(padre, os.path.basename(path)) is not None
+
+    def _renombrar(self, origen: str, destino: str) -> bool:
+        padre_origen = self._directorios.get(os.path.dirname(origen))
+        padre_destino = self._directorios.get(os.path.dirname(destino))
+        nombre = os.path.basename(destino)
+        nodo = self._quitar_hijo(padre_origen, os.path.basename(origen)) if padre_origen else None
+        if nodo is None:
+            return self._crear(destino)
+        if padre_destino is None or nombre.startswith('.'):
+            return True
+
+        # Se conserva el nodo (y con él las descripciones); solo cambian nombre y rutas
+        nodo['name'] = nombre
+        pila = [nodo]
+        while pila:
+            actual = pila.pop()
+            full_path = actual.get('full_path', '')
+            if full_path == origen or full_path.startswith(origen + os.sep):
+                actual['full_path'] = destino + full_path[len(origen):]
+            pila.extend(actual.get('children', []))
+        self._quitar_hijo(padre_destino, nombre)
+        self._insertar_hijo(padre_destino, nodo)
+        return True
+
+    def _aplicar(self, operaciones: List[Tuple]):
+        with self._lock, edicion_estructuras():
+            cambios = self._estructura_actual()
+            for operacion in operaciones:
+                self.eventos_recibidos += 1
+                tipo = operacion[0]
+                if tipo == 'crear':
+                    cambios += self._crear(operacion[1])
+                elif tipo == 'eliminar':
+                    cambios += self._eliminar(operacion[1])
+                elif tipo == 'renombrar':
+                    cambios += self._renombrar(operacion[1], operacion[2])
+                elif tipo == 'actualizar':
+                    cambios += self._actualizar(operacion[1])
+                elif tipo == 'resincronizar':
+                    self._firmas.clear()
+                    cambios += self._barrer(aplicar=False)
+            self._anotar_cambios(cambios)
+
+    def _anotar_cambios(self, cambios: int):
+        tocados, self._tocados = self._tocados, set()
+        if not cambios:
+            return
+        if self._con_metadatos():
+            # Añadir o quitar hijos cambia también el mtime de su directorio
+            for path in tocados:
+                if path in self._directorios:
+                    self._refrescar_metadatos(self._directorios[path])
+            recalcular_ancestros(self._directorios, tocados)
+        self.cambios_aplicados += cambios
+        ahora = time.monotonic()
+        self._ultimo_cambio = ahora
+        if self._primer_cambio is None:
+            self._primer_cambio = ahora
+        marcar_derivados_obsoletos(self.ruta_json)
+
+    def _barrer(self, aplicar: bool = True) -> int:
+        """
+        Compara con el disco los directorios cuyo mtime o inodo ha cambiado desde
+        el último barrido (todos en el primero) y aplica las diferencias. Los
+        directorios que desaparecen en un sitio y aparecen en otro con el mismo
+        inodo se tratan como renombrados.
+
+        Si la estructura tiene metadatos, en el modo 'sondeo' (y con inotify la
+        primera vez que se ve cada directorio) se compara además el stat de cada
+        archivo: editar un archivo en sitio no cambia el mtime de su directorio.
+
+        Returns:
+            int: Cambios aplicados
+        """
+        if aplicar:
+            with self._lock, edicion_estructuras():
+                cambios = self._estructura_actual() + self._barrer(aplicar=False)
+                self._anotar_cambios(cambios)
+                return cambios
+
+        self._proximo_sondeo = time.monotonic() + self.intervalo_sondeo
+        creados: List[str] = []
+        eliminados: List[str] = []
+        inodos_eliminados: Dict[int, str] = {}
+        con_metadatos = self._con_metadatos()
+        cambios = 0
+        for path, nodo in list(self._directorios.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            firma = (stat.st_mtime_ns, stat.st_ino)
+            anterior = self._firmas.get(path)
+            self._firmas[path] = firma
+            if con_metadatos and (self.modo == 'sondeo' or anterior is None):
+                actualizados = sum(
+                    self._refrescar_metadatos(hijo) for hijo in nodo.get('children', []) if hijo.get('type') != 'directory'
+                )
+                if actualizados:
+                    self._tocados.add(path)
+                    cambios += actualizados
+            if anterior == firma:
+                continue
+            try:
+                with os.scandir(path) as iterador:
+                    en_disco = {e.name: es_directorio(e)[0] for e in iterador if not e.name.startswith('.')}
+            except OSError:
+                continue
+            en_memoria = {h.get('name'): h for h in nodo.get('children', [])}
+            for nombre, hijo in en_memoria.items():
+                es_dir = hijo.get('type') == 'directory'
+                if en_disco.get(nombre) != es_dir:
+                    ruta_hijo = os.path.join(path, nombre)
+                    eliminados.append(ruta_hijo)
+                    if es_dir and ruta_hijo in self._firmas:
+                        inodos_eliminados[self._firmas[ruta_hijo][1]] = ruta_hijo
+            for nombre, es_dir in en_disco.items():
+                hijo = en_memoria.get(nombre)
+                if hijo is None or (hijo.get('type') == 'directory') != es_dir:
+                    creados.append(os.path.join(path, nombre))
+
+        renombrados = set()
+        for path in creados:
+            origen = None
+            if inodos_eliminados:
+                try:
+                    origen = inodos_eliminados.pop(os.stat(path).st_ino, None)
+                except OSError:
+                    pass
+            if origen is not None:
+                renombrados.add(origen)
+                cambios += self._renombrar(origen, path)
+            else:
+                cambios += self._crear(path)
+        for path in eliminados:
+            if path not in renombrados:
+                cambios += self._eliminar(path)
+        return cambios
+
+    def _guardar_si_toca(self):
+        if self._primer_cambio is None:
+            return
+        ahora = time.monotonic()
+        if (ahora - self._ultimo_cambio >= self.debounce
+                or ahora - self._primer_cambio >= self.debounce * FACTOR_ESPERA_MAXIMA):
+            self._guardar()
+
+    def _guardar(self):
+        with self._lock, edicion_estructuras():
+            if self._primer_cambio is None or self._estructura is None:
+                return
+            # Si la estructura se ha reemplazado mientras tanto, los cambios se rehacen sobre la nueva
+            self._anotar_cambios(self._estructura_actual())
+            if self._primer_cambio is None:
+                return
+            guardar_estructura(self.ruta_json, self._estructura)
+            self._primer_cambio = None
+            self.guardados += 1
+            self.ultimo_guardado = datetime.now().isoformat()
+
+
+_VIGILANTES: Dict[str, Vigilante] = {}
+_LOCK_VIGILANTES = threading.Lock()
+
+
+def iniciar_vigilancia(
+    ruta_json: str,
+    debounce: float = DEBOUNCE_SEGUNDOS,
+    intervalo_sondeo: float = INTERVALO_SONDEO,
+    modo: Optional[str] = None
+) -> Vigilante:
+    """Arranca (o devuelve, si ya existe) el vigilante de un archivo de estructura."""
+    clave = os.path.abspath(ruta_json)
+    with _LOCK_VIGILANTES:
+        vigilante = _VIGILANTES.get(clave)
+        if vigilante is not None and vigilante.estado()['activo']:
+            return vigilante
+        vigilante = Vigilante(clave, debounce=debounce, intervalo_sondeo=intervalo_sondeo, modo=modo).iniciar()
+        _VIGILANTES[clave] = vigilante
+        return vigilante
+
+
+def detener_vigilancia(ruta_json: str) -> Optional[Dict]:
+    """Detiene el vigilante de un archivo (escribiendo lo pendiente) y devuelve su último estado."""
+    with _LOCK_VIGILANTES:
+        vigilante = _VIGILANTES.pop(os.path.abspath(ruta_json), None)
+    if vigilante is None:
+        return None
+    vigilante.detener()
+    return vigilante.estado()